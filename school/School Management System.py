@@ -1,163 +1,34 @@
 import tkinter as tk
-from tkinter import ttk, messagebox, simpledialog
+from tkinter import ttk, messagebox, simpledialog, filedialog
 import sqlite3
 import datetime
 import os
-import statistics
-
-DB_PATH = "school.db"
-
-
-def get_conn():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-
-def init_db():
-    created = not os.path.exists(DB_PATH)
-    conn = get_conn()
-    cur = conn.cursor()
-
-    # users table (FIXED: Changed PRIMARY PRIMARY KEY to PRIMARY KEY)
-    cur.execute(
-        """
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY,
-        username TEXT UNIQUE NOT NULL,
-        password TEXT NOT NULL,
-        role TEXT NOT NULL
-    )
-    """
-    )
-
-    # students table
-    cur.execute(
-        """
-    CREATE TABLE IF NOT EXISTS students (
-        id INTEGER PRIMARY KEY,
-        first_name TEXT,
-        last_name TEXT,
-        dob TEXT,
-        admission_no TEXT UNIQUE,
-        class TEXT,
-        section TEXT,
-        guardian_name TEXT,
-        phone TEXT,
-        created_at TEXT
-    )
-    """
-    )
-
-    # attendance table
-    cur.execute(
-        """
-    CREATE TABLE IF NOT EXISTS attendance (
-        id INTEGER PRIMARY KEY,
-        student_id INTEGER,
-        date TEXT,
-        status TEXT,
-        marked_by INTEGER,
-        FOREIGN KEY(student_id) REFERENCES students(id)
-    )
-    """
-    )
-
-    # fees/payments tables
-    cur.execute(
-        """
-    CREATE TABLE IF NOT EXISTS fees (
-        id INTEGER PRIMARY KEY,
-        student_id INTEGER,
-        description TEXT,
-        amount REAL,
-        due_date TEXT,
-        status TEXT,
-        created_at TEXT,
-        FOREIGN KEY(student_id) REFERENCES students(id)
-    )
-    """
-    )
-
-    cur.execute(
-        """
-    CREATE TABLE IF NOT EXISTS payments (
-        id INTEGER PRIMARY KEY,
-        fee_id INTEGER,
-        student_id INTEGER,
-        amount REAL,
-        method TEXT,
-        tx_ref TEXT,
-        paid_at TEXT,
-        FOREIGN KEY(fee_id) REFERENCES fees(id),
-        FOREIGN KEY(student_id) REFERENCES students(id)
-    )
-    """
-    )
-
-    # exams placeholder (old structure)
-    cur.execute(
-        """
-    CREATE TABLE IF NOT EXISTS exams (
-        id INTEGER PRIMARY KEY,
-        title TEXT,
-        start_date TEXT,
-        end_date TEXT
-    )
-    """
-    )
-
-    # Exam Schedule (detailed schedule)
-    cur.execute(
-        """
-    CREATE TABLE IF NOT EXISTS exam_schedule (
-        id INTEGER PRIMARY KEY,
-        exam_title TEXT NOT NULL,
-        class TEXT,
-        subject TEXT,
-        exam_date TEXT,
-        start_time TEXT,
-        end_time TEXT,
-        room TEXT
-    )
-    """
-    )
-
-    conn.commit()
-
-    # insert default admin if none exists
-    cur.execute("SELECT COUNT(*) FROM users")
-    if cur.fetchone()[0] == 0:
-        cur.execute(
-            "INSERT INTO users (username, password, role) VALUES (?, ?, ?)",
-            ("admin", "admin", "admin"),
-        )
-        conn.commit()
-
-    # insert sample students if none
-    cur.execute("SELECT COUNT(*) FROM students")
-    if cur.fetchone()[0] == 0:
-        now = datetime.datetime.now().isoformat()
-        sample = [
-            ("Aisha", "Khan", "2012-05-11", "ADM001", "Grade 1", "A", "Mrs Khan", "9999999999", now),
-            ("Ravi", "Patel", "2011-09-20", "ADM002", "Grade 2", "B", "Mr Patel", "8888888888", now),
-            ("Maya", "Singh", "2010-03-05", "ADM003", "Grade 3", "A", "Mrs Singh", "7777777777", now),
-        ]
-        cur.executemany(
-            "INSERT INTO students (first_name,last_name,dob,admission_no,class,section,guardian_name,phone,created_at) VALUES (?,?,?,?,?,?,?,?,?)",
-            sample,
-        )
-        conn.commit()
-
-    conn.close()
-
-
-def fmt_date(dt=None):
-    if dt is None:
-        dt = datetime.date.today()
-    if isinstance(dt, datetime.datetime):
-        dt = dt.date()
-    return dt.isoformat()
+import sys
+import time
+
+# the headless core lives in the "school" package next to this script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from school import csvio  # noqa: E402
+from school.analytics import AttendanceMatrix  # noqa: E402
+from school.db import fmt_date  # noqa: E402
+from school.executor import QueryExecutor  # noqa: E402
+from school.instrument import QueryProfiler, from_environment  # noqa: E402
+from school.repository import Repository, validate_payment, validate_payment_filters, validate_student  # noqa: E402
+from school import archive, backup, documents, timetable  # noqa: E402
+from school.schedule import ScheduleConflict, describe  # noqa: E402
+
+# Students list: rows fetched per page, and the most rows kept in the
+# Treeview at once (older pages are dropped while scrolling).
+STUDENT_PAGE_SIZE = 100
+STUDENT_MAX_ITEMS = 300
+# payment history: rows per page (Newer/Older)
+PAYMENT_PAGE_SIZE = 100
+# only the last keystroke in a burst this close together runs a search
+SEARCH_DEBOUNCE_MS = 250
+# fold the shared WAL back into school.db every few minutes
+CHECKPOINT_MS = 5 * 60 * 1000
+# how often to check whether a scheduled backup is due (SCHOOL_BACKUP_HOURS)
+BACKUP_CHECK_MS = 10 * 60 * 1000
 
 
 class SchoolApp(tk.Tk):
@@ -169,8 +40,16 @@ class SchoolApp(tk.Tk):
         self.style.theme_use("clam")
         self.current_user = None
 
-        # initialize DB
-        init_db()
+        # initialize DB and keep one connection for the lifetime of the app
+        self.repo = Repository()
+        # SQL for the heavier views runs off the Tk thread
+        self.executor = QueryExecutor(self)
+        self._loading = {}
+        # query/view timing, off unless SCHOOL_PROFILE=1 or enabled in Settings
+        self.profiler = from_environment(self.repo)
+        self.after(CHECKPOINT_MS, self._checkpoint)
+        if backup.BACKUP_HOURS > 0:
+            self.after(BACKUP_CHECK_MS, self._scheduled_backup)
 
         # build login screen
         self._build_login()
@@ -198,13 +77,9 @@ class SchoolApp(tk.Tk):
         def on_login():
             user = username_entry.get().strip()
             pwd = password_entry.get().strip()
-            conn = get_conn()
-            cur = conn.cursor()
-            cur.execute("SELECT * FROM users WHERE username=? AND password=?", (user, pwd))
-            row = cur.fetchone()
-            conn.close()
+            row = self.repo.authenticate(user, pwd)
             if row:
-                self.current_user = dict(row)
+                self.current_user = row
                 self._build_main_ui()
             else:
                 messagebox.showerror("Login failed", "Invalid username or password")
@@ -238,113 +113,110 @@ class SchoolApp(tk.Tk):
         ]
 
         for (label, cmd) in buttons:
-            b = ttk.Button(sidebar, text=label, command=cmd)
+            b = ttk.Button(sidebar, text=label, command=lambda label=label, cmd=cmd: self._timed(f"view: {label}", cmd))
             b.pack(fill="x", padx=10, pady=6)
 
         # main content area
         self.content = ttk.Frame(container)
         self.content.pack(side="left", fill="both", expand=True, padx=10, pady=10)
+        # views built so far: name -> {"frame", "refresh", "tables", "stamp"}
+        self._views = {}
+        self._current_view = None
 
         # default view
-        self._show_dashboard()
+        self._timed("view: Dashboard", self._show_dashboard)
 
     def _show_dashboard(self):
-        self._clear_content()
-        ttk.Label(self.content, text="Dashboard", font=("Helvetica", 16, "bold")).pack(anchor="w")
+        self._show_view("dashboard", self._build_dashboard, ("students", "attendance_daily", "fees"))
 
-        frame = ttk.Frame(self.content)
+    def _build_dashboard(self, view):
+        ttk.Label(view, text="Dashboard", font=("Helvetica", 16, "bold")).pack(anchor="w")
+
+        frame = ttk.Frame(view)
         frame.pack(fill="x", pady=10)
 
         # KPIs
         kpi_frame = ttk.Frame(frame)
         kpi_frame.pack(fill="x")
-        conn = get_conn()
-        cur = conn.cursor()
-        cur.execute("SELECT COUNT(*) FROM students")
-        total_students = cur.fetchone()[0]
-        cur.execute("SELECT COUNT(*) FROM fees WHERE status='paid'")
-        paid_fees_count = cur.fetchone()[0]
-        # avg attendance (last 30 days) calculation
-        cur.execute("SELECT date, status FROM attendance WHERE date >= ?", (fmt_date(datetime.date.today() - datetime.timedelta(days=30)),))
-        rows = cur.fetchall()
-        perc = 0
-        if rows:
-            statuses = [1 if r["status"] == "Present" else 0 for r in rows]
-            perc = round(sum(statuses) / len(statuses) * 100, 1)
-        conn.close()
 
         kp = ttk.Frame(kpi_frame, relief="groove", padding=10)
         kp.pack(side="left", padx=6, pady=6)
         ttk.Label(kp, text="Total Students", font=("Helvetica", 12)).pack()
-        ttk.Label(kp, text=str(total_students), font=("Helvetica", 18, "bold")).pack()
+        total_lbl = ttk.Label(kp, text="…", font=("Helvetica", 18, "bold"))
+        total_lbl.pack()
 
         kp2 = ttk.Frame(kpi_frame, relief="groove", padding=10)
         kp2.pack(side="left", padx=6, pady=6)
         ttk.Label(kp2, text="Avg Attendance (30d)", font=("Helvetica", 12)).pack()
-        ttk.Label(kp2, text=f"{perc}%", font=("Helvetica", 18, "bold")).pack()
+        perc_lbl = ttk.Label(kp2, text="…", font=("Helvetica", 18, "bold"))
+        perc_lbl.pack()
 
         kp3 = ttk.Frame(kpi_frame, relief="groove", padding=10)
         kp3.pack(side="left", padx=6, pady=6)
         ttk.Label(kp3, text="Fees Recorded (paid rows)", font=("Helvetica", 12)).pack()
-        ttk.Label(kp3, text=str(paid_fees_count), font=("Helvetica", 18, "bold")).pack()
+        paid_lbl = ttk.Label(kp3, text="…", font=("Helvetica", 18, "bold"))
+        paid_lbl.pack()
 
         # attendance trend chart
-        trend_frame = ttk.Frame(self.content)
+        trend_frame = ttk.Frame(view)
         trend_frame.pack(fill="both", expand=True, pady=(12, 0))
         ttk.Label(trend_frame, text="Attendance Trend (last 6 months)", font=("Helvetica", 12)).pack(anchor="w")
         canvas = tk.Canvas(trend_frame, height=180, bg="white", bd=0, highlightthickness=0)
         canvas.pack(fill="x", pady=8)
 
-        # compute monthly percent from attendance table
-        conn = get_conn()
-        cur = conn.cursor()
-        today = datetime.date.today()
-        months = []
-        for i in range(5, -1, -1):  # last 6 months
-            m = (today.replace(day=1) - datetime.timedelta(days=i * 30)).replace(day=1)
-            months.append(m)
-        points = []
-        for m in months:
-            start = m.isoformat()
+        def load():
+            # runs on a worker thread: SQL only, no Tk calls
+            today = datetime.date.today()
+            months = []
+            for i in range(5, -1, -1):  # last 6 months
+                m = (today.replace(day=1) - datetime.timedelta(days=i * 30)).replace(day=1)
+                months.append(m)
             # next month start calculation
-            try:
-                next_month = (m.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
-            except Exception:
-                next_month = (m + datetime.timedelta(days=31)).replace(day=1)
-            cur.execute("SELECT status FROM attendance WHERE date >= ? AND date < ?", (start, next_month.isoformat()))
-            rs = cur.fetchall()
-            if not rs:
-                points.append(None)
-            else:
-                vals = [1 if r["status"] == "Present" else 0 for r in rs]
-                points.append(round(sum(vals) / len(vals) * 100, 1))
-        conn.close()
-
-        # draw bars on canvas
-        w = canvas.winfo_reqwidth() or 800
-        bar_w = 60
-        gap = 12
-        x = 20
-        maxh = 120
-        for idx, val in enumerate(points):
-            label_month = months[idx].strftime("%b")
-            if val is None:
-                h = 6
-                canvas.create_rectangle(x, 150 - h, x + bar_w, 150, fill="#ddd", outline="#ddd")
-                canvas.create_text(x + bar_w / 2, 160, text=label_month)
-            else:
-                h = max(6, int((val / 100.0) * maxh))
-                canvas.create_rectangle(x, 150 - h, x + bar_w, 150, fill="#60A5FA", outline="")
-                canvas.create_text(x + bar_w / 2, 150 - h - 8, text=f"{val}%", font=("", 9))
-                canvas.create_text(x + bar_w / 2, 160, text=label_month)
-            x += bar_w + gap
+            next_month = (months[-1].replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+            total_students = self.repo.count_students()
+            paid_fees_count = self.repo.count_paid_fees()
+            # avg attendance (last 30 days) calculation
+            perc = self.repo.attendance_percent(fmt_date(today - datetime.timedelta(days=30))) or 0
+            # compute monthly percent from the attendance rollup in one query
+            trend = self.repo.attendance_trend(months[0].isoformat(), next_month.isoformat())
+            points = [trend.get(m.strftime("%Y-%m")) for m in months]
+            return total_students, perc, paid_fees_count, months, points
+
+        def render(data):
+            total_students, perc, paid_fees_count, months, points = data
+            total_lbl.config(text=str(total_students))
+            perc_lbl.config(text=f"{perc}%")
+            paid_lbl.config(text=str(paid_fees_count))
+
+            # draw bars on canvas
+            canvas.delete("all")
+            bar_w = 60
+            gap = 12
+            x = 20
+            maxh = 120
+            for idx, val in enumerate(points):
+                label_month = months[idx].strftime("%b")
+                if val is None:
+                    h = 6
+                    canvas.create_rectangle(x, 150 - h, x + bar_w, 150, fill="#ddd", outline="#ddd")
+                    canvas.create_text(x + bar_w / 2, 160, text=label_month)
+                else:
+                    h = max(6, int((val / 100.0) * maxh))
+                    canvas.create_rectangle(x, 150 - h, x + bar_w, 150, fill="#60A5FA", outline="")
+                    canvas.create_text(x + bar_w / 2, 150 - h - 8, text=f"{val}%", font=("", 9))
+                    canvas.create_text(x + bar_w / 2, 160, text=label_month)
+                x += bar_w + gap
+
+        return lambda: self._run_async(canvas, load, render, key="dashboard")
 
     def _show_students(self):
-        self._clear_content()
-        header = ttk.Label(self.content, text="Students", font=("Helvetica", 16, "bold"))
+        self._show_view("students", self._build_students, ("students",))
+
+    def _build_students(self, view):
+        header = ttk.Label(view, text="Students", font=("Helvetica", 16, "bold"))
         header.pack(anchor="w")
 
-        toolbar = ttk.Frame(self.content)
+        toolbar = ttk.Frame(view)
         toolbar.pack(fill="x", pady=6)
         search_var = tk.StringVar()
 
@@ -352,59 +224,134 @@ class SchoolApp(tk.Tk):
         search_entry = ttk.Entry(toolbar, textvariable=search_var)
         search_entry.pack(side="left", padx=(0, 6))
 
-        def reload_tree(*_):
-            q = search_var.get().strip().lower()
+        # The tree only ever holds a window of at most STUDENT_MAX_ITEMS rows.
+        # Scrolling near either edge fetches the neighbouring page by id
+        # (keyset pagination) and drops rows from the opposite end. A search
+        # shows the best STUDENT_MAX_ITEMS matches instead.
+        window = {"at_start": True, "at_end": True, "busy": False, "pending": None}
+
+        def values(row):
+            return (row["admission_no"], row["first_name"], row["last_name"], row["class"], row["section"])
+
+        def top_index():
+            top = self.tree.identify_row(2)
+            return self.tree.index(top) if top else 0
+
+        def fill_tree(rows, paged=True):
             for r in self.tree.get_children():
                 self.tree.delete(r)
-            conn = get_conn()
-            cur = conn.cursor()
-            if q:
-                cur.execute(
-                    "SELECT * FROM students WHERE lower(first_name)||' '||lower(last_name) LIKE ? OR lower(admission_no) LIKE ?",
-                    (f"%{q}%", f"%{q}%"),
+            for row in rows:
+                self.tree.insert("", "end", iid=row["id"], values=values(row))
+            window.update(at_start=True, at_end=not paged or len(rows) < STUDENT_PAGE_SIZE, busy=False)
+
+        def append_page(rows):
+            window["busy"] = False
+            if not rows:
+                window["at_end"] = True
+                return
+            for row in rows:
+                self.tree.insert("", "end", iid=row["id"], values=values(row))
+            window["at_end"] = len(rows) < STUDENT_PAGE_SIZE
+            items = self.tree.get_children()
+            extra = len(items) - STUDENT_MAX_ITEMS
+            if extra > 0:
+                top = top_index()
+                self.tree.delete(*items[:extra])
+                window["at_start"] = False
+                self.tree.yview_moveto(max(0, top - extra) / STUDENT_MAX_ITEMS)
+
+        def prepend_page(rows):
+            window["busy"] = False
+            if not rows:
+                window["at_start"] = True
+                return
+            top = top_index()
+            for i, row in enumerate(rows):
+                self.tree.insert("", i, iid=row["id"], values=values(row))
+            window["at_start"] = len(rows) < STUDENT_PAGE_SIZE
+            items = self.tree.get_children()
+            extra = len(items) - STUDENT_MAX_ITEMS
+            if extra > 0:
+                self.tree.delete(*items[-extra:])
+                window["at_end"] = False
+            self.tree.yview_moveto((top + len(rows)) / len(self.tree.get_children()))
+
+        def load_more(direction):
+            items = self.tree.get_children()
+            if window["busy"] or not items:
+                return
+            window["busy"] = True
+            if direction == "down":
+                self.executor.submit(
+                    self.repo.students_page, append_page, int(items[-1]), None, STUDENT_PAGE_SIZE,
+                    key="students", owner=self.tree,
+                )
+            else:
+                self.executor.submit(
+                    self.repo.students_page, prepend_page, None, int(items[0]), STUDENT_PAGE_SIZE,
+                    key="students", owner=self.tree,
+                )
+
+        def on_scroll(first, last):
+            scrollbar.set(first, last)
+            if float(last) > 0.9 and not window["at_end"]:
+                load_more("down")
+            elif float(first) < 0.1 and not window["at_start"]:
+                load_more("up")
+
+        def reload_tree(*_):
+            if not search_entry.winfo_exists():
+                return  # debounced call after the view was closed
+            # a newer keystroke supersedes a search that is still running
+            window.update(busy=True, pending=None)
+            query = search_var.get()
+            if query.strip():
+                self._run_async(
+                    self.tree, self.repo.search_students, lambda rows: fill_tree(rows, paged=False), query, STUDENT_MAX_ITEMS,
+                    key="students",
                 )
             else:
-                cur.execute("SELECT * FROM students ORDER BY id DESC")
-            for row in cur.fetchall():
-                self.tree.insert("", "end", iid=row["id"], values=(row["admission_no"], row["first_name"], row["last_name"], row["class"], row["section"]))
-            conn.close()
+                self._run_async(self.tree, self.repo.students_page, fill_tree, None, None, STUDENT_PAGE_SIZE, key="students")
+
+        def on_key(_event):
+            if window["pending"] is not None:
+                self.after_cancel(window["pending"])
+            window["pending"] = self.after(SEARCH_DEBOUNCE_MS, reload_tree)
 
         ttk.Button(toolbar, text="Add Student", command=self._add_student_dialog).pack(side="right")
         ttk.Button(toolbar, text="Edit Selected", command=lambda: self._edit_student()).pack(side="right", padx=(0, 6))
         ttk.Button(toolbar, text="Delete Selected", command=lambda: self._delete_student()).pack(side="right", padx=(0, 6))
-        search_entry.bind("<KeyRelease>", reload_tree)
+        ttk.Button(toolbar, text="Export CSV", command=self._export_students_csv).pack(side="right", padx=(0, 6))
+        ttk.Button(toolbar, text="Import CSV", command=self._import_students_csv).pack(side="right", padx=(0, 6))
+        ttk.Button(toolbar, text="Term Documents", command=self._generate_documents).pack(side="right", padx=(0, 6))
+        search_entry.bind("<KeyRelease>", on_key)
 
         # treeview
+        list_frame = ttk.Frame(view)
+        list_frame.pack(fill="both", expand=True, pady=6)
         cols = ("admission_no", "first", "last", "class", "section")
-        self.tree = ttk.Treeview(self.content, columns=cols, show="headings", selectmode="browse", height=18)
+        self.tree = ttk.Treeview(list_frame, columns=cols, show="headings", selectmode="browse", height=18)
         self.tree.heading("admission_no", text="Adm No")
         self.tree.heading("first", text="First Name")
         self.tree.heading("last", text="Last Name")
         self.tree.heading("class", text="Class")
         self.tree.heading("section", text="Section")
-        self.tree.pack(fill="both", expand=True, pady=6)
+        scrollbar = ttk.Scrollbar(list_frame, orient="vertical", command=self.tree.yview)
+        self.tree.configure(yscrollcommand=on_scroll)
+        scrollbar.pack(side="right", fill="y")
+        self.tree.pack(side="left", fill="both", expand=True)
 
-        reload_tree()
+        return reload_tree
 
     def _add_student_dialog(self):
         dlg = StudentDialog(self, title="Add Student")
         self.wait_window(dlg.top)
         if dlg.result:
-            s = dlg.result
-            conn = get_conn()
-            cur = conn.cursor()
-            now = datetime.datetime.now().isoformat()
             try:
-                cur.execute(
-                    "INSERT INTO students (first_name,last_name,dob,admission_no,class,section,guardian_name,phone,created_at) VALUES (?,?,?,?,?,?,?,?,?)",
-                    (s["first"], s["last"], s["dob"], s["adm"], s["class"], s["section"], s["guardian"], s["phone"], now),
-                )
-                conn.commit()
+                self.repo.add_student(dlg.result)
                 messagebox.showinfo("Success", "Student added")
             except sqlite3.IntegrityError:
                 messagebox.showerror("Error", "Admission number must be unique")
-            finally:
-                conn.close()
             self._show_students()
 
     def _edit_student(self):
@@ -413,31 +360,18 @@ class SchoolApp(tk.Tk):
             messagebox.showwarning("No selection", "Select a student to edit")
             return
         sid = int(sel[0])
-        conn = get_conn()
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM students WHERE id=?", (sid,))
-        row = cur.fetchone()
-        conn.close()
+        row = self.repo.get_student(sid)
         if not row:
             messagebox.showerror("Error", "Student not found")
             return
         dlg = StudentDialog(self, title="Edit Student", payload=row)
         self.wait_window(dlg.top)
         if dlg.result:
-            s = dlg.result
-            conn = get_conn()
-            cur = conn.cursor()
             try:
-                cur.execute(
-                    "UPDATE students SET first_name=?, last_name=?, dob=?, admission_no=?, class=?, section=?, guardian_name=?, phone=? WHERE id=?",
-                    (s["first"], s["last"], s["dob"], s["adm"], s["class"], s["section"], s["guardian"], s["phone"], sid),
-                )
-                conn.commit()
+                self.repo.update_student(sid, dlg.result)
                 messagebox.showinfo("Success", "Student updated")
             except sqlite3.IntegrityError:
                 messagebox.showerror("Error", "Admission number must be unique")
-            finally:
-                conn.close()
             self._show_students()
 
     def _delete_student(self):
@@ -448,76 +382,212 @@ class SchoolApp(tk.Tk):
         if not messagebox.askyesno("Confirm", "Delete selected student? This cannot be undone."):
             return
         sid = int(sel[0])
-        conn = get_conn()
-        cur = conn.cursor()
-        cur.execute("DELETE FROM students WHERE id=?", (sid,))
-        conn.commit()
-        conn.close()
+        self.repo.delete_student(sid)
         self._show_students()
 
+    def _generate_documents(self):
+        # report cards and fee statements for every student, rendered by a
+        # process pool (school/documents.py)
+        out_dir = filedialog.askdirectory(parent=self, title="Folder for report cards and fee statements")
+        if not out_dir:
+            return
+        start, end = documents.default_term()
+        start = simpledialog.askstring("Term start (YYYY-MM-DD)", "Attendance from:", parent=self, initialvalue=start)
+        if not start:
+            return
+        end = simpledialog.askstring("Term end (YYYY-MM-DD)", "Attendance to:", parent=self, initialvalue=end)
+        if not end:
+            return
+        try:
+            start, end = (fmt_date(datetime.date.fromisoformat(d.strip())) for d in (start, end))
+        except ValueError:
+            messagebox.showerror("Invalid date", "Enter dates as YYYY-MM-DD")
+            return
+
+        # generate() reports progress from the worker thread, which must not
+        # touch Tk: it only records the count and show() polls it via after()
+        written = [0, 0]
+
+        def progress(n, total):
+            written[:] = n, total
+
+        def run():
+            return documents.generate(self.repo, out_dir, start, end, progress=progress)
+
+        def show():
+            busy = self._loading.get("documents")
+            if busy is not None and busy.winfo_exists():
+                if written[1]:
+                    busy.configure(text=f"Writing documents… {written[0]}/{written[1]} students")
+                self.after(250, show)
+
+        def done(result):
+            students, files = result
+            messagebox.showinfo("Term documents", f"Wrote {files} documents for {students} students to\n{out_dir}")
+
+        self._run_async(self.content, run, done, key="documents")
+        show()
+
+    def _import_students_csv(self):
+        path = filedialog.askopenfilename(parent=self, title="Import students", filetypes=[("CSV files", "*.csv"), ("All files", "*.*")])
+        if not path:
+            return
+        upsert = messagebox.askyesnocancel("Import", "Update students whose admission number already exists?\n(No = skip and report them)")
+        if upsert is None:
+            return
+
+        def run():
+            # utf-8-sig also accepts files saved by Excel with a BOM
+            with open(path, newline="", encoding="utf-8-sig") as f:
+                return csvio.import_students(self.repo, f, upsert=upsert)
+
+        def done(report):
+            msg = report.summary()
+            if report.errors:
+                shown = "\n".join(f"line {line}: {adm or '(blank)'} - {err}" for line, adm, err in report.errors[:20])
+                more = len(report.errors) - 20
+                msg += "\n\n" + shown + (f"\n… and {more} more" if more > 0 else "")
+            messagebox.showinfo("Import finished", msg)
+            self._show_students()
+
+        self._run_async(self.content, run, done, key="students-import")
+
+    def _export_students_csv(self):
+        path = filedialog.asksaveasfilename(parent=self, title="Export students", defaultextension=".csv", filetypes=[("CSV files", "*.csv")])
+        if not path:
+            return
+
+        def run():
+            with open(path, "w", newline="", encoding="utf-8") as f:
+                return csvio.export_students(self.repo, f)
+
+        self._run_async(self.content, run, lambda n: messagebox.showinfo("Export finished", f"Exported {n} students"), key="students-export")
+
     def _show_attendance(self):
-        self._clear_content()
-        ttk.Label(self.content, text="Attendance", font=("Helvetica", 16, "bold")).pack(anchor="w")
-        toolbar = ttk.Frame(self.content)
+        self._show_view("attendance", self._build_attendance, ("students", "attendance"))
+
+    def _build_attendance(self, view):
+        ttk.Label(view, text="Attendance", font=("Helvetica", 16, "bold")).pack(anchor="w")
+        toolbar = ttk.Frame(view)
         toolbar.pack(fill="x", pady=6)
         cls_var = tk.StringVar(value="All Classes")
+        date_var = tk.StringVar(value=fmt_date())
         ttk.Label(toolbar, text="Class:").pack(side="left")
         ttk.Entry(toolbar, textvariable=cls_var, width=20).pack(side="left", padx=6)
+        ttk.Label(toolbar, text="Date:").pack(side="left")
+        ttk.Entry(toolbar, textvariable=date_var, width=12).pack(side="left", padx=6)
         ttk.Button(toolbar, text="Load Students", command=lambda: load_students_for_attendance(cls_var.get())).pack(side="left", padx=6)
+        ttk.Label(toolbar, text="Blue = not saved yet", foreground="#1D4ED8").pack(side="right")
 
-        frame = ttk.Frame(self.content)
+        frame = ttk.Frame(view)
         frame.pack(fill="both", expand=True, pady=8)
 
-        tree = ttk.Treeview(frame, columns=("name", "class", "status"), show="headings", height=18)
+        # extended selection: mark several students at once (shift/ctrl-click)
+        tree = ttk.Treeview(frame, columns=("name", "class", "status"), show="headings", selectmode="extended", height=18)
         tree.heading("name", text="Student")
         tree.heading("class", text="Class")
         tree.heading("status", text="Status")
+        tree.tag_configure("pending", foreground="#1D4ED8")
         tree.pack(side="left", fill="both", expand=True)
 
         # controls
         ctrl = ttk.Frame(frame)
         ctrl.pack(side="left", fill="y", padx=8)
+        ttk.Button(ctrl, text="All Present", command=lambda: stage(tree.get_children(), "Present")).pack(fill="x", pady=4)
         ttk.Button(ctrl, text="Present", command=lambda: mark_selected("Present")).pack(fill="x", pady=4)
         ttk.Button(ctrl, text="Absent", command=lambda: mark_selected("Absent")).pack(fill="x", pady=4)
+        ttk.Button(ctrl, text="Toggle", command=lambda: mark_selected(None)).pack(fill="x", pady=4)
+        ttk.Button(ctrl, text="Save Roll", command=lambda: save_roll()).pack(fill="x", pady=8)
         ttk.Button(ctrl, text="Refresh", command=lambda: load_students_for_attendance(cls_var.get())).pack(fill="x", pady=8)
         ttk.Button(ctrl, text="Recent Attendance (7d)", command=self._show_recent_attendance).pack(fill="x", pady=4)
+        ttk.Button(ctrl, text="Attendance Report", command=self._show_attendance_report).pack(fill="x", pady=4)
+
+        # marks staged in the tree but not saved yet: {student_id: status}
+        pending = {}
+        # status each row currently displays, so reloads touch only rows
+        # whose status changed: {iid: status}
+        shown = {}
+
+        def fill_tree(rows):
+            # reloading drops unsaved marks
+            unsaved = [str(sid) for sid in pending]
+            pending.clear()
+            ids = [str(row["id"]) for row in rows]
+            if list(tree.get_children()) != ids:
+                # a different roster (class filter, students added/removed)
+                old = tree.get_children()
+                if old:
+                    tree.delete(*old)
+                shown.clear()
+                for row in rows:
+                    status = row["status"] or ""
+                    tree.insert("", "end", iid=row["id"], values=(f"{row['first_name']} {row['last_name']}", row["class"], status))
+                    shown[str(row["id"])] = status
+                return
+            # same students (e.g. another date): update statuses in place,
+            # keeping the selection and scroll position
+            for iid in unsaved:
+                tree.item(iid, tags=())
+            for iid, row in zip(ids, rows):
+                status = row["status"] or ""
+                if shown.get(iid) != status:
+                    tree.set(iid, "status", status)
+                    shown[iid] = status
 
         def load_students_for_attendance(classfilter):
-            for r in tree.get_children():
-                tree.delete(r)
-            conn = get_conn()
-            cur = conn.cursor()
-            if classfilter and classfilter != "All Classes":
-                cur.execute("SELECT * FROM students WHERE class LIKE ? ORDER BY id", (f"%{classfilter}%",))
-            else:
-                cur.execute("SELECT * FROM students ORDER BY id")
-            for row in cur.fetchall():
-                tree.insert("", "end", iid=row["id"], values=(f"{row['first_name']} {row['last_name']}", row["class"], ""))
-            conn.close()
+            try:
+                date = fmt_date(datetime.date.fromisoformat(date_var.get().strip()))
+            except ValueError:
+                messagebox.showerror("Invalid date", "Enter the date as YYYY-MM-DD")
+                return
+            # one query: the roster joined with that date's recorded statuses
+            self._run_async(tree, self.repo.attendance_roster, fill_tree, date, classfilter, key="attendance")
+
+        def stage(items, status):
+            for iid in items:
+                new = status
+                if new is None:  # toggle
+                    new = "Absent" if tree.set(iid, "status") == "Present" else "Present"
+                pending[int(iid)] = new
+                tree.set(iid, "status", new)
+                shown[iid] = new
+                tree.item(iid, tags=("pending",))
 
         def mark_selected(status):
             sel = tree.selection()
             if not sel:
                 messagebox.showwarning("No selection", "Select a student to mark")
                 return
-            sid = int(sel[0])
-            date = fmt_date()
-            conn = get_conn()
-            cur = conn.cursor()
-            # check if already marked today
-            cur.execute("SELECT id FROM attendance WHERE student_id=? AND date=?", (sid, date))
-            if cur.fetchone():
-                # update
-                cur.execute("UPDATE attendance SET status=?, marked_by=? WHERE student_id=? AND date=?", (status, self.current_user["id"], sid, date))
-            else:
-                cur.execute("INSERT INTO attendance (student_id,date,status,marked_by) VALUES (?,?,?,?)", (sid, date, status, self.current_user["id"]))
-            conn.commit()
-            conn.close()
-            load_students_for_attendance(classfilter=cls_var.get())
-            messagebox.showinfo("Marked", f"Marked {status} for student")
+            stage(sel, status)
 
-        # initially load
-        load_students_for_attendance("All Classes")
+        def save_roll():
+            if not pending:
+                messagebox.showwarning("Nothing to save", "Mark students first")
+                return
+            try:
+                date = fmt_date(datetime.date.fromisoformat(date_var.get().strip()))
+            except ValueError:
+                messagebox.showerror("Invalid date", "Enter the date as YYYY-MM-DD")
+                return
+            try:
+                self.repo.mark_attendance_bulk(date, pending.items(), self.current_user["id"])
+            except ValueError as e:  # an archived year
+                messagebox.showerror("Attendance", str(e))
+                return
+            # the tree already shows the saved statuses; only the marked rows
+            # lose their "not saved" colour
+            for sid in pending:
+                tree.item(str(sid), tags=())
+            count = len(pending)
+            pending.clear()
+            messagebox.showinfo("Marked", f"Saved attendance for {count} students on {date}")
+
+        def refresh():
+            # coming back to the view must not throw away a roll in progress
+            if not pending:
+                load_students_for_attendance(cls_var.get())
+
+        return refresh
 
     def _show_recent_attendance(self):
         # show a small dialog with recent attendance
@@ -529,67 +599,214 @@ class SchoolApp(tk.Tk):
         tree.heading("date", text="Date")
         tree.heading("status", text="Status")
         tree.pack(fill="both", expand=True)
-        conn = get_conn()
-        cur = conn.cursor()
-        d0 = fmt_date(datetime.date.today() - datetime.timedelta(days=7))
-        cur.execute(
-            "SELECT a.date, a.status, s.first_name || ' ' || s.last_name AS student FROM attendance a JOIN students s ON s.id=a.student_id WHERE a.date >= ? ORDER BY a.date DESC",
-            (d0,),
-        )
-        for row in cur.fetchall():
-            tree.insert("", "end", values=(row["student"], row["date"], row["status"]))
-        conn.close()
+
+        def fill_tree(rows):
+            for row in rows:
+                tree.insert("", "end", values=(row["student"], row["date"], row["status"]))
+
+        self._run_async(tree, self.repo.recent_attendance, fill_tree, 7)
+
+    def _show_attendance_report(self):
+        # per-class percentages plus students below a threshold or with an
+        # absence streak, for any date range
+        dlg = tk.Toplevel(self)
+        dlg.title("Attendance Report")
+        dlg.geometry("700x500")
+
+        form = ttk.Frame(dlg, padding=6)
+        form.pack(fill="x")
+        today = datetime.date.today()
+        from_var = tk.StringVar(value=fmt_date(today - datetime.timedelta(days=30)))
+        to_var = tk.StringVar(value=fmt_date(today))
+        threshold_var = tk.StringVar(value="90")
+        streak_var = tk.StringVar(value="3")
+        for label, var, width in (("From", from_var, 12), ("To", to_var, 12), ("Below %", threshold_var, 5), ("Absent days in a row", streak_var, 4)):
+            ttk.Label(form, text=label).pack(side="left")
+            ttk.Entry(form, textvariable=var, width=width).pack(side="left", padx=(4, 10))
+        ttk.Button(form, text="Run", command=lambda: run()).pack(side="left")
+
+        class_tree = ttk.Treeview(dlg, columns=("class", "percent"), show="headings", height=6)
+        class_tree.heading("class", text="Class")
+        class_tree.heading("percent", text="Attendance %")
+        class_tree.pack(fill="x", padx=6, pady=6)
+
+        tree = ttk.Treeview(dlg, columns=("student", "class", "percent", "streak"), show="headings")
+        tree.heading("student", text="Student")
+        tree.heading("class", text="Class")
+        tree.heading("percent", text="Attendance %")
+        tree.heading("streak", text="Longest absence (days)")
+        tree.pack(fill="both", expand=True, padx=6, pady=(0, 6))
+
+        def run():
+            try:
+                start = fmt_date(datetime.date.fromisoformat(from_var.get().strip()))
+                end = fmt_date(datetime.date.fromisoformat(to_var.get().strip()))
+                threshold = float(threshold_var.get())
+                min_days = max(1, int(streak_var.get()))
+            except ValueError:
+                messagebox.showerror("Invalid input", "Dates must be YYYY-MM-DD and limits numbers", parent=dlg)
+                return
+
+            def load():
+                matrix = AttendanceMatrix.load(self.repo, start, end)
+                return matrix.class_percentages(), matrix.report(threshold, min_days)
+
+            def render(data):
+                classes, flagged = data
+                for t in (class_tree, tree):
+                    for r in t.get_children():
+                        t.delete(r)
+                for cls in sorted(classes):
+                    class_tree.insert("", "end", values=(cls or "(none)", f"{classes[cls]}%"))
+                for row in flagged:
+                    pct = "" if row["percent"] is None else f"{row['percent']}%"
+                    tree.insert("", "end", values=(row["name"], row["class"], pct, row["streak"] or ""))
+
+            self._run_async(tree, load, render, key="attendance-report")
+
+        run()
 
     def _show_fees(self):
-        self._clear_content()
-        ttk.Label(self.content, text="Fees & Payments", font=("Helvetica", 16, "bold")).pack(anchor="w")
+        self._show_view("fees", self._build_fees, ("payments", "payment_allocations", "students", "fees"))
 
-        toolbar = ttk.Frame(self.content)
+    def _build_fees(self, view):
+        ttk.Label(view, text="Fees & Payments", font=("Helvetica", 16, "bold")).pack(anchor="w")
+
+        toolbar = ttk.Frame(view)
         toolbar.pack(fill="x", pady=6)
         ttk.Button(toolbar, text="New Invoice", command=self._create_invoice).pack(side="right")
         ttk.Button(toolbar, text="Record Payment", command=self._record_payment).pack(side="right", padx=6)
-
-        # recent payments treeview
-        tree = ttk.Treeview(self.content, columns=("student", "amount", "paid_at", "method"), show="headings", height=16)
-        tree.heading("student", text="Student")
-        tree.heading("amount", text="Amount")
-        tree.heading("paid_at", text="Paid At")
-        tree.heading("method", text="Method")
+        ttk.Button(toolbar, text="Balances & Aging", command=self._show_aging_report).pack(side="right")
+
+        # filters; blank means any
+        filters = ttk.Frame(view)
+        filters.pack(fill="x")
+        fvars = {}
+        for name, label, width in (("adm", "Adm No", 10), ("method", "Method", 8), ("start", "From", 11), ("end", "To", 11), ("fee", "Invoice #", 7)):
+            ttk.Label(filters, text=label + ":").pack(side="left", padx=(0, 4))
+            fvars[name] = tk.StringVar()
+            if name == "method":
+                field = ttk.Combobox(filters, textvariable=fvars[name], values=("", "cash", "card", "online"), width=width)
+            else:
+                field = ttk.Entry(filters, textvariable=fvars[name], width=width)
+            field.pack(side="left", padx=(0, 8))
+            field.bind("<Return>", lambda e: apply_filters())
+
+        # payment history, newest first. Pages are keyset on (paid_at, id):
+        # Older asks for the rows after the last one shown, and the stack of
+        # cursors lets Newer go back, so any page costs the same as the first.
+        # Running totals come from SQL (see Repository.payment_history).
+        cols = ("paid_at", "student", "amount", "method", "ref", "invoice", "running")
+        tree = ttk.Treeview(view, columns=cols, show="headings", height=16)
+        for col, text, width in zip(cols, ("Paid At", "Student", "Amount", "Method", "Reference", "Invoice", "Running Total"), (150, 180, 90, 70, 110, 160, 110)):
+            tree.heading(col, text=text)
+            tree.column(col, width=width, anchor="e" if col in ("amount", "running") else "w")
         tree.pack(fill="both", expand=True, pady=6)
 
-        conn = get_conn()
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT p.amount, p.paid_at, p.method, s.first_name || ' ' || s.last_name AS student FROM payments p JOIN students s ON s.id=p.student_id ORDER BY p.paid_at DESC LIMIT 50"
-        )
-        for row in cur.fetchall():
-            tree.insert("", "end", values=(row["student"], f"${row['amount']:.2f}", row["paid_at"], row["method"]))
-        conn.close()
+        pager = ttk.Frame(view)
+        pager.pack(fill="x")
+        status = ttk.Label(pager)
+        status.pack(side="left")
+        older = ttk.Button(pager, text="Older ▶", command=lambda: turn(1))
+        older.pack(side="right")
+        newer = ttk.Button(pager, text="◀ Newer", command=lambda: turn(-1))
+        newer.pack(side="right", padx=6)
+
+        # cursors[i] is (before, newer) for page i: the last (paid_at, id) of
+        # the page above it and the sum of the amounts on all pages above
+        state = {"query": {}, "cursors": [(None, 0.0)], "page": 0, "rows": []}
+
+        def load(query, before, newer_total):
+            rows = self.repo.payment_history(
+                query.get("student_id"), query.get("method"), query.get("start"), query.get("end"), query.get("fee_id"),
+                before, newer_total, PAYMENT_PAGE_SIZE,
+            )
+            totals = self.repo.payment_totals(query.get("student_id"), query.get("method"), query.get("start"), query.get("end"), query.get("fee_id"))
+            return rows, totals
+
+        def fill_tree(result):
+            rows, (count, total) = result
+            state["rows"] = rows
+            old = tree.get_children()
+            if old:
+                tree.delete(*old)
+            for row in rows:
+                invoice = f"#{row['fee_id']} {row['fee'] or ''}".strip() if row["fee_id"] else ""
+                tree.insert("", "end", values=(
+                    row["paid_at"], f"{row['student']} ({row['admission_no']})", f"${row['amount']:.2f}", row["method"],
+                    row["tx_ref"] or "", invoice, f"${row['running']:.2f}",
+                ))
+            first = state["page"] * PAYMENT_PAGE_SIZE
+            shown = f"Payments {first + 1}–{first + len(rows)} of {count}" if rows else f"No payments of {count}"
+            status.configure(text=f"{shown} · total ${total:,.2f}")
+            newer.state(["!disabled"] if state["page"] else ["disabled"])
+            older.state(["!disabled"] if first + len(rows) < count else ["disabled"])
+
+        def show(page):
+            state["page"] = page
+            before, newer_total = state["cursors"][page]
+            self._run_async(tree, load, fill_tree, state["query"], before, newer_total, key="fees")
+
+        def turn(step):
+            page = state["page"] + step
+            if page < 0:
+                return
+            if step > 0:
+                rows = state["rows"]
+                if not rows:
+                    return
+                newer_total = state["cursors"][state["page"]][1]
+                del state["cursors"][page:]
+                state["cursors"].append(((rows[-1]["paid_at"], rows[-1]["id"]), round(newer_total + sum(r["amount"] for r in rows), 2)))
+            show(page)
+
+        def apply_filters():
+            try:
+                adm, query = validate_payment_filters(fvars["adm"].get(), fvars["method"].get(), fvars["start"].get(), fvars["end"].get(), fvars["fee"].get())
+            except ValueError as e:
+                messagebox.showerror("Filter", str(e))
+                return
+            if adm:
+                student = self.repo.find_student(adm)
+                if not student:
+                    messagebox.showerror("Not found", "Student admission number not found")
+                    return
+                query["student_id"] = student["id"]
+            state.update(query=query, cursors=[(None, 0.0)])
+            show(0)
+
+        def clear_filters():
+            for var in fvars.values():
+                var.set("")
+            apply_filters()
+
+        ttk.Button(filters, text="Apply", command=apply_filters).pack(side="left")
+        ttk.Button(filters, text="Clear", command=clear_filters).pack(side="left", padx=6)
+
+        # new data: back to the newest page with the same filters
+        return lambda: (state.update(cursors=[(None, 0.0)]), show(0))
 
     def _create_invoice(self):
         # ask for student admission number and amount
         adm = simpledialog.askstring("Invoice", "Enter student admission number (e.g. ADM001):", parent=self)
         if not adm:
             return
-        conn = get_conn()
-        cur = conn.cursor()
-        cur.execute("SELECT id, first_name || ' ' || last_name AS name FROM students WHERE admission_no=?", (adm.strip(),))
-        row = cur.fetchone()
+        row = self.repo.find_student(adm)
         if not row:
             messagebox.showerror("Not found", "Student admission number not found")
-            conn.close()
             return
         sid = row["id"]
         amt = simpledialog.askfloat("Amount", "Enter amount", parent=self, minvalue=0.0)
         if amt is None:
-            conn.close()
+            return
+        try:
+            amt, _, _ = validate_payment(amt)
+        except ValueError as e:
+            messagebox.showerror("Validation", str(e))
             return
         desc = simpledialog.askstring("Description", "Invoice description", parent=self) or "Tuition"
         due = simpledialog.askstring("Due date (YYYY-MM-DD)", "Enter due date", initialvalue=fmt_date(), parent=self)
-        now = datetime.datetime.now().isoformat()
-        cur.execute("INSERT INTO fees (student_id, description, amount, due_date, status, created_at) VALUES (?,?,?,?,?,?)", (sid, desc, amt, due, "pending", now))
-        conn.commit()
-        conn.close()
+        self.repo.create_invoice(sid, desc, amt, due)
         messagebox.showinfo("Invoice created", f"Invoice for {row['name']} created")
 
         self._show_fees()
@@ -598,49 +815,67 @@ class SchoolApp(tk.Tk):
         adm = simpledialog.askstring("Payment", "Enter student admission number:", parent=self)
         if not adm:
             return
-        conn = get_conn()
-        cur = conn.cursor()
-        cur.execute("SELECT id, first_name || ' ' || last_name AS name FROM students WHERE admission_no=?", (adm.strip(),))
-        row = cur.fetchone()
+        row = self.repo.find_student(adm)
         if not row:
             messagebox.showerror("Not found", "Student admission number not found")
-            conn.close()
             return
         sid = row["id"]
         amt = simpledialog.askfloat("Amount", "Enter amount", parent=self, minvalue=0.0)
         if amt is None:
-            conn.close()
-            return
-        method = simpledialog.askstring("Method", "Payment method (cash/card/online)", parent=self) or "cash"
-        tx = simpledialog.askstring("Transaction ref", "Transaction reference (optional)", parent=self) or ""
-        paid_at = datetime.datetime.now().isoformat()
-        # Link to fee if any pending fee exists (take oldest)
-        cur.execute("SELECT id FROM fees WHERE student_id=? AND status!='paid' ORDER BY id LIMIT 1", (sid,))
-        fee_row = cur.fetchone()
-        fee_id = fee_row["id"] if fee_row else None
-        cur.execute("INSERT INTO payments (fee_id, student_id, amount, method, tx_ref, paid_at) VALUES (?,?,?,?,?,?)", (fee_id, sid, amt, method, tx, paid_at))
-        if fee_id:
-            cur.execute("UPDATE fees SET status='paid' WHERE id=?", (fee_id,))
-        conn.commit()
-        conn.close()
-        messagebox.showinfo("Payment recorded", f"Payment of ${amt:.2f} recorded for {row['name']}")
+            return
+        method = simpledialog.askstring("Method", "Payment method (cash/card/online)", parent=self)
+        tx = simpledialog.askstring("Transaction ref", "Transaction reference (optional)", parent=self)
+        try:
+            amt, method, tx = validate_payment(amt, method, tx)
+        except ValueError as e:
+            messagebox.showerror("Validation", str(e))
+            return
+        self.repo.record_payment(sid, amt, method, tx)
+        balance = self.repo.student_balance(sid) or 0
+        state = f"Balance due: ${balance:.2f}" if balance > 0 else f"Credit: ${-balance:.2f}"
+        messagebox.showinfo("Payment recorded", f"Payment of ${amt:.2f} recorded for {row['name']}\n{state}")
         self._show_fees()
 
+    def _show_aging_report(self):
+        # who owes what, split by how long the invoices are overdue
+        dlg = tk.Toplevel(self)
+        dlg.title("Outstanding Balances")
+        dlg.geometry("800x400")
+        cols = ("adm", "student", "class", "d0", "d31", "d60", "total", "balance")
+        tree = ttk.Treeview(dlg, columns=cols, show="headings")
+        for col, text in zip(cols, ("Adm No", "Student", "Class", "0-30 days", "31-60 days", "60+ days", "Open invoices", "Balance")):
+            tree.heading(col, text=text)
+            tree.column(col, width=90 if col not in ("student",) else 160)
+        tree.pack(fill="both", expand=True)
+
+        def fill_tree(rows):
+            for row in rows:
+                tree.insert("", "end", values=(
+                    row["admission_no"], row["student"], row["class"], f"${row['days_0_30']:.2f}", f"${row['days_31_60']:.2f}",
+                    f"${row['days_60_plus']:.2f}", f"${row['total']:.2f}", f"${row['balance'] or 0:.2f}",
+                ))
+
+        self._run_async(tree, self.repo.aging_report, fill_tree)
+
     def _show_exams(self):
-        self._clear_content()
-        ttk.Label(self.content, text="Exam Schedule", font=("Helvetica", 16, "bold")).pack(anchor="w")
+        self._show_view("exams", self._build_exams, ("exam_schedule",))
+
+    def _build_exams(self, view):
+        ttk.Label(view, text="Exam Schedule", font=("Helvetica", 16, "bold")).pack(anchor="w")
 
-        toolbar = ttk.Frame(self.content)
+        toolbar = ttk.Frame(view)
         toolbar.pack(fill="x", pady=6)
         # Added Delete Button
         ttk.Button(toolbar, text="Delete Selected Exam", command=self._delete_exam_schedule).pack(side="right", padx=6)
         ttk.Button(toolbar, text="Add New Exam Schedule", command=self._add_exam_schedule).pack(side="right")
-        ttk.Button(toolbar, text="Refresh List", command=self._show_exams).pack(side="right", padx=6)
+        ttk.Button(toolbar, text="Refresh List", command=self._load_exam_schedules).pack(side="right", padx=6)
+        ttk.Button(toolbar, text="Check Conflicts", command=self._audit_exams).pack(side="right")
+        ttk.Button(toolbar, text="Generate Timetable", command=self._generate_timetable).pack(side="right", padx=6)
 
 
         # Treeview for displaying the exam schedules
         cols = ("title", "class", "subject", "date", "start_time", "end_time", "room")
-        self.exam_tree = ttk.Treeview(self.content, columns=cols, show="headings", selectmode="browse", height=18)
+        self.exam_tree = ttk.Treeview(view, columns=cols, show="headings", selectmode="browse", height=18)
         self.exam_tree.heading("title", text="Exam Title")
         self.exam_tree.heading("class", text="Class")
         self.exam_tree.heading("subject", text="Subject")
@@ -650,20 +885,18 @@ class SchoolApp(tk.Tk):
         self.exam_tree.heading("room", text="Room")
         self.exam_tree.pack(fill="both", expand=True, pady=6)
 
-        self._load_exam_schedules()
+        return self._load_exam_schedules
 
     def _load_exam_schedules(self):
-        for r in self.exam_tree.get_children():
-            self.exam_tree.delete(r)
-
-        conn = get_conn()
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM exam_schedule ORDER BY exam_date, start_time")
-        for row in cur.fetchall():
-            self.exam_tree.insert("", "end", iid=row["id"], values=(
-                row["exam_title"], row["class"], row["subject"], row["exam_date"], row["start_time"], row["end_time"], row["room"]
-            ))
-        conn.close()
+        def fill_tree(rows):
+            for r in self.exam_tree.get_children():
+                self.exam_tree.delete(r)
+            for row in rows:
+                self.exam_tree.insert("", "end", iid=row["id"], values=(
+                    row["exam_title"], row["class"], row["subject"], row["exam_date"], row["start_time"], row["end_time"], row["room"]
+                ))
+
+        self._run_async(self.exam_tree, self.repo.list_exam_schedules, fill_tree, key="exams")
 
     def _add_exam_schedule(self):
         # Use simpledialog to get exam details
@@ -687,23 +920,77 @@ class SchoolApp(tk.Tk):
 
         room = simpledialog.askstring("Room/Hall", "Enter Room/Hall Number:", parent=self) or ""
 
-        # Insert into database
-        conn = get_conn()
-        cur = conn.cursor()
+        # Insert into database; a room/class clash needs confirming
         try:
-            cur.execute(
-                "INSERT INTO exam_schedule (exam_title, class, subject, exam_date, start_time, end_time, room) VALUES (?,?,?,?,?,?,?)",
-                (title, class_name, subject, date, start_time, end_time, room)
-            )
-            conn.commit()
+            try:
+                self.repo.add_exam_schedule(title, class_name, subject, date, start_time, end_time, room)
+            except ScheduleConflict as e:
+                if not messagebox.askyesno("Schedule conflict", f"{e}\n\nSave anyway?"):
+                    return
+                self.repo.add_exam_schedule(title, class_name, subject, date, start_time, end_time, room, allow_conflicts=True)
             messagebox.showinfo("Success", "Exam schedule added successfully.")
+        except ValueError as e:
+            messagebox.showerror("Validation", str(e))
+            return
         except Exception as e:
             messagebox.showerror("Error", f"Failed to add exam schedule: {e}")
-        finally:
-            conn.close()
 
         self._load_exam_schedules() # Refresh the list
 
+    def _generate_timetable(self):
+        # plan a term of papers (CSV: class,subject[,duration][,title]) into
+        # free slots and rooms; see school/timetable.py
+        path = filedialog.askopenfilename(parent=self, title="Papers to schedule", filetypes=[("CSV files", "*.csv"), ("All files", "*.*")])
+        if not path:
+            return
+        rooms = simpledialog.askstring("Rooms", "Rooms and capacities (e.g. Hall:120, R1:40):", parent=self)
+        if not rooms:
+            return
+        start = simpledialog.askstring("From (YYYY-MM-DD)", "First exam day:", parent=self, initialvalue=fmt_date())
+        if not start:
+            return
+        end = simpledialog.askstring("To (YYYY-MM-DD)", "Last exam day:", parent=self, initialvalue=start)
+        if not end:
+            return
+        try:
+            with open(path, newline="", encoding="utf-8-sig") as f:
+                papers = timetable.read_papers(f)
+            rooms = timetable.parse_rooms(rooms)
+            start, end = (fmt_date(datetime.date.fromisoformat(d.strip())) for d in (start, end))
+        except (OSError, ValueError) as e:
+            messagebox.showerror("Generate timetable", str(e))
+            return
+
+        def done(table):
+            lines = [f"{len(table.rows())} papers scheduled, {len(table.unplaced)} not placed."]
+            lines += [f"Not placed: {p.class_name} {p.subject} ({reason})" for p, reason in table.unplaced[:20]]
+            messagebox.showinfo("Generate timetable", "\n".join(lines))
+            self._load_exam_schedules()
+
+        self._run_async(self.exam_tree, timetable.generate, done, self.repo, papers, rooms, start, end, key="timetable")
+
+    def _audit_exams(self):
+        # whole-timetable clash check; conflicting rows are highlighted too
+        def show(result):
+            conflicts, invalid = result
+            self.exam_tree.tag_configure("conflict", background="#f8d7da")
+            clashing = {str(e["id"]) for _, a, b in conflicts for e in (a, b)} | {str(e["id"]) for e in invalid}
+            for iid in self.exam_tree.get_children():
+                self.exam_tree.item(iid, tags=("conflict",) if iid in clashing else ())
+            if not (conflicts or invalid):
+                messagebox.showinfo("Exam schedule", "No conflicts found.")
+                return
+            lines = [f"{kind.title()} clash:\n  {describe(a)}\n  {describe(b)}" for kind, a, b in conflicts]
+            lines += [f"Invalid date or time: {describe(e)}" for e in invalid]
+            dlg = tk.Toplevel(self)
+            dlg.title(f"Exam schedule: {len(conflicts)} conflicts, {len(invalid)} invalid")
+            text = tk.Text(dlg, wrap="none", width=100, height=25)
+            text.insert("1.0", "\n".join(lines))
+            text.configure(state="disabled")
+            text.pack(fill="both", expand=True)
+
+        self._run_async(self.exam_tree, self.repo.audit_exam_schedule, show, key="exam-audit")
+
     # Delete exam schedule
     def _delete_exam_schedule(self):
         sel = self.exam_tree.selection()
@@ -716,39 +1003,100 @@ class SchoolApp(tk.Tk):
         if not messagebox.askyesno("Confirm Delete", "Are you sure you want to delete the selected exam schedule?"):
             return
 
-        conn = get_conn()
-        cur = conn.cursor()
         try:
-            cur.execute("DELETE FROM exam_schedule WHERE id=?", (exam_id,))
-            conn.commit()
+            self.repo.delete_exam_schedule(exam_id)
             messagebox.showinfo("Success", "Exam schedule deleted successfully.")
         except Exception as e:
             messagebox.showerror("Error", f"Failed to delete exam schedule: {e}")
-        finally:
-            conn.close()
 
         self._load_exam_schedules() # Refresh the list
 
     def _show_settings(self):
-        self._clear_content()
-        ttk.Label(self.content, text="Settings", font=("Helvetica", 16, "bold")).pack(anchor="w")
-        ttk.Label(self.content, text="Change admin password or add users", font=("Helvetica", 11)).pack(anchor="w", pady=8)
+        self._show_view("settings", self._build_settings)
 
-        frm = ttk.Frame(self.content)
+    def _build_settings(self, view):
+        ttk.Label(view, text="Settings", font=("Helvetica", 16, "bold")).pack(anchor="w")
+        ttk.Label(view, text="Change admin password or add users", font=("Helvetica", 11)).pack(anchor="w", pady=8)
+
+        frm = ttk.Frame(view)
         frm.pack(anchor="w", pady=6)
 
         ttk.Button(frm, text="Change password", command=self._change_password).pack(side="left", padx=6)
         ttk.Button(frm, text="Add user", command=self._add_user).pack(side="left", padx=6)
+        ttk.Button(frm, text="Diagnostics", command=self._show_diagnostics).pack(side="left", padx=6)
+        ttk.Button(frm, text="Archive Attendance", command=self._archive_attendance).pack(side="left", padx=6)
+        ttk.Button(frm, text="Back Up Now", command=self._backup_now).pack(side="left", padx=6)
+
+    def _archive_attendance(self):
+        # move closed academic years out of the live attendance table
+        years = archive.closed_years(self.repo)
+        if not years:
+            messagebox.showinfo("Archive attendance", "No closed academic years to archive.")
+            return
+        names = ", ".join(f"{y}/{y + 1}" for y in years)
+        if not messagebox.askyesno("Archive attendance", f"Move attendance for {names} to yearly archive files?\n"
+                                   "Archived days can no longer be edited; reports still include them."):
+            return
+
+        def done(moved):
+            lines = [f"{y}/{y + 1}: {n} records -> {archive.archive_file(self.repo, y)}" for y, n in moved.items()]
+            messagebox.showinfo("Archive attendance", "\n".join(lines))
+
+        self._run_async(self.content, archive.archive_closed, done, self.repo, key="archive")
+
+    def _show_diagnostics(self):
+        # query counts/latencies, view build times and the slow query log
+        dlg = tk.Toplevel(self)
+        dlg.title("Diagnostics")
+        dlg.geometry("900x500")
+        bar = ttk.Frame(dlg, padding=6)
+        bar.pack(fill="x")
+        enabled = tk.BooleanVar(value=self.profiler is not None)
+        threshold = tk.StringVar(value=str(self.profiler.threshold_ms if self.profiler else 50))
+        text = tk.Text(dlg, wrap="none", font=("Courier", 9))
+        text.pack(fill="both", expand=True)
+
+        def refresh():
+            text.delete("1.0", "end")
+            text.insert("1.0", self.profiler.report() if self.profiler else "Profiling is off.")
+
+        def toggle():
+            if enabled.get():
+                try:
+                    ms = float(threshold.get())
+                except ValueError:
+                    ms = 50.0
+                self.profiler = QueryProfiler(ms).attach(self.repo)
+            elif self.profiler is not None:
+                self.profiler.detach()
+                self.profiler = None
+            refresh()
+
+        def reset():
+            if self.profiler is not None:
+                self.profiler.reset()
+            refresh()
+
+        def save():
+            if self.profiler is None:
+                return
+            path = filedialog.asksaveasfilename(parent=dlg, defaultextension=".txt", initialfile="school-profile.txt")
+            if path:
+                self.profiler.dump(path)
+
+        ttk.Checkbutton(bar, text="Profiling on", variable=enabled, command=toggle).pack(side="left")
+        ttk.Label(bar, text="Slow query ms:").pack(side="left", padx=(12, 4))
+        ttk.Entry(bar, textvariable=threshold, width=6).pack(side="left")
+        ttk.Button(bar, text="Refresh", command=refresh).pack(side="left", padx=6)
+        ttk.Button(bar, text="Reset", command=reset).pack(side="left")
+        ttk.Button(bar, text="Save to file", command=save).pack(side="left", padx=6)
+        refresh()
 
     def _change_password(self):
         new = simpledialog.askstring("New password", "Enter new password:", parent=self, show="*")
         if not new:
             return
-        conn = get_conn()
-        cur = conn.cursor()
-        cur.execute("UPDATE users SET password=? WHERE id=?", (new, self.current_user["id"]))
-        conn.commit()
-        conn.close()
+        self.repo.change_password(self.current_user["id"], new)
         messagebox.showinfo("Changed", "Password updated")
 
     def _add_user(self):
@@ -759,25 +1107,106 @@ class SchoolApp(tk.Tk):
         if p is None:
             return
         role = simpledialog.askstring("Role", "Role (admin/teacher/accountant):", parent=self, initialvalue="teacher")
-        conn = get_conn()
-        cur = conn.cursor()
         try:
-            cur.execute("INSERT INTO users (username,password,role) VALUES (?,?,?)", (u, p, role or "teacher"))
-            conn.commit()
+            self.repo.add_user(u, p, role or "teacher")
             messagebox.showinfo("Added", "User added")
         except sqlite3.IntegrityError:
             messagebox.showerror("Error", "Username already exists")
-        finally:
-            conn.close()
 
     def _logout(self):
         if messagebox.askyesno("Logout", "Are you sure you want to logout?"):
             self.current_user = None
             self._build_login()
 
-    def _clear_content(self):
-        for w in self.content.winfo_children():
-            w.destroy()
+    def _show_view(self, name, build, tables=()):
+        # Each view is built once into its own frame and kept: navigating
+        # hides the current frame and shows the cached one, so widgets are
+        # not torn down and recreated on every click. build(frame) returns
+        # the view's data reload (or None); it runs on first show and when
+        # one of `tables` has changed since the last reload.
+        view = self._views.get(name)
+        if view is None:
+            frame = ttk.Frame(self.content)
+            view = self._views[name] = {"frame": frame, "refresh": build(frame), "tables": tables, "stamp": None}
+        if self._current_view is not view:
+            if self._current_view is not None:
+                self._current_view["frame"].pack_forget()
+            view["frame"].pack(fill="both", expand=True)
+            self._current_view = view
+        if view["refresh"] is not None:
+            # the stamp takes repo.lock, which a long save or report on the
+            # executor may hold, so it is read there rather than on the Tk thread
+            def compare(stamp):
+                if self._current_view is view and (stamp is None or stamp != view["stamp"]):
+                    view["stamp"] = stamp
+                    view["refresh"]()
+
+            self.executor.submit(self.repo.data_stamp, compare, tables, key=f"stamp: {name}", owner=view["frame"])
+
+    def _run_async(self, owner, fn, on_done, *args, key=None):
+        # Run fn(*args) on the query executor and pass its result to on_done
+        # on the Tk thread, with a "Loading…" overlay on owner meanwhile. A
+        # newer call with the same key supersedes an unfinished one.
+        key = key or str(owner)
+        old = self._loading.pop(key, None)
+        if old is not None and old.winfo_exists():
+            old.destroy()
+        busy = ttk.Label(owner, text="Loading…", padding=8)
+        busy.place(relx=0.5, rely=0.5, anchor="center")
+        self._loading[key] = busy
+        started = time.perf_counter()
+
+        def finish():
+            if self.profiler is not None:
+                self.profiler.add_view_time(f"load: {key}", (time.perf_counter() - started) * 1000)
+            if self._loading.get(key) is busy:
+                del self._loading[key]
+            if busy.winfo_exists():
+                busy.destroy()
+
+        def done(result):
+            finish()
+            on_done(result)
+
+        def failed(exc):
+            finish()
+            messagebox.showerror("Database error", str(exc))
+
+        self.executor.submit(fn, done, *args, key=key, owner=owner, on_error=failed)
+
+    def _timed(self, name, fn):
+        if self.profiler is None:
+            return fn()
+        with self.profiler.view(name):
+            return fn()
+
+    def _checkpoint(self):
+        # PASSIVE never waits on other terminals, so a busy WAL just carries
+        # over to the next run
+        self.executor.submit(self.repo.checkpoint, lambda result: None, key="checkpoint", on_error=lambda e: None)
+        self.after(CHECKPOINT_MS, self._checkpoint)
+
+    def _scheduled_backup(self):
+        # every terminal checks, but a backup is only taken when the newest
+        # one in the shared directory is older than SCHOOL_BACKUP_HOURS
+        age = backup.latest_age(self.repo, backup.BACKUP_DIR)
+        if age is None or age >= backup.BACKUP_HOURS * 3600:
+            self.executor.submit(
+                backup.backup, lambda path: None, self.repo, backup.BACKUP_DIR, backup.BACKUP_KEEP, key="backup",
+                on_error=lambda e: messagebox.showwarning("Scheduled backup failed", str(e)),
+            )
+        self.after(BACKUP_CHECK_MS, self._scheduled_backup)
+
+    def _backup_now(self):
+        def done(path):
+            messagebox.showinfo("Backup", f"Backed up and checked:\n{path}")
+
+        self._run_async(self.content, backup.backup, done, self.repo, backup.BACKUP_DIR, backup.BACKUP_KEEP, key="backup")
+
+    def destroy(self):
+        self.executor.shutdown()
+        super().destroy()
+        self.repo.close()
 
 
 # Student add / edit dialog class
@@ -839,25 +1268,25 @@ class StudentDialog:
         btn.grid(row=8, column=0, columnspan=2, pady=8)
 
     def _on_save(self):
-        a = self.e_first.get().strip()
-        b = self.e_last.get().strip()
-        adm = self.e_adm.get().strip()
-        if not (a and adm):
-            messagebox.showerror("Validation", "First name and Admission No are required")
-            return
-        self.result = {
-            "first": a,
-            "last": b,
-            "dob": self.e_dob.get().strip(),
-            "adm": adm,
-            "class": self.e_class.get().strip(),
-            "section": self.e_section.get().strip(),
-            "guardian": self.e_guardian.get().strip(),
-            "phone": self.e_phone.get().strip(),
+        # keys match school.repository.STUDENT_FIELDS
+        data = {
+            "first_name": self.e_first.get(),
+            "last_name": self.e_last.get(),
+            "dob": self.e_dob.get(),
+            "admission_no": self.e_adm.get(),
+            "class": self.e_class.get(),
+            "section": self.e_section.get(),
+            "guardian_name": self.e_guardian.get(),
+            "phone": self.e_phone.get(),
         }
+        try:
+            self.result = validate_student(data)
+        except ValueError as e:
+            messagebox.showerror("Validation", str(e))
+            return
         self.top.destroy()
 
 
 if __name__ == "__main__":
     app = SchoolApp()
-    app.mainloop()
\ No newline at end of file
+    app.mainloop()
\ No newline at end of file
@@ -0,0 +1,4 @@
+# Headless core of the School Management System. Nothing in this package
+# imports tkinter; the desktop UI lives in "School Management System.py".
+from .db import DB_PATH, connect, fmt_date, init_db
+from .repository import STUDENT_FIELDS, Repository
@@ -0,0 +1,110 @@
+import bisect
+
+# Attendance analytics over per-student day bitmaps.
+#
+# Every school day in the range (a date on which any attendance was marked)
+# gets a bit index. Each student has two Python ints: `marked` with a bit
+# set for every day they have a record, `present` for every day marked
+# Present. Range percentages, absence streaks and absentee lists are then a
+# handful of big-int AND/shift/popcount operations per student instead of
+# loops over attendance rows.
+
+
+def _mask(lo, hi):
+    # bits lo..hi-1
+    return ((1 << hi) - 1) ^ ((1 << lo) - 1)
+
+
+def _pct(present, marked):
+    total = marked.bit_count()
+    return round(present.bit_count() / total * 100, 1) if total else None
+
+
+def _longest_run(bits):
+    # length of the longest run of consecutive 1 bits
+    n = 0
+    while bits:
+        bits &= bits >> 1
+        n += 1
+    return n
+
+
+class AttendanceMatrix:
+    def __init__(self, days, present, marked, students):
+        self.days = days          # sorted ISO dates, bit i <-> days[i]
+        self.present = present    # {student_id: int}
+        self.marked = marked      # {student_id: int}
+        self.students = students  # {student_id: (name, class)}
+
+    @classmethod
+    def load(cls, repo, start, end):
+        # one pass over the attendance rows in [start, end]
+        day_index = {}
+        present, marked = {}, {}
+        for sid, date, status in repo.iter_attendance(start, end):
+            i = day_index.get(date)
+            if i is None:
+                # rows arrive in date order, so indexes are date order too
+                i = day_index[date] = len(day_index)
+            bit = 1 << i
+            marked[sid] = marked.get(sid, 0) | bit
+            if status == "Present":
+                present[sid] = present.get(sid, 0) | bit
+        return cls(list(day_index), present, marked, repo.student_names())
+
+    def _range(self, start=None, end=None):
+        lo = 0 if start is None else bisect.bisect_left(self.days, start)
+        hi = len(self.days) if end is None else bisect.bisect_right(self.days, end)
+        return _mask(lo, hi)
+
+    def student_percentages(self, start=None, end=None):
+        # {student_id: percent present} over start..end (inclusive)
+        m = self._range(start, end)
+        out = {}
+        for sid, marked in self.marked.items():
+            pct = _pct(self.present.get(sid, 0) & m, marked & m)
+            if pct is not None:
+                out[sid] = pct
+        return out
+
+    def class_percentages(self, start=None, end=None):
+        # {class: percent present} over start..end (inclusive)
+        m = self._range(start, end)
+        totals = {}
+        for sid, marked in self.marked.items():
+            cls = self.students.get(sid, ("", ""))[1]
+            p, t = totals.get(cls, (0, 0))
+            totals[cls] = (p + (self.present.get(sid, 0) & m).bit_count(), t + (marked & m).bit_count())
+        return {cls: round(p / t * 100, 1) for cls, (p, t) in totals.items() if t}
+
+    def absence_streaks(self, min_days=3, start=None, end=None):
+        # {student_id: longest run of consecutive school days marked Absent}
+        # for students with a run of at least min_days
+        m = self._range(start, end)
+        out = {}
+        for sid, marked in self.marked.items():
+            absent = marked & ~self.present.get(sid, 0) & m
+            run = absent
+            for _ in range(min_days - 1):
+                run &= run >> 1
+            if run:
+                out[sid] = _longest_run(absent)
+        return out
+
+    def chronic_absentees(self, threshold=90.0, start=None, end=None):
+        # [(student_id, percent)] below threshold percent, worst first
+        pcts = self.student_percentages(start, end)
+        return sorted(((sid, p) for sid, p in pcts.items() if p < threshold), key=lambda x: (x[1], x[0]))
+
+    def report(self, threshold=90.0, min_days=3, start=None, end=None):
+        # rows for display: students that are chronically absent or have an
+        # absence streak, with both measures
+        pcts = self.student_percentages(start, end)
+        streaks = self.absence_streaks(min_days, start, end)
+        flagged = {sid for sid, p in pcts.items() if p < threshold} | set(streaks)
+        rows = []
+        for sid in flagged:
+            name, cls = self.students.get(sid, (f"#{sid}", ""))
+            rows.append({"student_id": sid, "name": name, "class": cls, "percent": pcts.get(sid), "streak": streaks.get(sid, 0)})
+        rows.sort(key=lambda r: (r["percent"] if r["percent"] is not None else 0, -r["streak"]))
+        return rows
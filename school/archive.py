@@ -0,0 +1,115 @@
+import datetime
+import os
+
+from .db import fmt_date
+
+# Archival of closed academic years of attendance.
+#
+# The live attendance table only grows (students x school days a year), so
+# once a year is over its rows move to a file of their own next to the
+# main database, e.g. school-attendance-2024.db for 2024/25. The dashboard
+# keeps its history because the attendance_daily rollup is left untouched,
+# and the Attendance view only ever works on the current year. Reports that
+# reach back (Repository.iter_attendance, attendance_months) ATTACH only
+# the yearly files they cover, one at a time and only for the length of
+# a query; see Repository._attached().
+
+# academic years start on this (month, day)
+YEAR_START = (8, 1)
+
+ARCHIVE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS {schema}.attendance (
+    id INTEGER PRIMARY KEY,
+    student_id INTEGER,
+    date TEXT,
+    status TEXT,
+    marked_by INTEGER,
+    UNIQUE(student_id, date)
+)
+"""
+
+
+def academic_year(date):
+    # the calendar year an academic year starts in
+    d = datetime.date.fromisoformat(str(date)[:10])
+    return d.year if (d.month, d.day) >= YEAR_START else d.year - 1
+
+
+def year_range(year):
+    # first and last day of an academic year, inclusive
+    start = datetime.date(year, *YEAR_START)
+    end = datetime.date(year + 1, *YEAR_START) - datetime.timedelta(days=1)
+    return fmt_date(start), fmt_date(end)
+
+
+def archive_file(repo, year):
+    # file name stored in the catalogue, relative to the main database
+    stem = os.path.splitext(os.path.basename(repo.path))[0]
+    return f"{stem}-attendance-{year}.db"
+
+
+def closed_years(repo, today=None):
+    # academic years before the current one that still have live rows
+    current = academic_year(today or fmt_date())
+    first = repo._scalar("SELECT MIN(date) FROM attendance")
+    if first is None:
+        return []
+    years = []
+    for year in range(academic_year(first), current):
+        start, end = year_range(year)
+        if repo._scalar("SELECT 1 FROM attendance WHERE date BETWEEN ? AND ? LIMIT 1", (start, end)):
+            years.append(year)
+    return years
+
+
+def archive_year(repo, year, today=None):
+    # move one closed academic year's attendance to its archive file;
+    # returns the number of rows moved. Running it again for the same year
+    # (e.g. after late corrections) merges into the existing file.
+    if repo.path == ":memory:":
+        raise ValueError("An in-memory database cannot be archived")
+    if year >= academic_year(today or fmt_date()):
+        raise ValueError(f"Academic year {year}/{year + 1} is not over yet")
+    start, end = year_range(year)
+    name = archive_file(repo, year)
+    path = os.path.join(os.path.dirname(os.path.abspath(repo.path)), name)
+    schema = f"archive_{year}"
+    # The lock is held for the whole ATTACH/copy/DELETE/DETACH sequence:
+    # the connection is shared, and a query on another thread would
+    # otherwise run in the middle of it.
+    with repo.lock:
+        repo._execute("ATTACH DATABASE ? AS " + schema, (path,))
+        try:
+            with repo.transaction():
+                repo._execute(ARCHIVE_SCHEMA.format(schema=schema))
+                repo._execute(f"CREATE INDEX IF NOT EXISTS {schema}.idx_attendance_date ON attendance(date)")
+                repo._execute(
+                    f"INSERT OR REPLACE INTO {schema}.attendance (id, student_id, date, status, marked_by) "
+                    "SELECT id, student_id, date, status, marked_by FROM main.attendance WHERE date BETWEEN ? AND ?",
+                    (start, end),
+                )
+                # the raised flag stops the delete triggers from taking the rows'
+                # counts out of attendance_daily and logging them as deleted for
+                # sync; the rows still exist, just in another file
+                repo._execute("INSERT INTO maintenance (flag) VALUES ('archive')")
+                moved = repo._execute("DELETE FROM main.attendance WHERE date BETWEEN ? AND ?", (start, end)).rowcount
+                repo._execute("DELETE FROM maintenance WHERE flag='archive'")
+                total = repo._scalar(f"SELECT COUNT(*) FROM {schema}.attendance")
+                repo._execute(
+                    "INSERT INTO attendance_archives (year, path, start, end, rows, archived_at) VALUES (?,?,?,?,?,?) "
+                    "ON CONFLICT(year) DO UPDATE SET rows=excluded.rows, archived_at=excluded.archived_at",
+                    (year, name, start, end, total, datetime.datetime.now().isoformat()),
+                )
+        finally:
+            repo._execute("DETACH DATABASE " + schema)
+    return moved
+
+
+def archive_closed(repo, today=None, progress=None):
+    # archive every closed year still in the live table; {year: rows}
+    moved = {}
+    for year in closed_years(repo, today):
+        moved[year] = archive_year(repo, year, today)
+        if progress:
+            progress(year, moved[year])
+    return moved
@@ -0,0 +1,119 @@
+import datetime
+import glob
+import os
+import sqlite3
+import time
+import urllib.request
+
+from .db import connect
+
+# Online backups of the live database.
+#
+# sqlite3's backup API copies the file page by page while the app keeps
+# running. The copy is read from its own connection inside one read
+# transaction: in WAL mode that is a fixed snapshot, so other terminals
+# keep writing and the copy is still consistent (without it, every commit
+# elsewhere would restart the backup from page one). Copying PAGES pages
+# per step with a short sleep in between keeps the disk free for the app.
+#
+# Each backup is written to a .part file, switched to a standalone
+# rollback-journal database, checked with PRAGMA integrity_check and only
+# then renamed into place; the oldest backups beyond `keep` are removed.
+# Attendance archive files (school.archive) are written once and are not
+# included.
+
+PAGES = 256
+SLEEP = 0.02
+KEEP = 7
+
+# settings for the desktop app's scheduled backup; SCHOOL_BACKUP_HOURS=0
+# (the default) turns it off
+BACKUP_HOURS = float(os.environ.get("SCHOOL_BACKUP_HOURS", 0))
+BACKUP_DIR = os.environ.get("SCHOOL_BACKUP_DIR") or None
+BACKUP_KEEP = int(os.environ.get("SCHOOL_BACKUP_KEEP", KEEP))
+
+
+def _stem(repo):
+    return os.path.splitext(os.path.basename(repo.path))[0]
+
+
+def default_dir(repo):
+    # backups/ next to the database
+    return os.path.join(os.path.dirname(os.path.abspath(repo.path)), "backups")
+
+
+def list_backups(repo, directory=None):
+    # finished backups of this database, oldest first (the names sort by time)
+    return sorted(glob.glob(os.path.join(directory or default_dir(repo), f"{glob.escape(_stem(repo))}-backup-*.db")))
+
+
+def latest_age(repo, directory=None):
+    # seconds since the newest backup was taken, None if there is none
+    backups = list_backups(repo, directory)
+    return time.time() - os.path.getmtime(backups[-1]) if backups else None
+
+
+def verify(path):
+    # PRAGMA integrity_check of a backup; raises ValueError on damage
+    conn = sqlite3.connect(f"file:{urllib.request.pathname2url(os.path.abspath(path))}?mode=ro", uri=True)
+    try:
+        problems = [r[0] for r in conn.execute("PRAGMA integrity_check")]
+    except sqlite3.DatabaseError as e:  # too damaged to check at all
+        problems = [str(e)]
+    finally:
+        conn.close()
+    if problems != ["ok"]:
+        raise ValueError(f"{path} failed the integrity check: {'; '.join(problems[:5])}")
+
+
+def backup(repo, directory=None, keep=KEEP, pages=PAGES, sleep=SLEEP, progress=None):
+    # copy the database to <directory>/<name>-backup-YYYYmmdd-HHMMSS.db and
+    # return its path; progress(copied_pages, total_pages) after each step
+    if repo.path == ":memory:":
+        raise ValueError("An in-memory database cannot be backed up")
+    if keep < 1:
+        raise ValueError("Keep at least one backup")
+    directory = directory or default_dir(repo)
+    os.makedirs(directory, exist_ok=True)
+    stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    path = os.path.join(directory, f"{_stem(repo)}-backup-{stamp}.db")
+    part = path + ".part"
+    if os.path.exists(path):
+        raise ValueError(f"{path} already exists")
+    if os.path.exists(part):
+        os.remove(part)  # left by an interrupted run
+
+    source = connect(repo.path)
+    target = sqlite3.connect(part)
+    try:
+        try:
+            source.execute("BEGIN")
+            source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()  # pins the snapshot
+            source.backup(
+                target, pages=pages, sleep=sleep,
+                progress=(lambda status, remaining, total: progress(total - remaining, total)) if progress else None,
+            )
+            source.execute("COMMIT")
+            # one self-contained file: no -wal/-shm next to the backup
+            target.execute("PRAGMA journal_mode=DELETE")
+        finally:
+            target.close()
+            source.close()
+        verify(part)
+    except BaseException:
+        # a failed or damaged copy never replaces a good one
+        if os.path.exists(part):
+            os.remove(part)
+        raise
+    os.replace(part, path)
+    rotate(repo, directory, keep)
+    return path
+
+
+def rotate(repo, directory=None, keep=KEEP):
+    # remove all but the newest `keep` backups; returns the removed paths
+    backups = list_backups(repo, directory)
+    removed = backups[:-keep] if keep else backups
+    for old in removed:
+        os.remove(old)
+    return removed
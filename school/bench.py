@@ -0,0 +1,83 @@
+import argparse
+import datetime
+import os
+import statistics
+import tempfile
+import time
+
+from .datagen import generate
+from .db import fmt_date
+from .repository import Repository
+
+# Times every query path the views use against generated databases of
+# increasing size, so regressions show up as numbers:
+#
+#     python -m school.bench --scales 1000,10000 --years 1
+
+
+def _paths(repo):
+    today = datetime.date.today()
+    month_start = today.replace(day=1)
+    six_months_ago = (month_start - datetime.timedelta(days=150)).replace(day=1)
+    next_month = (month_start.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+    roster = [r["id"] for r in repo.students_in_class("Grade 3")]
+    return [
+        ("dashboard kpis", lambda: (
+            repo.count_students(), repo.count_paid_fees(),
+            repo.attendance_percent(fmt_date(today - datetime.timedelta(days=30))),
+        )),
+        ("dashboard trend", lambda: repo.attendance_trend(six_months_ago.isoformat(), next_month.isoformat())),
+        ("students first page", lambda: repo.students_page(limit=100)),
+        ("students search", lambda: repo.search_students("ra pa", limit=300)),
+        ("attendance roster", lambda: repo.attendance_roster(fmt_date(today), "Grade 3")),
+        ("attendance mark class", lambda: repo.mark_attendance_bulk(fmt_date(today), [(sid, "Present") for sid in roster], 1)),
+        ("recent attendance 7d", lambda: repo.recent_attendance(7)),
+        ("recent payments", lambda: repo.recent_payments(50)),
+        ("payment history page", lambda: repo.payment_history(limit=100)),
+        ("aging report", lambda: repo.aging_report()),
+        ("exam list", lambda: repo.list_exam_schedules()),
+        ("exam audit", lambda: repo.audit_exam_schedule()),
+    ]
+
+
+def time_call(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(samples), min(samples)
+
+
+def run(scales=(1000, 5000), years=1, repeat=5, directory=None, report=print):
+    # returns [(scale, path name, median ms, min ms)]
+    results = []
+    with tempfile.TemporaryDirectory(dir=directory) as tmp:
+        for scale in scales:
+            path = os.path.join(tmp, f"bench_{scale}.db")
+            # without the result cache, so repeats measure the queries
+            repo = Repository(path, cache_size=0)
+            try:
+                t0 = time.perf_counter()
+                generate(repo, students=scale, years=years, exams=max(50, scale // 20))
+                report(f"-- {scale} students, {years}y attendance (generated in {time.perf_counter() - t0:.1f}s)")
+                for name, fn in _paths(repo):
+                    median, best = time_call(fn, repeat)
+                    results.append((scale, name, median, best))
+                    report(f"{name:<24} median {median:9.2f} ms   min {best:9.2f} ms")
+            finally:
+                repo.close()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the school database query paths")
+    parser.add_argument("--scales", default="1000,5000", help="comma separated student counts")
+    parser.add_argument("--years", type=int, default=1, help="years of attendance per scale")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+    run([int(x) for x in args.scales.split(",")], args.years, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
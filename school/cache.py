@@ -0,0 +1,132 @@
+import collections
+import functools
+import re
+
+from .db import DERIVED_TABLES
+
+# Read-through cache for the repository's view queries.
+#
+# Each cached method names the tables it reads. The cache keeps a write
+# counter per table, bumped whenever this process runs an INSERT, UPDATE or
+# DELETE against it (and for tables fed by triggers, see DERIVED_TABLES);
+# an entry stays valid while the counters of its tables are unchanged.
+# Commits from other connections or terminals don't pass through here, so
+# every lookup also reads PRAGMA data_version, which SQLite changes only when
+# another connection has committed; then every entry is dropped. A repeat
+# of an unchanged view therefore costs one pragma and no table reads.
+#
+# Results are shared between callers and must not be modified.
+
+_WRITE = re.compile(r"^\s*(?:INSERT(?:\s+OR\s+\w+)?\s+INTO|REPLACE\s+INTO|UPDATE(?:\s+OR\s+\w+)?|DELETE\s+FROM)\s+(?:\w+\.)?[\"`\[]?(\w+)", re.I)
+# ATTACH/DETACH are not listed: the archives attached for one query
+# (Repository._attached()) don't change what main's tables return
+_DDL = re.compile(r"^\s*(?:CREATE|DROP|ALTER)\b", re.I)
+
+
+@functools.lru_cache(maxsize=512)
+def written_tables(sql):
+    # tables a statement changes, None for schema changes (drop everything)
+    if _DDL.match(sql):
+        return None
+    m = _WRITE.match(sql)
+    if not m:
+        return ()
+    table = m.group(1).lower()
+    return (table,) + DERIVED_TABLES.get(table, ())
+
+
+def _size(value):
+    return len(value) if isinstance(value, (list, tuple, dict)) else 1
+
+
+class QueryCache:
+    def __init__(self, maxsize=128, max_rows=50000):
+        self.maxsize = maxsize
+        self.max_rows = max_rows
+        self.entries = collections.OrderedDict()  # key -> (versions, value, rows)
+        self.versions = collections.Counter()
+        self.rows = 0
+        self.data_version = None
+        self.hits = self.misses = self.invalidations = 0
+
+    def sync(self, conn):
+        # drop everything if another connection committed since last time
+        version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if version != self.data_version:
+            if self.data_version is not None:
+                self.clear()
+            self.data_version = version
+
+    def wrote(self, sql):
+        tables = written_tables(sql)
+        if tables is None:
+            self.clear()
+        for table in tables or ():
+            self.versions[table] += 1
+
+    def stamp(self, conn, tables):
+        # changes whenever any of `tables` may have: a write here or a
+        # commit anywhere else
+        self.sync(conn)
+        return (self.data_version,) + tuple(self.versions[t] for t in tables)
+
+    def clear(self):
+        if self.entries:
+            self.invalidations += 1
+        self.entries.clear()
+        self.rows = 0
+
+    def get(self, key, tables):
+        entry = self.entries.get(key)
+        if entry is not None:
+            if entry[0] == tuple(self.versions[t] for t in tables):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[1]
+            self._drop(key)
+        self.misses += 1
+        return False, None
+
+    def put(self, key, tables, value):
+        rows = _size(value)
+        if rows > self.max_rows:
+            return
+        self.entries[key] = (tuple(self.versions[t] for t in tables), value, rows)
+        self.rows += rows
+        while len(self.entries) > self.maxsize or self.rows > self.max_rows:
+            self._drop(next(iter(self.entries)))
+
+    def _drop(self, key):
+        self.rows -= self.entries.pop(key)[2]
+
+    def stats(self):
+        return {"entries": len(self.entries), "rows": self.rows, "hits": self.hits, "misses": self.misses, "invalidations": self.invalidations}
+
+
+def cached(*tables):
+    # decorator for Repository read methods; a no-op while repo.cache is None
+    tables = tuple(t.lower() for t in tables)
+
+    def wrap(fn):
+        @functools.wraps(fn)
+        def method(self, *args, **kwargs):
+            cache = self.cache
+            if cache is None:
+                return fn(self, *args, **kwargs)
+            key = (fn.__name__, args, tuple(sorted(kwargs.items())))
+            try:
+                hash(key)
+            except TypeError:
+                return fn(self, *args, **kwargs)
+            with self.lock:
+                cache.sync(self.conn)
+                hit, value = cache.get(key, tables)
+                if hit:
+                    return value
+                value = fn(self, *args, **kwargs)
+                cache.put(key, tables, value)
+                return value
+
+        return method
+
+    return wrap
@@ -0,0 +1,386 @@
+import argparse
+import datetime
+import os
+import sys
+
+from . import schedule
+from .db import fmt_date
+from .repository import Repository
+
+# Command line entry point: python -m school <command> ...
+#
+# Nothing here (or in what it imports) touches tkinter, so batch jobs run on
+# servers without a display and start in milliseconds. Only the "gui"
+# command loads the desktop app, and only when it is run.
+
+GUI_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "School Management System.py")
+
+
+def _table(rows, headers, out):
+    rows = [["" if v is None else str(v) for v in row] for row in rows]
+    widths = [max([len(h)] + [len(r[i]) for r in rows]) for i, h in enumerate(headers)]
+    out.write("  ".join(h.ljust(w) for h, w in zip(headers, widths)).rstrip() + "\n")
+    for r in rows:
+        out.write("  ".join(v.ljust(w) for v, w in zip(r, widths)).rstrip() + "\n")
+
+
+def _date(text):
+    return fmt_date(datetime.date.fromisoformat(text))
+
+
+def cmd_report(repo, args, out):
+    today = datetime.date.today()
+    out.write(f"Total students:        {repo.count_students()}\n")
+    perc = repo.attendance_percent(fmt_date(today - datetime.timedelta(days=30)))
+    out.write(f"Avg attendance (30d):  {'-' if perc is None else f'{perc}%'}\n")
+    out.write(f"Fees paid (rows):      {repo.count_paid_fees()}\n")
+    first = (today.replace(day=1) - datetime.timedelta(days=150)).replace(day=1)
+    end = (today.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+    trend = repo.attendance_trend(first.isoformat(), end.isoformat())
+    out.write("\nAttendance trend:\n")
+    _table(sorted((m, f"{p}%") for m, p in trend.items()), ["Month", "Present"], out)
+
+
+def cmd_attendance(repo, args, out):
+    from .analytics import AttendanceMatrix
+
+    end = args.to or fmt_date()
+    start = args.start or fmt_date(datetime.date.fromisoformat(end) - datetime.timedelta(days=30))
+    matrix = AttendanceMatrix.load(repo, start, end)
+    out.write(f"Attendance {start} .. {end} ({len(matrix.days)} school days)\n\n")
+    classes = matrix.class_percentages()
+    _table([(c or "(none)", f"{classes[c]}%") for c in sorted(classes)], ["Class", "Present"], out)
+    flagged = matrix.report(args.threshold, args.streak)
+    out.write(f"\nBelow {args.threshold}% or absent {args.streak}+ days in a row: {len(flagged)}\n")
+    if flagged:
+        _table(
+            [(r["name"], r["class"], "" if r["percent"] is None else f"{r['percent']}%", r["streak"] or "") for r in flagged],
+            ["Student", "Class", "Present", "Longest absence"],
+            out,
+        )
+
+
+def cmd_balances(repo, args, out):
+    if args.aging:
+        rows = repo.aging_report(args.date)
+        _table(
+            [(r["admission_no"], r["student"], r["class"], f"{r['days_0_30']:.2f}", f"{r['days_31_60']:.2f}",
+              f"{r['days_60_plus']:.2f}", f"{r['total']:.2f}") for r in rows],
+            ["Adm No", "Student", "Class", "0-30", "31-60", "60+", "Total"],
+            out,
+        )
+    else:
+        rows = repo.outstanding_balances()
+        _table(
+            [(r["admission_no"], r["student"], r["class"], f"{r['invoiced']:.2f}", f"{r['paid']:.2f}", f"{r['balance']:.2f}") for r in rows],
+            ["Adm No", "Student", "Class", "Invoiced", "Paid", "Balance"],
+            out,
+        )
+    out.write(f"{len(rows)} students\n")
+
+
+def cmd_exams(repo, args, out):
+    conflicts, invalid = repo.audit_exam_schedule()
+    if not args.audit:
+        rows = repo.list_exam_schedules()
+        _table(
+            [(r["exam_date"], r["start_time"], r["end_time"], r["class"], r["subject"], r["room"], r["exam_title"]) for r in rows],
+            ["Date", "Start", "End", "Class", "Subject", "Room", "Title"],
+            out,
+        )
+        out.write("\n")
+    _table(
+        [(kind, schedule.describe(a), schedule.describe(b)) for kind, a, b in conflicts],
+        ["Clash", "Exam", "Overlaps"],
+        out,
+    )
+    for exam in invalid:
+        out.write(f"invalid date or time: {schedule.describe(exam)}\n")
+    out.write(f"\n{len(conflicts)} conflicts, {len(invalid)} with an invalid date or time\n")
+    return 1 if args.audit and (conflicts or invalid) else 0
+
+
+def cmd_timetable(repo, args, out):
+    from . import timetable
+
+    with open(args.papers, newline="", encoding="utf-8-sig") as f:
+        papers = timetable.read_papers(f, args.title)
+    rooms = timetable.parse_rooms(args.rooms)
+    table = timetable.generate(
+        repo, papers, rooms, _date(args.start), _date(args.end), args.slots.split(","), args.slot_length,
+        seconds=args.seconds, seed=args.seed, write=not args.dry_run,
+    )
+    rows = table.rows()
+    if args.dry_run:
+        _table(rows, ["Title", "Class", "Subject", "Date", "Start", "End", "Room"], out)
+    for paper, reason in table.unplaced:
+        out.write(f"not placed: {paper.class_name} {paper.subject} ({reason})\n")
+    action = "planned" if args.dry_run else "added"
+    out.write(f"{len(rows)} papers {action}, {len(table.unplaced)} not placed, spread penalty {table.penalty}\n")
+    return 1 if table.unplaced else 0
+
+
+def cmd_archive(repo, args, out):
+    from . import archive
+
+    if args.year is not None:
+        moved = {args.year: archive.archive_year(repo, args.year)}
+    elif not args.list:
+        moved = archive.archive_closed(repo)
+        if not moved:
+            out.write("no closed academic years left to archive\n")
+    for year, rows in (moved.items() if not args.list else ()):
+        out.write(f"{year}/{year + 1}: moved {rows} attendance rows to {archive.archive_file(repo, year)}\n")
+    _table(
+        [(f"{r['year']}/{r['year'] + 1}", r["start"], r["end"], r["rows"], r["path"]) for r in repo.attendance_archives()],
+        ["Year", "From", "To", "Rows", "File"],
+        out,
+    )
+
+
+def cmd_documents(repo, args, out):
+    import time
+
+    from . import documents
+
+    start, end = documents.default_term()
+    start, end = _date(args.start) if args.start else start, _date(args.end) if args.end else end
+    kinds = documents.KINDS if args.kind == "all" else (args.kind,)
+    t0 = time.perf_counter()
+
+    def progress(done, total):
+        sys.stderr.write(f"\r{done}/{total} students")
+        sys.stderr.flush()
+
+    students, files = documents.generate(
+        repo, args.out, start, end, kinds, args.class_name, args.workers, args.batch_size, args.school, progress=None if args.quiet else progress
+    )
+    if not args.quiet:
+        sys.stderr.write("\n")
+    out.write(f"{files} documents for {students} students in {args.out} ({time.perf_counter() - t0:.1f}s)\n")
+
+
+def cmd_backup(repo, args, out):
+    from . import backup
+
+    if args.verify:
+        backup.verify(args.verify)
+        out.write(f"{args.verify}: ok\n")
+        return
+    if not args.list:
+        def progress(done, total):
+            sys.stderr.write(f"\r{done}/{total} pages")
+            sys.stderr.flush()
+
+        path = backup.backup(repo, args.dir, args.keep, args.pages, args.sleep, progress=None if args.quiet else progress)
+        if not args.quiet:
+            sys.stderr.write("\n")
+        out.write(f"backed up to {path} (integrity ok)\n")
+    for path in backup.list_backups(repo, args.dir):
+        out.write(f"{path}  {os.path.getsize(path) // 1024} KiB\n")
+
+
+def cmd_sync(repo, args, out):
+    from . import sync
+
+    if args.action == "export":
+        delta = sync.export_changes(repo, args.peer, args.since)
+        sync.write_delta(delta, args.file)
+        out.write(f"{len(delta['changes'])} changes ({delta['since']}..{delta['through']}) written to {args.file}\n")
+    elif args.action == "apply":
+        for path in args.files:
+            stats = sync.apply_changes(repo, sync.read_delta(path))
+            if stats.get("already"):
+                out.write(f"{path}: already applied\n")
+            else:
+                out.write(f"{path}: {stats['applied']} applied, {stats['conflicts']} kept (changed later here), {stats['skipped']} skipped\n")
+    elif args.action == "new-site":
+        out.write(f"site id is now {sync.new_site(repo)}\n")
+    elif args.action == "prune":
+        out.write(f"removed {sync.prune(repo)} change log entries\n")
+    else:
+        out.write(f"site {sync.site_id(repo)}, change log at {sync.last_seq(repo)}\n\n")
+        _table([(p["site"], p["received"], p["received_at"], p["sent"], p["sent_at"]) for p in sync.peers(repo)],
+               ["Peer", "Received", "At", "Sent", "At"], out)
+
+
+def cmd_serve(repo, args, out):
+    import logging
+
+    from .server import serve
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    serve(repo, args.host, args.port, args.workers)
+
+
+def cmd_export(repo, args, out):
+    from . import csvio
+
+    if args.output in (None, "-"):
+        count = csvio.export_students(repo, out)
+    else:
+        with open(args.output, "w", newline="", encoding="utf-8") as f:
+            count = csvio.export_students(repo, f)
+    sys.stderr.write(f"exported {count} students\n")
+
+
+def cmd_import(repo, args, out):
+    from . import csvio
+
+    with open(args.file, newline="", encoding="utf-8-sig") as f:
+        report = csvio.import_students(repo, f, upsert=args.upsert, batch_size=args.batch_size)
+    out.write(report.summary() + "\n")
+    for line, adm, err in report.errors:
+        out.write(f"line {line}: {adm or '(blank)'} - {err}\n")
+    return 1 if report.errors else 0
+
+
+PASSTHROUGH = {
+    "generate": "fill the database with synthetic data (see: generate --help)",
+    "bench": "benchmark the query paths (see: bench --help)",
+    "gui": "start the desktop app",
+}
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m school", description="School Management System batch commands")
+    parser.add_argument("--db", default=None, help="database file (default: school.db in the current directory)")
+    parser.add_argument(
+        "--busy-timeout", type=float, default=None, help="seconds to wait for another terminal's write (default: $SCHOOL_BUSY_TIMEOUT or 5)"
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sub.add_parser("report", help="dashboard figures and attendance trend").set_defaults(func=cmd_report)
+
+    p = sub.add_parser("attendance", help="attendance summary per class and flagged students")
+    p.add_argument("--from", dest="start", type=_date, help="first day (default: 30 days before --to)")
+    p.add_argument("--to", type=_date, help="last day (default: today)")
+    p.add_argument("--threshold", type=float, default=90.0, help="flag students below this percent")
+    p.add_argument("--streak", type=int, default=3, help="flag students absent this many days in a row")
+    p.set_defaults(func=cmd_attendance)
+
+    p = sub.add_parser("balances", help="students with an outstanding balance")
+    p.add_argument("--aging", action="store_true", help="split open invoices by days overdue")
+    p.add_argument("--date", type=_date, default=None, help="age invoices as of this day (default: today)")
+    p.set_defaults(func=cmd_balances)
+
+    p = sub.add_parser("export", help="export students as CSV")
+    p.add_argument("-o", "--output", help="file to write (default: stdout)")
+    p.set_defaults(func=cmd_export)
+
+    p = sub.add_parser("import", help="import students from CSV")
+    p.add_argument("file")
+    p.add_argument("--upsert", action="store_true", help="update students whose admission number exists")
+    p.add_argument("--batch-size", type=int, default=500)
+    p.set_defaults(func=cmd_import)
+
+    p = sub.add_parser("exams", help="exam timetable and room/class clashes")
+    p.add_argument("--audit", action="store_true", help="only report conflicts (exit status 1 if any)")
+    p.set_defaults(func=cmd_exams)
+
+    p = sub.add_parser("timetable", help="plan exams for a term into free slots and rooms")
+    p.add_argument("papers", help="CSV with class,subject and optional duration (minutes), title")
+    p.add_argument("--rooms", required=True, help="room:capacity list, e.g. Hall:120,R1:40")
+    p.add_argument("--from", dest="start", required=True, help="first exam day (YYYY-MM-DD)")
+    p.add_argument("--to", dest="end", required=True, help="last exam day (YYYY-MM-DD)")
+    p.add_argument("--slots", default="09:00,13:00", help="slot start times per day")
+    p.add_argument("--slot-length", type=int, default=180, help="minutes per slot")
+    p.add_argument("--title", default="Term Exam")
+    p.add_argument("--seconds", type=float, default=2.0, help="time limit for improving the spread")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--dry-run", action="store_true", help="print the plan without saving it")
+    p.set_defaults(func=cmd_timetable)
+
+    p = sub.add_parser("archive", help="move closed academic years of attendance to yearly files")
+    p.add_argument("--year", type=int, help="archive only the academic year starting in this year")
+    p.add_argument("--list", action="store_true", help="only list existing archives")
+    p.set_defaults(func=cmd_archive)
+
+    p = sub.add_parser("documents", help="write report cards and fee statements as HTML")
+    p.add_argument("-o", "--out", required=True, help="output directory")
+    p.add_argument("--kind", choices=("all", "cards", "statements"), default="all")
+    p.add_argument("--from", dest="start", help="term start (default: start of the academic year)")
+    p.add_argument("--to", dest="end", help="term end (default: today)")
+    p.add_argument("--class", dest="class_name", help="only this class")
+    p.add_argument("--workers", type=int, default=None, help="render processes (default: one per CPU)")
+    p.add_argument("--batch-size", type=int, default=200)
+    p.add_argument("--school", default="School", help="name printed on every document")
+    p.add_argument("-q", "--quiet", action="store_true", help="no progress output")
+    p.set_defaults(func=cmd_documents)
+
+    p = sub.add_parser("backup", help="copy the live database to a checked backup, keeping the newest few")
+    p.add_argument("-o", "--dir", default=None, help="backup directory (default: backups/ next to the database)")
+    p.add_argument("--keep", type=int, default=7, help="backups to keep")
+    p.add_argument("--pages", type=int, default=256, help="pages copied per step")
+    p.add_argument("--sleep", type=float, default=0.02, help="seconds to pause between steps")
+    p.add_argument("--list", action="store_true", help="only list existing backups")
+    p.add_argument("--verify", metavar="FILE", help="only run the integrity check on a backup")
+    p.add_argument("-q", "--quiet", action="store_true", help="no progress output")
+    p.set_defaults(func=cmd_backup)
+
+    p = sub.add_parser("sync", help="exchange changes with another campus database")
+    actions = p.add_subparsers(dest="action", required=True)
+    actions.add_parser("status", help="this site's id and what each peer has sent and been sent")
+    a = actions.add_parser("export", help="write the changes a peer hasn't been sent yet")
+    a.add_argument("file", help="delta file to write (gzipped if it ends in .gz)")
+    a.add_argument("--peer", required=True, help="site id of the receiving database (see: sync status there)")
+    a.add_argument("--since", type=int, default=None, help="resend everything after this sequence number")
+    a = actions.add_parser("apply", help="apply delta files from another campus")
+    a.add_argument("files", nargs="+")
+    actions.add_parser("new-site", help="give a copied database its own site id")
+    actions.add_parser("prune", help="drop change log entries every peer has been sent")
+    p.set_defaults(func=cmd_sync)
+
+    p = sub.add_parser("serve", help="run the HTTP/JSON API")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8080)
+    p.add_argument("--workers", type=int, default=4, help="threads running database work")
+    p.set_defaults(func=cmd_serve)
+
+    # thin wrappers that hand the remaining arguments to the tool's own parser
+    for name, help_text in PASSTHROUGH.items():
+        sub.add_parser(name, help=help_text, add_help=False)
+    return parser
+
+
+def main(argv=None, out=None):
+    out = out or sys.stdout
+    parser = build_parser()
+    args, extra = parser.parse_known_args(argv)
+    if extra and args.command not in PASSTHROUGH:
+        parser.error(f"unrecognized arguments: {' '.join(extra)}")
+
+    if args.command == "gui":
+        # the only command that needs tkinter, imported on demand
+        import runpy
+
+        from . import db
+
+        if args.db:
+            db.DB_PATH = args.db
+        if args.busy_timeout is not None:
+            db.BUSY_TIMEOUT = args.busy_timeout
+        sys.argv = [GUI_SCRIPT] + extra
+        runpy.run_path(GUI_SCRIPT, run_name="__main__")
+        return 0
+    if args.command == "bench":
+        from . import bench
+
+        bench.main(extra)
+        return 0
+    if args.command == "generate":
+        from . import datagen
+
+        datagen.main((["--db", args.db] if args.db else []) + extra)
+        return 0
+
+    repo = Repository(args.db, timeout=args.busy_timeout)
+    try:
+        return args.func(repo, args, out) or 0
+    except BrokenPipeError:  # e.g. piped into head
+        return 0
+    except ValueError as e:  # bad input, e.g. a malformed file or a clash
+        sys.stderr.write(f"{parser.prog} {args.command}: {e}\n")
+        return 2
+    finally:
+        repo.close()
@@ -0,0 +1,70 @@
+import csv
+
+from .repository import STUDENT_FIELDS
+
+# column order of exported files; imports accept these columns in any order
+CSV_COLUMNS = STUDENT_FIELDS
+
+
+class ImportReport:
+    def __init__(self):
+        self.inserted = 0
+        self.updated = 0
+        # (line number, admission_no, message) for every rejected row
+        self.errors = []
+
+    def summary(self):
+        return f"{self.inserted} added, {self.updated} updated, {len(self.errors)} rejected"
+
+
+def import_students(repo, fileobj, upsert=False, batch_size=500):
+    # Stream students from a CSV file into the database in batches of
+    # batch_size rows per transaction. Rows whose admission_no is already
+    # taken are reported (or updated when upsert=True) without aborting the
+    # rest of the batch.
+    reader = csv.DictReader(fileobj)
+    missing = {"first_name", "admission_no"} - set(reader.fieldnames or ())
+    if missing:
+        raise ValueError(f"CSV is missing required column(s): {', '.join(sorted(missing))}")
+
+    columns = [f for f in STUDENT_FIELDS if f in reader.fieldnames]
+    report = ImportReport()
+    batch = []
+
+    def flush():
+        outcomes = repo.import_students_batch([s for _, s in batch], upsert=upsert)
+        for (line, student), outcome in zip(batch, outcomes):
+            if outcome == "inserted":
+                report.inserted += 1
+            elif outcome == "updated":
+                report.updated += 1
+            else:
+                report.errors.append((line, student["admission_no"], "Admission number already exists"))
+        batch.clear()
+
+    for record in reader:
+        # the file line the record ends on; a quoted field may span lines
+        line = reader.line_num
+        student = {f: (record[f] or "").strip() for f in columns}
+        # same rule as StudentDialog._on_save
+        if not (student["first_name"] and student["admission_no"]):
+            report.errors.append((line, student["admission_no"], "First name and Admission No are required"))
+            continue
+        batch.append((line, student))
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    report.errors.sort()
+    return report
+
+
+def export_students(repo, fileobj):
+    # write the students table row by row; returns the number of rows
+    writer = csv.writer(fileobj)
+    writer.writerow(CSV_COLUMNS)
+    count = 0
+    for row in repo.iter_students():
+        writer.writerow([row[c] for c in CSV_COLUMNS])
+        count += 1
+    return count
@@ -0,0 +1,146 @@
+import argparse
+import contextlib
+import datetime
+import random
+
+from .db import fmt_date
+from .repository import Repository
+
+CLASSES = [f"Grade {i}" for i in range(1, 13)]
+SECTIONS = "ABCD"
+FIRST_NAMES = ["Aisha", "Ravi", "Maya", "Arjun", "Sara", "Omar", "Lina", "Kiran", "Zara", "Dev", "Nina", "Ishaan", "Leela", "Yusuf", "Anya", "Rohan"]
+LAST_NAMES = ["Khan", "Patel", "Singh", "Sharma", "Iyer", "Das", "Gupta", "Rao", "Ali", "Mehta", "Nair", "Bose"]
+SUBJECTS = ["Mathematics", "Science", "English", "History", "Geography", "Computer Science", "Art", "Music"]
+ROOMS = [f"Room {i}" for i in range(101, 121)] + ["Main Hall"]
+METHODS = ["cash", "card", "online"]
+
+# Synthetic data for benchmarks and demos. Everything goes in through bulk
+# executemany batches so generating years of attendance stays quick; the
+# same triggers as normal use (rollup, search index) still run, except
+# change capture: generated rows are not changes to sync to other campuses.
+
+
+@contextlib.contextmanager
+def _unlogged(repo):
+    # a transaction that school.sync's change log doesn't record
+    with repo.transaction():
+        repo._execute("INSERT INTO maintenance (flag) VALUES ('sync')")
+        yield
+        repo._execute("DELETE FROM maintenance WHERE flag='sync'")
+
+
+def school_days(start, end):
+    d = start
+    while d <= end:
+        if d.weekday() < 5:
+            yield d
+        d += datetime.timedelta(days=1)
+
+
+def _batched(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def generate(repo, students=1000, years=1, fees_per_student=3, exams=200, present_rate=0.92, seed=0, batch_size=5000, progress=None):
+    rng = random.Random(seed)
+    today = datetime.date.today()
+    now = datetime.datetime.now().isoformat()
+    say = progress or (lambda msg: None)
+
+    # students, numbered after any existing ones so reruns don't collide
+    first = (repo._scalar("SELECT MAX(id) FROM students") or 0) + 1
+    say(f"students: {students}")
+    rows = (
+        (
+            rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES), fmt_date(today - datetime.timedelta(days=rng.randint(5 * 365, 17 * 365))),
+            f"GEN{first + i:07d}", rng.choice(CLASSES), rng.choice(SECTIONS), f"Guardian {i}", f"9{rng.randint(0, 999999999):09d}", now,
+        )
+        for i in range(students)
+    )
+    for batch in _batched(rows, batch_size):
+        with _unlogged(repo):
+            repo._executemany(
+                "INSERT INTO students (first_name,last_name,dob,admission_no,class,section,guardian_name,phone,created_at) VALUES (?,?,?,?,?,?,?,?,?)",
+                batch,
+            )
+    ids = [r["id"] for r in repo._fetchall("SELECT id FROM students WHERE id >= ?", (first,))]
+
+    # daily attendance on weekdays
+    days = list(school_days(today - datetime.timedelta(days=365 * years), today))
+    say(f"attendance: {len(days)} days x {len(ids)} students")
+    rows = (
+        (sid, fmt_date(day), "Present" if rng.random() < present_rate else "Absent", 1)
+        for day in days
+        for sid in ids
+    )
+    for batch in _batched(rows, batch_size):
+        with _unlogged(repo):
+            repo._executemany(
+                "INSERT INTO attendance (student_id,date,status,marked_by) VALUES (?,?,?,?) ON CONFLICT(student_id, date) DO NOTHING",
+                batch,
+            )
+
+    # invoices, with most paid in full, some partly and some not at all
+    say(f"fees: {fees_per_student * len(ids)}")
+    with _unlogged(repo):
+        for sid in ids:
+            for n in range(fees_per_student):
+                amount = float(rng.choice([500, 750, 1000, 1500]))
+                due = today - datetime.timedelta(days=30 * (fees_per_student - n) - rng.randint(0, 20))
+                roll = rng.random()
+                paid = amount if roll < 0.7 else round(amount * rng.uniform(0.2, 0.8), 2) if roll < 0.85 else 0.0
+                status = "paid" if paid >= amount else "partial" if paid else "pending"
+                fee_id = repo._execute(
+                    "INSERT INTO fees (student_id, description, amount, due_date, status, created_at, paid_amount) VALUES (?,?,?,?,?,?,?)",
+                    (sid, f"Term {n + 1} tuition", amount, fmt_date(due), status, now, paid),
+                ).lastrowid
+                if paid:
+                    paid_at = datetime.datetime.combine(due - datetime.timedelta(days=rng.randint(0, 10)), datetime.time(rng.randint(8, 16), rng.randint(0, 59)))
+                    pay_id = repo._execute(
+                        "INSERT INTO payments (fee_id, student_id, amount, method, tx_ref, paid_at) VALUES (?,?,?,?,?,?)",
+                        (fee_id, sid, paid, rng.choice(METHODS), "", paid_at.isoformat()),
+                    ).lastrowid
+                    repo._execute("INSERT INTO payment_allocations (payment_id, fee_id, amount) VALUES (?,?,?)", (pay_id, fee_id, paid))
+    repo.rebuild_balances()
+
+    # exam slots over the next two months
+    say(f"exam slots: {exams}")
+    rows = []
+    for _ in range(exams):
+        start = rng.choice([9, 10, 11, 13, 14])
+        rows.append((
+            "Term Exam", rng.choice(CLASSES), rng.choice(SUBJECTS), fmt_date(today + datetime.timedelta(days=rng.randint(1, 60))),
+            f"{start:02d}:00", f"{start + 2:02d}:00", rng.choice(ROOMS),
+        ))
+    with _unlogged(repo):
+        repo._executemany(
+            "INSERT INTO exam_schedule (exam_title, class, subject, exam_date, start_time, end_time, room) VALUES (?,?,?,?,?,?,?)", rows
+        )
+    return ids
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fill a school database with synthetic data")
+    parser.add_argument("--db", default=None, help="database file (default: school.db)")
+    parser.add_argument("--students", type=int, default=1000)
+    parser.add_argument("--years", type=int, default=1, help="years of daily attendance")
+    parser.add_argument("--fees", type=int, default=3, help="invoices per student")
+    parser.add_argument("--exams", type=int, default=200, help="exam slots")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    repo = Repository(args.db)
+    try:
+        generate(repo, args.students, args.years, args.fees, args.exams, seed=args.seed, progress=print)
+    finally:
+        repo.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,559 @@
+import datetime
+import os
+import sqlite3
+
+DB_PATH = "school.db"
+
+# Several terminals may open the same school.db. How long (seconds) a
+# connection waits on another terminal's write lock before giving up.
+BUSY_TIMEOUT = float(os.environ.get("SCHOOL_BUSY_TIMEOUT", 5))
+
+# WAL needs shared memory, so every terminal must run on the machine that
+# holds school.db. Set SCHOOL_JOURNAL_MODE=DELETE when the file sits on a
+# network share; anything other than WAL falls back to DELETE.
+JOURNAL_MODE = "WAL" if os.environ.get("SCHOOL_JOURNAL_MODE", "WAL").upper() == "WAL" else "DELETE"
+
+
+def connect(path=None, cached_statements=256, timeout=None):
+    # isolation_level=None: transactions are opened explicitly by the
+    # repository instead of implicitly by the sqlite3 module.
+    # check_same_thread=False: the connection is shared and guarded by a lock.
+    # timeout: installs SQLite's busy handler (PRAGMA busy_timeout).
+    conn = sqlite3.connect(
+        path or DB_PATH,
+        timeout=BUSY_TIMEOUT if timeout is None else timeout,
+        isolation_level=None,
+        check_same_thread=False,
+        cached_statements=cached_statements,
+    )
+    conn.row_factory = sqlite3.Row
+    # WAL: readers see a snapshot and never block the writer (or each other),
+    # so one terminal browsing students doesn't stall another marking
+    # attendance. The mode is stored in the file; NORMAL sync is durable
+    # across application crashes and only fsyncs at checkpoints. DELETE
+    # keeps SQLite's default FULL sync.
+    conn.execute(f"PRAGMA journal_mode={JOURNAL_MODE}")
+    if JOURNAL_MODE == "WAL":
+        conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def is_busy(exc):
+    # SQLITE_BUSY / SQLITE_LOCKED, including their extended codes
+    code = getattr(exc, "sqlite_errorcode", None)
+    if code is not None:
+        return code & 0xFF in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    return "locked" in str(exc) or "busy" in str(exc)
+
+
+def _migration_1_base_schema(conn):
+    cur = conn.cursor()
+
+    # users table (FIXED: Changed PRIMARY PRIMARY KEY to PRIMARY KEY)
+    cur.execute(
+        """
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY,
+        username TEXT UNIQUE NOT NULL,
+        password TEXT NOT NULL,
+        role TEXT NOT NULL
+    )
+    """
+    )
+
+    # students table
+    cur.execute(
+        """
+    CREATE TABLE IF NOT EXISTS students (
+        id INTEGER PRIMARY KEY,
+        first_name TEXT,
+        last_name TEXT,
+        dob TEXT,
+        admission_no TEXT UNIQUE,
+        class TEXT,
+        section TEXT,
+        guardian_name TEXT,
+        phone TEXT,
+        created_at TEXT
+    )
+    """
+    )
+
+    # attendance table
+    cur.execute(
+        """
+    CREATE TABLE IF NOT EXISTS attendance (
+        id INTEGER PRIMARY KEY,
+        student_id INTEGER,
+        date TEXT,
+        status TEXT,
+        marked_by INTEGER,
+        FOREIGN KEY(student_id) REFERENCES students(id)
+    )
+    """
+    )
+
+    # fees/payments tables
+    cur.execute(
+        """
+    CREATE TABLE IF NOT EXISTS fees (
+        id INTEGER PRIMARY KEY,
+        student_id INTEGER,
+        description TEXT,
+        amount REAL,
+        due_date TEXT,
+        status TEXT,
+        created_at TEXT,
+        FOREIGN KEY(student_id) REFERENCES students(id)
+    )
+    """
+    )
+
+    cur.execute(
+        """
+    CREATE TABLE IF NOT EXISTS payments (
+        id INTEGER PRIMARY KEY,
+        fee_id INTEGER,
+        student_id INTEGER,
+        amount REAL,
+        method TEXT,
+        tx_ref TEXT,
+        paid_at TEXT,
+        FOREIGN KEY(fee_id) REFERENCES fees(id),
+        FOREIGN KEY(student_id) REFERENCES students(id)
+    )
+    """
+    )
+
+    # exams placeholder (old structure)
+    cur.execute(
+        """
+    CREATE TABLE IF NOT EXISTS exams (
+        id INTEGER PRIMARY KEY,
+        title TEXT,
+        start_date TEXT,
+        end_date TEXT
+    )
+    """
+    )
+
+    # Exam Schedule (detailed schedule)
+    cur.execute(
+        """
+    CREATE TABLE IF NOT EXISTS exam_schedule (
+        id INTEGER PRIMARY KEY,
+        exam_title TEXT NOT NULL,
+        class TEXT,
+        subject TEXT,
+        exam_date TEXT,
+        start_time TEXT,
+        end_time TEXT,
+        room TEXT
+    )
+    """
+    )
+
+    # insert default admin if none exists
+    cur.execute("SELECT COUNT(*) FROM users")
+    if cur.fetchone()[0] == 0:
+        cur.execute(
+            "INSERT INTO users (username, password, role) VALUES (?, ?, ?)",
+            ("admin", "admin", "admin"),
+        )
+
+    # insert sample students if none
+    cur.execute("SELECT COUNT(*) FROM students")
+    if cur.fetchone()[0] == 0:
+        now = datetime.datetime.now().isoformat()
+        sample = [
+            ("Aisha", "Khan", "2012-05-11", "ADM001", "Grade 1", "A", "Mrs Khan", "9999999999", now),
+            ("Ravi", "Patel", "2011-09-20", "ADM002", "Grade 2", "B", "Mr Patel", "8888888888", now),
+            ("Maya", "Singh", "2010-03-05", "ADM003", "Grade 3", "A", "Mrs Singh", "7777777777", now),
+        ]
+        cur.executemany(
+            "INSERT INTO students (first_name,last_name,dob,admission_no,class,section,guardian_name,phone,created_at) VALUES (?,?,?,?,?,?,?,?,?)",
+            sample,
+        )
+
+
+def _migration_2_indexes(conn):
+    # attendance gets UNIQUE(student_id, date); SQLite can't add a constraint
+    # in place, so rebuild the table keeping the latest mark per student/day
+    conn.execute(
+        """
+    CREATE TABLE attendance_new (
+        id INTEGER PRIMARY KEY,
+        student_id INTEGER,
+        date TEXT,
+        status TEXT,
+        marked_by INTEGER,
+        UNIQUE(student_id, date),
+        FOREIGN KEY(student_id) REFERENCES students(id)
+    )
+    """
+    )
+    conn.execute(
+        "INSERT INTO attendance_new (id, student_id, date, status, marked_by) "
+        "SELECT id, student_id, date, status, marked_by FROM attendance "
+        "WHERE id IN (SELECT MAX(id) FROM attendance GROUP BY student_id, date)"
+    )
+    conn.execute("DROP TABLE attendance")
+    conn.execute("ALTER TABLE attendance_new RENAME TO attendance")
+
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_attendance_date ON attendance(date)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_fees_student_status ON fees(student_id, status)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_payments_paid_at ON payments(paid_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_payments_student ON payments(student_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_payments_fee ON payments(fee_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_exam_schedule_date ON exam_schedule(exam_date, start_time)")
+
+
+_ROLLUP_ADD = """
+    INSERT INTO attendance_daily (date, class, present, total)
+    VALUES (NEW.date, COALESCE((SELECT class FROM students WHERE id=NEW.student_id), ''), NEW.status='Present', 1)
+    ON CONFLICT(date, class) DO UPDATE SET present=present+excluded.present, total=total+1;
+"""
+_ROLLUP_REMOVE = """
+    UPDATE attendance_daily SET present=present-(OLD.status='Present'), total=total-1
+    WHERE date=OLD.date AND class=COALESCE((SELECT class FROM students WHERE id=OLD.student_id), '');
+    DELETE FROM attendance_daily WHERE date=OLD.date AND total<=0;
+"""
+
+
+def _migration_3_attendance_rollup(conn):
+    # per day/class present/total counts behind the dashboard, kept in step
+    # with attendance by triggers so every writer (GUI, scripts, other
+    # terminals) maintains it
+    conn.execute(
+        """
+    CREATE TABLE attendance_daily (
+        date TEXT NOT NULL,
+        class TEXT NOT NULL,
+        present INTEGER NOT NULL DEFAULT 0,
+        total INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY(date, class)
+    ) WITHOUT ROWID
+    """
+    )
+    conn.execute(
+        "INSERT INTO attendance_daily (date, class, present, total) "
+        "SELECT a.date, COALESCE(s.class, ''), SUM(a.status='Present'), COUNT(*) "
+        "FROM attendance a LEFT JOIN students s ON s.id=a.student_id GROUP BY 1, 2"
+    )
+
+    add, remove = _ROLLUP_ADD, _ROLLUP_REMOVE
+    conn.execute(f"CREATE TRIGGER attendance_rollup_insert AFTER INSERT ON attendance BEGIN {add} END")
+    conn.execute(f"CREATE TRIGGER attendance_rollup_delete AFTER DELETE ON attendance BEGIN {remove} END")
+    conn.execute(f"CREATE TRIGGER attendance_rollup_update AFTER UPDATE OF student_id, date, status ON attendance BEGIN {remove} {add} END")
+
+    # moving a student to another class moves their counts with them
+    conn.execute(
+        """
+    CREATE TRIGGER students_class_rollup AFTER UPDATE OF class ON students
+    WHEN COALESCE(OLD.class, '') IS NOT COALESCE(NEW.class, '')
+    BEGIN
+        UPDATE attendance_daily
+        SET present=present-(SELECT COUNT(*) FROM attendance a WHERE a.student_id=NEW.id AND a.date=attendance_daily.date AND a.status='Present'),
+            total=total-(SELECT COUNT(*) FROM attendance a WHERE a.student_id=NEW.id AND a.date=attendance_daily.date)
+        WHERE class=COALESCE(OLD.class, '') AND date IN (SELECT date FROM attendance WHERE student_id=NEW.id);
+        DELETE FROM attendance_daily WHERE class=COALESCE(OLD.class, '') AND total<=0;
+        INSERT INTO attendance_daily (date, class, present, total)
+        SELECT date, COALESCE(NEW.class, ''), status='Present', 1 FROM attendance WHERE student_id=NEW.id AND true
+        ON CONFLICT(date, class) DO UPDATE SET present=present+excluded.present, total=total+excluded.total;
+    END
+    """
+    )
+
+
+def _migration_4_student_search(conn):
+    # full-text index over the searchable student columns; external content
+    # (the rows live in students) kept in sync by triggers
+    cols = "first_name, last_name, admission_no, guardian_name, phone"
+    try:
+        conn.execute(
+            f"CREATE VIRTUAL TABLE students_fts USING fts5({cols}, content='students', content_rowid='id', prefix='2 3')"
+        )
+    except sqlite3.OperationalError:
+        # SQLite built without FTS5: search falls back to LIKE
+        return
+    new = ", ".join(f"new.{c}" for c in cols.split(", "))
+    old = ", ".join(f"old.{c}" for c in cols.split(", "))
+    conn.execute(
+        f"CREATE TRIGGER students_fts_insert AFTER INSERT ON students BEGIN "
+        f"INSERT INTO students_fts(rowid, {cols}) VALUES (new.id, {new}); END"
+    )
+    conn.execute(
+        f"CREATE TRIGGER students_fts_delete AFTER DELETE ON students BEGIN "
+        f"INSERT INTO students_fts(students_fts, rowid, {cols}) VALUES ('delete', old.id, {old}); END"
+    )
+    conn.execute(
+        f"CREATE TRIGGER students_fts_update AFTER UPDATE ON students BEGIN "
+        f"INSERT INTO students_fts(students_fts, rowid, {cols}) VALUES ('delete', old.id, {old}); "
+        f"INSERT INTO students_fts(rowid, {cols}) VALUES (new.id, {new}); END"
+    )
+    conn.execute("INSERT INTO students_fts(students_fts) VALUES ('rebuild')")
+
+
+def _migration_5_fee_ledger(conn):
+    # fees.paid_amount tracks partial payments; status moves
+    # pending -> partial -> paid. Legacy fees already marked paid are
+    # treated as settled.
+    conn.execute("ALTER TABLE fees ADD COLUMN paid_amount REAL NOT NULL DEFAULT 0")
+    conn.execute("UPDATE fees SET paid_amount=amount WHERE status='paid'")
+
+    # how each payment was split across invoices
+    conn.execute(
+        """
+    CREATE TABLE payment_allocations (
+        payment_id INTEGER NOT NULL,
+        fee_id INTEGER NOT NULL,
+        amount REAL NOT NULL,
+        PRIMARY KEY(payment_id, fee_id),
+        FOREIGN KEY(payment_id) REFERENCES payments(id),
+        FOREIGN KEY(fee_id) REFERENCES fees(id)
+    )
+    """
+    )
+    conn.execute("CREATE INDEX idx_payment_allocations_fee ON payment_allocations(fee_id)")
+    conn.execute(
+        "INSERT INTO payment_allocations (payment_id, fee_id, amount) "
+        "SELECT id, fee_id, amount FROM payments WHERE fee_id IS NOT NULL"
+    )
+
+    # per-student running totals, updated in the same transaction as every
+    # invoice and payment; balance > 0 is owed, < 0 is unallocated credit
+    conn.execute(
+        """
+    CREATE TABLE balances (
+        student_id INTEGER PRIMARY KEY,
+        invoiced REAL NOT NULL DEFAULT 0,
+        paid REAL NOT NULL DEFAULT 0,
+        balance REAL NOT NULL DEFAULT 0,
+        updated_at TEXT,
+        FOREIGN KEY(student_id) REFERENCES students(id)
+    )
+    """
+    )
+    conn.execute(
+        """
+    INSERT INTO balances (student_id, invoiced, paid, balance, updated_at)
+    SELECT student_id, SUM(invoiced), SUM(paid), SUM(owed) - SUM(credit), datetime('now') FROM (
+        SELECT student_id, amount AS invoiced, 0 AS paid, amount - paid_amount AS owed, 0 AS credit FROM fees
+        UNION ALL
+        SELECT student_id, 0, amount, 0, CASE WHEN fee_id IS NULL THEN amount ELSE 0 END FROM payments
+    ) WHERE student_id IS NOT NULL GROUP BY student_id
+    """
+    )
+
+    # open invoices by due date, for allocation and the aging report
+    conn.execute("CREATE INDEX idx_fees_open ON fees(student_id, due_date) WHERE status != 'paid'")
+
+
+def _migration_6_attendance_archive(conn):
+    # closed academic years move to per-year files (see school.archive);
+    # this catalogue says which file holds which dates
+    conn.execute(
+        """
+    CREATE TABLE attendance_archives (
+        year INTEGER PRIMARY KEY,
+        path TEXT NOT NULL,
+        start TEXT NOT NULL,
+        end TEXT NOT NULL,
+        rows INTEGER NOT NULL,
+        archived_at TEXT NOT NULL
+    )
+    """
+    )
+    # flags raised for the length of one transaction by bulk jobs that
+    # must not fire the usual triggers; other connections never see them
+    conn.execute("CREATE TABLE maintenance (flag TEXT PRIMARY KEY) WITHOUT ROWID")
+    # moving rows to an archive keeps their counts in the dashboard rollup
+    conn.execute("DROP TRIGGER attendance_rollup_delete")
+    conn.execute(
+        "CREATE TRIGGER attendance_rollup_delete AFTER DELETE ON attendance "
+        f"WHEN NOT EXISTS (SELECT 1 FROM maintenance WHERE flag='archive') BEGIN {_ROLLUP_REMOVE} END"
+    )
+
+
+# Change capture for syncing campus databases (see school.sync). Every
+# write to a synced table appends (table, row id, key, op) to change_log;
+# the key names the row the same way in every campus database: a student
+# by admission_no, an attendance mark by admission_no and date, and fees,
+# payments and exam slots by a uid of "<site>-<id>" from the site that
+# created them (NULL until another site's copy is stored here).
+_SITE = "(SELECT value FROM sync_meta WHERE key='site')"
+# any raised maintenance flag ('archive', 'sync') pauses the log; testing
+# for an empty table is much cheaper per row than looking up the flags
+_LOGGING = "NOT EXISTS (SELECT 1 FROM maintenance)"
+_NOW = "strftime('%Y-%m-%dT%H:%M:%fZ', 'now')"
+
+
+def _migration_7_change_log(conn):
+    conn.execute("CREATE TABLE sync_meta (key TEXT PRIMARY KEY, value TEXT) WITHOUT ROWID")
+    conn.execute("INSERT INTO sync_meta (key, value) VALUES ('site', lower(hex(randomblob(8))))")
+    # AUTOINCREMENT: sequence numbers are never reused, even after pruning
+    conn.execute(
+        """
+    CREATE TABLE change_log (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        tbl TEXT NOT NULL,
+        row_id INTEGER NOT NULL,
+        key TEXT NOT NULL,
+        op TEXT NOT NULL,
+        origin TEXT,
+        changed_at TEXT NOT NULL
+    )
+    """
+    )
+    conn.execute("CREATE INDEX idx_change_log_row ON change_log(tbl, row_id)")
+    # per peer: how far through its log we have applied, and through which
+    # of our sequence numbers we have exported to it
+    conn.execute(
+        """
+    CREATE TABLE sync_peers (
+        site TEXT PRIMARY KEY,
+        received INTEGER NOT NULL DEFAULT 0,
+        received_at TEXT,
+        sent INTEGER NOT NULL DEFAULT 0,
+        sent_at TEXT
+    ) WITHOUT ROWID
+    """
+    )
+    for table in ("fees", "payments", "exam_schedule"):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN uid TEXT")
+        # rows from before change capture; campuses reconciled by copying
+        # files share them under the same ids
+        conn.execute(f"UPDATE {table} SET uid='0-' || id")
+        conn.execute(f"CREATE UNIQUE INDEX idx_{table}_uid ON {table}(uid) WHERE uid IS NOT NULL")
+
+    def uid(ref):
+        return f"COALESCE({ref}.uid, {_SITE} || '-' || {ref}.id)"
+
+    keys = {
+        "students": lambda ref: f"COALESCE({ref}.admission_no, '')",
+        "attendance": lambda ref: f"COALESCE((SELECT admission_no FROM students WHERE id={ref}.student_id), '') || '|' || {ref}.date",
+        "fees": uid,
+        "payments": uid,
+        "exam_schedule": uid,
+    }
+    for table, key in keys.items():
+        # updates and deletes log the key the row had before, which is the
+        # one other sites know it by
+        for event, ref, op in (("INSERT", "NEW", "I"), ("UPDATE", "OLD", "U"), ("DELETE", "OLD", "D")):
+            conn.execute(
+                f"CREATE TRIGGER {table}_log_{event.lower()} AFTER {event} ON {table} WHEN {_LOGGING} BEGIN "
+                f"INSERT INTO change_log (tbl, row_id, key, op, changed_at) VALUES ('{table}', {ref}.id, {key(ref)}, '{op}', {_NOW}); END"
+            )
+    # a payment's allocations travel with the payment
+    for event, ref in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+        conn.execute(
+            f"CREATE TRIGGER payment_allocations_log_{event.lower()} AFTER {event} ON payment_allocations WHEN {_LOGGING} BEGIN "
+            f"INSERT INTO change_log (tbl, row_id, key, op, changed_at) "
+            f"SELECT 'payments', p.id, {uid('p')}, 'U', {_NOW} FROM payments p WHERE p.id={ref}.payment_id; END"
+        )
+
+
+def _migration_8_payment_history(conn):
+    # one student's payment history newest first, read straight off the
+    # index (the all-payments history uses idx_payments_paid_at, whose
+    # entries end in the rowid, so it already orders by (paid_at, id)).
+    # It also serves every lookup by student_id alone.
+    conn.execute("CREATE INDEX idx_payments_student_paid ON payments(student_id, paid_at)")
+    conn.execute("DROP INDEX idx_payments_student")
+
+
+# A student's balance: what is still owed on their invoices less the part
+# of their payments not allocated to any invoice (balance > 0 is owed, < 0
+# is credit). Legacy fees settled by a smaller payment are owed nothing,
+# and that payment leaves no credit. Used by the migration below and by
+# Repository.rebuild_balances()/refresh_balances(); {where} narrows it to
+# some students.
+BALANCE_ROWS = """
+    SELECT student_id, round(SUM(invoiced), 2) AS invoiced, round(SUM(paid), 2) AS paid, round(SUM(owed) - SUM(credit), 2) AS balance FROM (
+        SELECT student_id, amount AS invoiced, 0 AS paid, amount - paid_amount AS owed, 0 AS credit FROM fees
+        UNION ALL
+        SELECT student_id, 0, amount, 0,
+               MAX(amount - COALESCE((SELECT SUM(a.amount) FROM payment_allocations a WHERE a.payment_id=payments.id), 0), 0)
+        FROM payments
+    ) WHERE student_id IS NOT NULL AND {where} GROUP BY student_id
+"""
+
+
+def _migration_9_legacy_allocations(conn):
+    # Fees marked paid before the ledger (any payment settled the first
+    # open invoice) have paid_amount=amount but only the payment's amount
+    # allocated. Top their payment's allocation up to the full fee so that
+    # paid_amount is what was allocated everywhere (school.sync recomputes
+    # it from the allocations), then rebuild the balances by BALANCE_ROWS.
+    # Each campus does this itself, so nothing is logged for sync.
+    conn.execute("INSERT INTO maintenance (flag) VALUES ('sync')")
+    conn.execute(
+        """
+    INSERT INTO payment_allocations (payment_id, fee_id, amount)
+    SELECT payment_id, id, missing FROM (
+        SELECT f.id, (SELECT MAX(p.id) FROM payments p WHERE p.fee_id=f.id) AS payment_id,
+               round(f.amount - COALESCE((SELECT SUM(a.amount) FROM payment_allocations a WHERE a.fee_id=f.id), 0), 2) AS missing
+        FROM fees f WHERE f.status='paid'
+    ) WHERE payment_id IS NOT NULL AND missing > 0
+    ON CONFLICT(payment_id, fee_id) DO UPDATE SET amount=round(amount+excluded.amount, 2)
+    """
+    )
+    conn.execute("DELETE FROM maintenance WHERE flag='sync'")
+    conn.execute("DELETE FROM balances")
+    conn.execute(
+        "INSERT INTO balances (student_id, invoiced, paid, balance, updated_at) "
+        f"SELECT student_id, invoiced, paid, balance, datetime('now') FROM ({BALANCE_ROWS.format(where='true')})"
+    )
+
+
+# tables that triggers keep in step with another table, so a write to the
+# key also changes them (used by school.cache to invalidate results)
+DERIVED_TABLES = {
+    "attendance": ("attendance_daily",),
+    "students": ("attendance_daily", "students_fts"),
+}
+
+# Schema migrations, applied in order. PRAGMA user_version records how many
+# have run, so append new steps here and never edit or reorder old ones.
+MIGRATIONS = [
+    _migration_1_base_schema,
+    _migration_2_indexes,
+    _migration_3_attendance_rollup,
+    _migration_4_student_search,
+    _migration_5_fee_ledger,
+    _migration_6_attendance_archive,
+    _migration_7_change_log,
+    _migration_8_payment_history,
+    _migration_9_legacy_allocations,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def init_db(conn):
+    # fast path: a current schema costs a single pragma read on startup
+    if schema_version(conn) >= SCHEMA_VERSION:
+        return
+    # take the write lock before re-checking so two terminals starting at
+    # the same time don't both run the same migration
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        version = schema_version(conn)
+        for step in MIGRATIONS[version:]:
+            step(conn)
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def fmt_date(dt=None):
+    if dt is None:
+        dt = datetime.date.today()
+    if isinstance(dt, datetime.datetime):
+        dt = dt.date()
+    return dt.isoformat()
@@ -0,0 +1,216 @@
+import concurrent.futures
+import html
+import multiprocessing
+import os
+import re
+
+from .archive import academic_year, year_range
+from .db import fmt_date
+
+# Batch generation of per-student documents: an attendance report card for
+# a term and a fee statement, as standalone HTML files (print to PDF from a
+# browser if needed).
+#
+# Students are read in id batches; for each batch the attendance, fees,
+# payments and balances of all its students come from one query per table.
+# Batches are rendered and written by a process
+# pool while the main process fetches the next ones, with a bounded number
+# in flight so memory stays flat however large the school is.
+
+KINDS = ("cards", "statements")
+
+STYLE = """
+body { font-family: Helvetica, Arial, sans-serif; margin: 2em; color: #222; }
+h1 { font-size: 1.4em; margin-bottom: 0; } h2 { font-size: 1.1em; margin-top: 1.5em; }
+.meta { color: #555; margin: 0.3em 0 1em; }
+table { border-collapse: collapse; width: 100%; } th, td { border: 1px solid #bbb; padding: 4px 8px; text-align: left; }
+td.n, th.n { text-align: right; } .total td { font-weight: bold; }
+"""
+
+
+def _file_name(admission_no, sid):
+    # admission numbers are user input; keep file names portable. The id
+    # keeps them unique: "A/1" and "A_1" clean up to the same name, and
+    # "a1" and "A1" are one file on case-insensitive file systems.
+    stem = re.sub(r"[^\w.-]+", "_", admission_no or "").strip("._") or "student"
+    return f"{stem}-{sid}.html"
+
+
+def _page(title, body):
+    return f'<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>{html.escape(title)}</title><style>{STYLE}</style></head>\n<body>\n{body}\n</body></html>\n'
+
+
+def _header(doc, student, school):
+    e = html.escape
+    return (
+        f"<h1>{e(school)}: {e(doc)}</h1>\n"
+        f'<p class="meta">{e(student["name"])} &middot; Admission No {e(student["admission_no"])} &middot; '
+        f'Class {e(student["class"] or "-")} {e(student["section"] or "")}</p>'
+    )
+
+
+def render_card(student, months, term, school):
+    # months: [(YYYY-MM, present, total)]
+    rows, present, total = [], 0, 0
+    for month, p, t in months:
+        present, total = present + p, total + t
+        rows.append(f'<tr><td>{month}</td><td class="n">{p}</td><td class="n">{t - p}</td><td class="n">{p / t * 100:.1f}%</td></tr>')
+    pct = f"{present / total * 100:.1f}%" if total else "-"
+    rows.append(f'<tr class="total"><td>Term</td><td class="n">{present}</td><td class="n">{total - present}</td><td class="n">{pct}</td></tr>')
+    body = (
+        _header("Attendance report", student, school)
+        + f"\n<p>Term {term[0]} to {term[1]}</p>\n"
+        + '<table><tr><th>Month</th><th class="n">Present</th><th class="n">Absent</th><th class="n">Attendance</th></tr>\n'
+        + "\n".join(rows)
+        + "\n</table>"
+    )
+    return _page(f"Attendance report {student['admission_no']}", body)
+
+
+def render_statement(student, fees, payments, balance, school, today):
+    e = html.escape
+    fee_rows = [
+        f'<tr><td>{e(f["due_date"] or "")}</td><td>{e(f["description"] or "")}</td><td class="n">{f["amount"]:.2f}</td>'
+        f'<td class="n">{f["paid_amount"]:.2f}</td><td>{e(f["status"] or "")}</td></tr>'
+        for f in fees
+    ]
+    pay_rows = [
+        f'<tr><td>{e((p["paid_at"] or "")[:10])}</td><td>{e(p["method"] or "")}</td><td>{e(p["tx_ref"] or "")}</td><td class="n">{p["amount"]:.2f}</td></tr>'
+        for p in payments
+    ]
+    state = f"Balance due: {balance:.2f}" if balance > 0 else f"Credit: {-balance:.2f}" if balance < 0 else "Fully paid"
+    body = (
+        _header("Fee statement", student, school)
+        + f"\n<p>As of {today}</p>\n<h2>Invoices</h2>\n"
+        + '<table><tr><th>Due</th><th>Description</th><th class="n">Amount</th><th class="n">Paid</th><th>Status</th></tr>\n'
+        + ("\n".join(fee_rows) or '<tr><td colspan="5">No invoices</td></tr>')
+        + "\n</table>\n<h2>Payments</h2>\n"
+        + '<table><tr><th>Date</th><th>Method</th><th>Reference</th><th class="n">Amount</th></tr>\n'
+        + ("\n".join(pay_rows) or '<tr><td colspan="4">No payments</td></tr>')
+        + f"\n</table>\n<h2>{state}</h2>"
+    )
+    return _page(f"Fee statement {student['admission_no']}", body)
+
+
+def render_batch(out_dir, kinds, term, school, today, batch):
+    # runs in a worker process: render and write one batch of students;
+    # batch items are plain dicts/tuples so they pickle cheaply
+    written = 0
+    for item in batch:
+        student = item["student"]
+        name = _file_name(student["admission_no"], student["id"])
+        if "cards" in kinds:
+            with open(os.path.join(out_dir, "cards", name), "w", encoding="utf-8") as f:
+                f.write(render_card(student, item["months"], term, school))
+            written += 1
+        if "statements" in kinds:
+            with open(os.path.join(out_dir, "statements", name), "w", encoding="utf-8") as f:
+                f.write(render_statement(student, item["fees"], item["payments"], item["balance"], school, today))
+            written += 1
+    return len(batch), written
+
+
+def _group(rows, key="student_id"):
+    groups = {}
+    for r in rows:
+        groups.setdefault(r[key], []).append(r)
+    return groups
+
+
+def fetch_batch(repo, students, kinds, start, end):
+    # the documents' data for a batch of students, one query per table
+    ids = tuple(s["id"] for s in students)
+    match = f"student_id IN ({','.join('?' * len(ids))})"
+    months = fees = payments = balances = {}
+    if "cards" in kinds:
+        # older terms live in the yearly archives (see school.archive)
+        months = {}
+        for sid, month, present, total in repo.attendance_months(ids, start, end):
+            months.setdefault(sid, []).append((month, present, total))
+    if "statements" in kinds:
+        fees = _group(repo._fetchall(
+            "SELECT student_id, description, amount, paid_amount, due_date, status FROM fees "
+            f"WHERE {match} ORDER BY student_id, due_date, id", ids,
+        ))
+        payments = _group(repo._fetchall(
+            f"SELECT student_id, amount, method, tx_ref, paid_at FROM payments WHERE {match} ORDER BY student_id, paid_at, id", ids,
+        ))
+        balances = dict(repo._fetchall(f"SELECT student_id, balance FROM balances WHERE {match}", ids))
+    batch = []
+    for s in students:
+        sid = s["id"]
+        batch.append({
+            "student": {
+                "id": sid, "name": f"{s['first_name']} {s['last_name'] or ''}".strip(), "admission_no": s["admission_no"],
+                "class": s["class"], "section": s["section"],
+            },
+            "months": months.get(sid, []),
+            "fees": [{k: r[k] for k in ("description", "amount", "paid_amount", "due_date", "status")} for r in fees.get(sid, ())],
+            "payments": [{k: r[k] for k in ("amount", "method", "tx_ref", "paid_at")} for r in payments.get(sid, ())],
+            "balance": balances.get(sid) or 0.0,
+        })
+    return batch
+
+
+def _batches(repo, classfilter, batch_size):
+    batch = []
+    for s in repo.iter_students(batch_size):
+        if classfilter and s["class"] != classfilter:
+            continue
+        batch.append(s)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def generate(repo, out_dir, start, end, kinds=KINDS, classfilter=None, workers=None, batch_size=200, school="School", progress=None):
+    # write <out_dir>/cards/<admission_no>-<id>.html and/or statements/...;
+    # progress(done_students, total_students) after each batch. Returns
+    # (students, files). workers=1 renders in this process.
+    kinds = tuple(k for k in KINDS if k in kinds)
+    if not kinds:
+        raise ValueError(f"Nothing to generate; choose from {', '.join(KINDS)}")
+    for kind in kinds:
+        os.makedirs(os.path.join(out_dir, kind), exist_ok=True)
+    total = repo._scalar("SELECT COUNT(*) FROM students WHERE class=?", (classfilter,)) if classfilter else repo.count_students()
+    term, today = (start, end), fmt_date()
+    args = (out_dir, kinds, term, school, today)
+    done = files = 0
+    workers = workers or os.cpu_count() or 1
+
+    def finished(n, written):
+        nonlocal done, files
+        done, files = done + n, files + written
+        if progress:
+            progress(done, total)
+
+    if workers == 1:
+        for students in _batches(repo, classfilter, batch_size):
+            finished(*render_batch(*args, fetch_batch(repo, students, kinds, start, end)))
+        return done, files
+
+    # spawn, not fork: the GUI runs this on an executor thread, and forking
+    # a process with other threads (and an open SQLite connection) can copy
+    # locks held mid-operation into the children
+    context = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        pending = set()
+        for students in _batches(repo, classfilter, batch_size):
+            pending.add(pool.submit(render_batch, *args, fetch_batch(repo, students, kinds, start, end)))
+            # keep the workers busy without holding the whole school in memory
+            if len(pending) >= workers * 2:
+                complete, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in complete:
+                    finished(*future.result())
+        for future in concurrent.futures.as_completed(pending):
+            finished(*future.result())
+    return done, files
+
+
+def default_term(today=None):
+    # the current academic year so far
+    today = today or fmt_date()
+    start, _ = year_range(academic_year(today))
+    return start, today
@@ -0,0 +1,79 @@
+import logging
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+
+class QueryExecutor:
+    # Runs database work on worker threads and hands results back on the Tk
+    # thread. Tk widgets must only be touched from the thread running
+    # mainloop, so workers never call into Tk: finished futures are queued and
+    # drained by a poll scheduled with widget.after().
+    #
+    # The module itself does not import tkinter; any object with after()
+    # works, which keeps it usable from tests.
+    def __init__(self, root, max_workers=2, poll_ms=20):
+        self.root = root
+        self.poll_ms = poll_ms
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="school-db")
+        self.done = queue.SimpleQueue()
+        self.latest = {}
+        self.pending = 0
+        self.polling = False
+
+    def submit(self, fn, on_done, *args, key=None, owner=None, on_error=None):
+        # key: a newer submit with the same key supersedes this one; if it has
+        # not started yet it is cancelled, otherwise its result is dropped.
+        # owner: a widget; the result is dropped if it was destroyed meanwhile
+        # (e.g. the user switched tabs).
+        if key is not None:
+            self.cancel(key)
+        future = self.pool.submit(fn, *args)
+        if key is not None:
+            self.latest[key] = future
+        self.pending += 1
+        future.add_done_callback(lambda f: self.done.put((f, key, owner, on_done, on_error)))
+        if not self.polling:
+            self.polling = True
+            self.root.after(self.poll_ms, self._poll)
+        return future
+
+    def cancel(self, key):
+        future = self.latest.pop(key, None)
+        if future is not None:
+            future.cancel()
+
+    def _poll(self):
+        while True:
+            try:
+                future, key, owner, on_done, on_error = self.done.get_nowait()
+            except queue.Empty:
+                break
+            self.pending -= 1
+            if future.cancelled():
+                continue
+            if key is not None:
+                if self.latest.get(key) is not future:
+                    continue  # superseded by a newer request
+                del self.latest[key]
+            if owner is not None and not owner.winfo_exists():
+                continue
+            exc = future.exception()
+            try:
+                if exc is None:
+                    on_done(future.result())
+                elif on_error is not None:
+                    on_error(exc)
+                else:
+                    log.error("background query failed", exc_info=exc)
+            except Exception:
+                log.exception("background query callback failed")
+        if self.pending > 0:
+            self.root.after(self.poll_ms, self._poll)
+        else:
+            self.polling = False
+
+    def shutdown(self):
+        self.latest.clear()
+        self.pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,152 @@
+import collections
+import contextlib
+import datetime
+import logging
+import os
+import re
+import threading
+import time
+
+log = logging.getLogger("school.sql")
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+
+def normalize(sql):
+    # collapse whitespace and literal values so the same statement with
+    # different arguments is counted once
+    return " ".join(_LITERALS.sub("?", sql).split())
+
+
+class _Stat:
+    __slots__ = ("count", "total_ms", "max_ms")
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def add(self, ms):
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+
+class QueryProfiler:
+    # Opt-in instrumentation for a Repository.
+    #
+    # * Repository._run() reports each statement's wall-clock time (execute
+    #   plus fetch), aggregated per normalized SQL text.
+    # * sqlite3's trace callback counts every statement the engine runs,
+    #   including ones fired by triggers and those outside the repository.
+    # * Statements slower than threshold_ms are logged to "school.sql" with
+    #   their EXPLAIN QUERY PLAN and kept in a bounded slow log.
+    # * view() times whole UI operations such as building a screen.
+    def __init__(self, threshold_ms=50.0, slow_log_size=200):
+        self.threshold_ms = threshold_ms
+        self.lock = threading.Lock()
+        self.statements = collections.defaultdict(_Stat)
+        self.views = collections.defaultdict(_Stat)
+        self.traced = collections.Counter()
+        self.slow = collections.deque(maxlen=slow_log_size)
+        self.repo = None
+
+    def attach(self, repo):
+        with repo.lock:
+            repo.profiler = self
+            repo.conn.set_trace_callback(self._trace)
+        self.repo = repo
+        return self
+
+    def detach(self):
+        repo, self.repo = self.repo, None
+        if repo is not None:
+            with repo.lock:
+                repo.profiler = None
+                if repo.conn is not None:
+                    repo.conn.set_trace_callback(None)
+
+    def reset(self):
+        with self.lock:
+            self.statements.clear()
+            self.views.clear()
+            self.traced.clear()
+            self.slow.clear()
+
+    def _trace(self, sql):
+        with self.lock:
+            self.traced[normalize(sql)] += 1
+
+    def record(self, conn, sql, params, ms):
+        # called by Repository._run with the repository lock held
+        key = normalize(sql)
+        with self.lock:
+            self.statements[key].add(ms)
+        if ms < self.threshold_ms:
+            return
+        plan = []
+        if params is not None:
+            conn.set_trace_callback(None)
+            try:
+                plan = [row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+            except Exception as e:  # e.g. statements EXPLAIN can't take
+                plan = [f"(no plan: {e})"]
+            finally:
+                conn.set_trace_callback(self._trace)
+        when = datetime.datetime.now().isoformat(timespec="seconds")
+        with self.lock:
+            self.slow.append((when, ms, key, plan))
+        log.warning("slow query %.1f ms: %s\n  plan: %s", ms, key, " | ".join(plan) or "-")
+
+    @contextlib.contextmanager
+    def view(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            ms = (time.perf_counter() - t0) * 1000
+            with self.lock:
+                self.views[name].add(ms)
+
+    def add_view_time(self, name, ms):
+        with self.lock:
+            self.views[name].add(ms)
+
+    def snapshot(self):
+        # plain data for display: (statements, views, traced, slow), each
+        # statement/view row is (text, count, total ms, avg ms, max ms)
+        with self.lock:
+            def rows(stats):
+                out = [(k, s.count, s.total_ms, s.total_ms / s.count, s.max_ms) for k, s in stats.items()]
+                return sorted(out, key=lambda r: r[2], reverse=True)
+            return rows(self.statements), rows(self.views), self.traced.most_common(), list(self.slow)
+
+    def report(self):
+        statements, views, traced, slow = self.snapshot()
+        lines = [f"# School MS query profile, {datetime.datetime.now().isoformat(timespec='seconds')}", "", "## Views"]
+        lines += [f"{cnt:6d}x  total {tot:9.1f} ms  avg {avg:8.2f} ms  max {mx:8.2f} ms  {name}" for name, cnt, tot, avg, mx in views]
+        cache = self.repo.cache if self.repo is not None else None
+        if cache is not None:
+            stats = cache.stats()
+            lines += ["", "## Result cache", "  ".join(f"{k} {v}" for k, v in stats.items())]
+        lines += ["", "## Statements (repository, incl. fetch)"]
+        lines += [f"{cnt:6d}x  total {tot:9.1f} ms  avg {avg:8.2f} ms  max {mx:8.2f} ms  {sql}" for sql, cnt, tot, avg, mx in statements]
+        lines += ["", "## Statements seen by the trace callback (incl. triggers)"]
+        lines += [f"{cnt:6d}x  {sql}" for sql, cnt in traced]
+        lines += ["", f"## Slow statements (>= {self.threshold_ms} ms)"]
+        for when, ms, sql, plan in slow:
+            lines.append(f"{when}  {ms:.1f} ms  {sql}")
+            lines += [f"    {p}" for p in plan]
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.report())
+
+
+def from_environment(repo):
+    # SCHOOL_PROFILE=1 turns profiling on at startup; SCHOOL_SLOW_MS sets the
+    # slow query threshold (default 50 ms)
+    if os.environ.get("SCHOOL_PROFILE", "") not in ("", "0"):
+        return QueryProfiler(float(os.environ.get("SCHOOL_SLOW_MS", "50"))).attach(repo)
+    return None
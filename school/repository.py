@@ -0,0 +1,832 @@
+import contextlib
+import datetime
+import math
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+
+from . import db, schedule
+from .cache import QueryCache, cached
+from .db import connect, fmt_date, init_db, is_busy
+
+STUDENT_FIELDS = ("first_name", "last_name", "dob", "admission_no", "class", "section", "guardian_name", "phone")
+ATTENDANCE_STATUSES = ("Present", "Absent")
+
+# amounts below this are treated as zero when allocating payments
+CENT = 0.005
+
+# bm25 column weights for students_fts: first_name, last_name, admission_no,
+# guardian_name, phone
+SEARCH_WEIGHTS = (5.0, 5.0, 10.0, 1.0, 1.0)
+
+# BEGIN IMMEDIATE already waits up to the busy timeout for another
+# terminal's write; these retries cover SQLITE_BUSY returned without waiting
+# (WAL recovery, a checkpoint in progress) with jittered exponential backoff
+WRITE_RETRIES = 4
+RETRY_BACKOFF = 0.05
+
+
+def fts_query(text):
+    # "ra pat" -> '"ra"* "pat"*': every word must match as a prefix. Words
+    # are quoted so user input can't inject FTS5 query syntax.
+    return " ".join(f'"{w}"*' for w in re.findall(r"[^\W_]+", text.lower()))
+
+
+# Input rules shared by the desktop dialogs and the API. They raise
+# ValueError with a message fit to show the user.
+
+
+def validate_student(data):
+    # as the Add/Edit Student dialog: returns a clean dict keyed by
+    # STUDENT_FIELDS
+    student = {f: str(data.get(f) or "").strip() for f in STUDENT_FIELDS}
+    if not (student["first_name"] and student["admission_no"]):
+        raise ValueError("First name and Admission No are required")
+    return student
+
+
+def validate_payment(amount, method=None, tx_ref=None):
+    # as Record Payment: a non-negative amount, method defaults to cash
+    try:
+        amount = float(amount)
+    except (TypeError, ValueError):
+        raise ValueError("Amount must be a number") from None
+    if not math.isfinite(amount):  # float() takes "inf" and "nan"
+        raise ValueError("Amount must be a number")
+    if amount < 0:
+        raise ValueError("Amount must not be negative")
+    return amount, (method or "").strip() or "cash", (tx_ref or "").strip()
+
+
+def validate_date(date):
+    try:
+        return fmt_date(datetime.date.fromisoformat(str(date)))
+    except ValueError:
+        raise ValueError("Date must be YYYY-MM-DD") from None
+
+
+def validate_attendance(date, status):
+    if status not in ATTENDANCE_STATUSES:
+        raise ValueError(f"Status must be one of: {', '.join(ATTENDANCE_STATUSES)}")
+    return validate_date(date), status
+
+
+def validate_payment_filters(admission_no=None, method=None, start=None, end=None, fee_id=None):
+    # as the payment history filters; blank values mean "any"
+    filters = {"method": (method or "").strip() or None, "fee_id": None, "start": None, "end": None}
+    for key, value in (("start", start), ("end", end)):
+        if value:
+            try:
+                filters[key] = fmt_date(datetime.date.fromisoformat(str(value).strip()))
+            except ValueError:
+                raise ValueError("Dates must be YYYY-MM-DD") from None
+    if filters["start"] and filters["end"] and filters["start"] > filters["end"]:
+        raise ValueError("The start date is after the end date")
+    if fee_id not in (None, ""):
+        try:
+            filters["fee_id"] = int(str(fee_id).strip().lstrip("#"))
+        except ValueError:
+            raise ValueError("Invoice must be a number") from None
+    return (admission_no or "").strip() or None, filters
+
+
+def validate_exam(title, class_name, subject, date, start_time, end_time, room=""):
+    # as Add Exam Schedule; times come back normalised to HH:MM
+    title, class_name, subject = (str(v or "").strip() for v in (title, class_name, subject))
+    if not (title and class_name and subject):
+        raise ValueError("Exam title, class and subject are required")
+    try:
+        date = fmt_date(datetime.date.fromisoformat(str(date)))
+    except ValueError:
+        raise ValueError("Date must be YYYY-MM-DD") from None
+    start, end = schedule.parse_time(start_time), schedule.parse_time(end_time)
+    if end <= start:
+        raise ValueError("End time must be after start time")
+    return title, class_name, subject, date, schedule.fmt_time(start), schedule.fmt_time(end), str(room or "").strip()
+
+
+class Repository:
+    # Headless data access shared by the Tk views, scripts and tests.
+    #
+    # The repository owns a single long-lived connection. sqlite3 keeps a
+    # per-connection cache of prepared statements keyed on the SQL text, so
+    # reusing the connection and the constant queries below avoids both the
+    # connect/close cost and re-parsing on every action.
+    def __init__(self, path=None, cached_statements=256, timeout=None, cache_size=128):
+        # db.DB_PATH is read at call time so entry points can override it
+        self.path = path or db.DB_PATH
+        self.conn = connect(self.path, cached_statements=cached_statements, timeout=timeout)
+        self.lock = threading.RLock()
+        # optional school.instrument.QueryProfiler; see _run()
+        self.profiler = None
+        # view query results, see school.cache; cache_size=0 turns it off
+        self.cache = QueryCache(cache_size) if cache_size else None
+        with self.lock:
+            init_db(self.conn)
+        self.has_fts = self._scalar("SELECT COUNT(*) FROM sqlite_master WHERE name='students_fts'") > 0
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                # fold the WAL back into the main file; another terminal
+                # still reading just means it stays for the next checkpoint
+                try:
+                    self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                except sqlite3.OperationalError:
+                    pass
+                self.conn.close()
+                self.conn = None
+
+    def checkpoint(self, mode="PASSIVE"):
+        # copy committed WAL frames into the database file. PASSIVE never
+        # waits on readers or writers, so it is safe to run on a timer.
+        # Returns (busy, wal_frames, checkpointed_frames).
+        with self.lock:
+            return tuple(self.conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone())
+
+    def data_stamp(self, tables):
+        # compare two stamps to tell whether `tables` changed in between;
+        # None (no cache) means unknown, so always reload
+        if self.cache is None:
+            return None
+        with self.lock:
+            return self.cache.stamp(self.conn, tuple(t.lower() for t in tables))
+
+    # ---- low level helpers ----
+
+    @contextlib.contextmanager
+    def transaction(self):
+        with self.lock:
+            if self.conn.in_transaction:
+                # nested use joins the outer transaction
+                yield self.conn
+                return
+            self._begin_immediate()
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                if self.cache is not None:
+                    # results read inside the transaction may be rolled back
+                    self.cache.clear()
+                raise
+            self.conn.execute("COMMIT")
+
+    def _begin_immediate(self):
+        # take the write lock up front: a deferred transaction that reads
+        # first and upgrades later can fail with SQLITE_BUSY when another
+        # terminal committed in between, and nothing can be retried by then
+        for attempt in range(WRITE_RETRIES + 1):
+            try:
+                self.conn.execute("BEGIN IMMEDIATE")
+                return
+            except sqlite3.OperationalError as e:
+                if not is_busy(e) or attempt == WRITE_RETRIES:
+                    raise
+            time.sleep(RETRY_BACKOFF * (2**attempt) * random.uniform(0.5, 1.5))
+
+    def _run(self, sql, params, fetch, many=False):
+        # every statement goes through here so a profiler can time it,
+        # including the fetch, without touching the query methods
+        with self.lock:
+            run = self.conn.executemany if many else self.conn.execute
+            if self.cache is not None and not sql.lstrip()[:6].upper() == "SELECT":
+                self.cache.wrote(sql)
+            if self.profiler is None:
+                return fetch(run(sql, params))
+            t0 = time.perf_counter()
+            result = fetch(run(sql, params))
+            self.profiler.record(self.conn, sql, None if many else params, (time.perf_counter() - t0) * 1000)
+            return result
+
+    def _execute(self, sql, params=()):
+        return self._run(sql, params, lambda cur: cur)
+
+    def _executemany(self, sql, seq):
+        return self._run(sql, seq, lambda cur: cur, many=True)
+
+    def _fetchone(self, sql, params=()):
+        return self._run(sql, params, lambda cur: cur.fetchone())
+
+    def _fetchall(self, sql, params=()):
+        return self._run(sql, params, lambda cur: cur.fetchall())
+
+    def _scalar(self, sql, params=()):
+        row = self._fetchone(sql, params)
+        return row[0] if row else None
+
+    # ---- users ----
+
+    def authenticate(self, username, password):
+        row = self._fetchone("SELECT * FROM users WHERE username=? AND password=?", (username, password))
+        return dict(row) if row else None
+
+    def change_password(self, user_id, password):
+        with self.transaction():
+            self._execute("UPDATE users SET password=? WHERE id=?", (password, user_id))
+
+    def add_user(self, username, password, role):
+        # raises sqlite3.IntegrityError if the username is taken
+        with self.transaction():
+            self._execute("INSERT INTO users (username,password,role) VALUES (?,?,?)", (username, password, role))
+
+    # ---- students ----
+
+    @cached("students")
+    def count_students(self):
+        return self._scalar("SELECT COUNT(*) FROM students")
+
+    @cached("students")
+    def list_students(self, query=""):
+        if query.strip():
+            return self.search_students(query, limit=-1)
+        return self._fetchall("SELECT * FROM students ORDER BY id DESC")
+
+    @cached("students")
+    def search_students(self, query, limit=100):
+        # Best matches first. Uses the students_fts index (prefix match on
+        # name, admission no, guardian and phone, ranked by bm25); without
+        # FTS5 falls back to the old substring scan. limit=-1 means no limit.
+        match = fts_query(query)
+        if not match:
+            return []
+        if self.has_fts:
+            return self._fetchall(
+                "SELECT s.* FROM students_fts JOIN students s ON s.id = students_fts.rowid "
+                "WHERE students_fts MATCH ? ORDER BY bm25(students_fts, ?, ?, ?, ?, ?), s.id DESC LIMIT ?",
+                (match,) + SEARCH_WEIGHTS + (limit,),
+            )
+        q = query.strip().lower()
+        return self._fetchall(
+            "SELECT * FROM students WHERE lower(first_name)||' '||lower(last_name) LIKE ? OR lower(admission_no) LIKE ? ORDER BY id DESC LIMIT ?",
+            (f"%{q}%", f"%{q}%", limit),
+        )
+
+    @cached("students")
+    def students_page(self, after_id=None, before_id=None, limit=100):
+        # One page of the roster in id DESC order using keyset pagination:
+        # after_id continues below the last row shown, before_id pages back
+        # up above the first one. Cost depends on the page size only.
+        if before_id is not None:
+            rows = self._fetchall("SELECT * FROM students WHERE id > ? ORDER BY id ASC LIMIT ?", (before_id, limit))
+            rows.reverse()
+            return rows
+        if after_id is not None:
+            return self._fetchall("SELECT * FROM students WHERE id < ? ORDER BY id DESC LIMIT ?", (after_id, limit))
+        return self._fetchall("SELECT * FROM students ORDER BY id DESC LIMIT ?", (limit,))
+
+    @cached("students")
+    def students_in_class(self, classfilter=None):
+        if classfilter and classfilter != "All Classes":
+            return self._fetchall("SELECT * FROM students WHERE class LIKE ? ORDER BY id", (f"%{classfilter}%",))
+        return self._fetchall("SELECT * FROM students ORDER BY id")
+
+    @cached("students")
+    def get_student(self, sid):
+        return self._fetchone("SELECT * FROM students WHERE id=?", (sid,))
+
+    def existing_student_ids(self, sids):
+        # the ids among sids that belong to a student
+        sids, found = list(sids), set()
+        for i in range(0, len(sids), 500):
+            chunk = sids[i:i + 500]
+            found.update(r[0] for r in self._fetchall(f"SELECT id FROM students WHERE id IN ({','.join('?' * len(chunk))})", chunk))
+        return found
+
+    def find_student(self, admission_no):
+        return self._fetchone(
+            "SELECT id, first_name || ' ' || last_name AS name FROM students WHERE admission_no=?", (admission_no.strip(),)
+        )
+
+    def add_student(self, student):
+        # raises sqlite3.IntegrityError if the admission number is taken
+        now = datetime.datetime.now().isoformat()
+        with self.transaction():
+            cur = self._execute(
+                "INSERT INTO students (first_name,last_name,dob,admission_no,class,section,guardian_name,phone,created_at) VALUES (?,?,?,?,?,?,?,?,?)",
+                tuple(student[f] for f in STUDENT_FIELDS) + (now,),
+            )
+        return cur.lastrowid
+
+    def update_student(self, sid, student):
+        with self.transaction():
+            self._execute(
+                "UPDATE students SET first_name=?, last_name=?, dob=?, admission_no=?, class=?, section=?, guardian_name=?, phone=? WHERE id=?",
+                tuple(student[f] for f in STUDENT_FIELDS) + (sid,),
+            )
+
+    def import_students_batch(self, students, upsert=False):
+        # Insert a batch of student dicts (keyed by STUDENT_FIELDS; missing
+        # keys are stored as "" and left alone on update) in one transaction.
+        # Returns one outcome per row: "inserted", "updated" or "conflict"
+        # (admission_no already taken and upsert is off). Conflicts don't
+        # abort the batch.
+        now = datetime.datetime.now().isoformat()
+        outcomes = []
+        with self.transaction():
+            for student in students:
+                values = tuple(student.get(f, "") for f in STUDENT_FIELDS)
+                cur = self._execute(
+                    "INSERT INTO students (first_name,last_name,dob,admission_no,class,section,guardian_name,phone,created_at) "
+                    "VALUES (?,?,?,?,?,?,?,?,?) ON CONFLICT(admission_no) DO NOTHING",
+                    values + (now,),
+                )
+                if cur.rowcount:
+                    outcomes.append("inserted")
+                elif upsert:
+                    # only overwrite the columns the caller supplied
+                    cols = [f for f in STUDENT_FIELDS if f in student]
+                    self._execute(
+                        f"UPDATE students SET {', '.join(c + '=?' for c in cols)} WHERE admission_no=?",
+                        tuple(student[c] for c in cols) + (student["admission_no"],),
+                    )
+                    outcomes.append("updated")
+                else:
+                    outcomes.append("conflict")
+        return outcomes
+
+    def iter_students(self, batch_size=500):
+        # stream the table in id order, one keyset batch at a time, without
+        # holding the connection between batches
+        last = 0
+        while True:
+            rows = self._fetchall("SELECT * FROM students WHERE id > ? ORDER BY id LIMIT ?", (last, batch_size))
+            if not rows:
+                return
+            yield from rows
+            last = rows[-1]["id"]
+
+    def delete_student(self, sid):
+        with self.transaction():
+            self._execute("DELETE FROM students WHERE id=?", (sid,))
+
+    # ---- attendance ----
+
+    def mark_attendance(self, sid, date, status, marked_by):
+        self._check_not_archived(date)
+        with self.transaction():
+            # one statement thanks to UNIQUE(student_id, date)
+            self._execute(
+                "INSERT INTO attendance (student_id,date,status,marked_by) VALUES (?,?,?,?) "
+                "ON CONFLICT(student_id, date) DO UPDATE SET status=excluded.status, marked_by=excluded.marked_by",
+                (sid, date, status, marked_by),
+            )
+
+    def mark_attendance_bulk(self, date, marks, marked_by):
+        # marks: iterable of (student_id, status); the whole roll for one
+        # date is written as a single executemany upsert in one transaction
+        self._check_not_archived(date)
+        with self.transaction():
+            self._executemany(
+                "INSERT INTO attendance (student_id,date,status,marked_by) VALUES (?,?,?,?) "
+                "ON CONFLICT(student_id, date) DO UPDATE SET status=excluded.status, marked_by=excluded.marked_by",
+                ((sid, date, status, marked_by) for sid, status in marks),
+            )
+
+    @cached("students", "attendance")
+    def attendance_roster(self, date, classfilter=None):
+        # students (optionally filtered by class) with their status on date,
+        # or None where nothing is recorded, in one query
+        sql = (
+            "SELECT s.id, s.first_name, s.last_name, s.admission_no, s.class, a.status FROM students s "
+            "LEFT JOIN attendance a ON a.student_id=s.id AND a.date=?"
+        )
+        if classfilter and classfilter != "All Classes":
+            return self._fetchall(sql + " WHERE s.class LIKE ? ORDER BY s.id", (date, f"%{classfilter}%"))
+        return self._fetchall(sql + " ORDER BY s.id", (date,))
+
+    def iter_attendance(self, start, end, batch_size=5000):
+        # (student_id, date, status) for start <= date <= end, streamed in
+        # keyset batches on (date, id) along idx_attendance_date. Archived
+        # years are read from their files first; their date ranges don't
+        # overlap each other or the live table, so the output stays in date
+        # order.
+        sources = [(year, path, lo, hi) for year, path, lo, hi in self._archive_files(start, end)]
+        sources.append((None, None, start, end))
+        for year, path, lo, hi in sources:
+            last, hi = (max(start, lo), 0), min(end, hi)
+            while True:
+                with self._attached(year, path) as schema:
+                    rows = self._fetchall(
+                        f"SELECT id, student_id, date, status FROM {schema}.attendance WHERE (date, id) > (?, ?) AND date <= ? ORDER BY date, id LIMIT ?",
+                        last + (hi, batch_size),
+                    )
+                if not rows:
+                    break
+                for row in rows:
+                    yield row["student_id"], row["date"], row["status"]
+                last = (rows[-1]["date"], rows[-1]["id"])
+
+    # ---- archived attendance (see school.archive) ----
+
+    @cached("attendance_archives")
+    def attendance_archives(self):
+        return self._fetchall("SELECT * FROM attendance_archives ORDER BY year")
+
+    def archived_through(self):
+        # last archived date, or None; earlier dates are read-only
+        rows = self.attendance_archives()
+        return rows[-1]["end"] if rows else None
+
+    def _check_not_archived(self, date):
+        through = self.archived_through()
+        if through is not None and str(date) <= through:
+            raise ValueError(f"{date} is in an archived academic year")
+
+    def _archive_files(self, start, end):
+        # [(year, file path, start, end)] of the archives overlapping
+        # [start, end], oldest first
+        base = os.path.dirname(os.path.abspath(self.path))
+        files = []
+        for r in self.attendance_archives():
+            path = os.path.join(base, r["path"])
+            if r["start"] <= end and r["end"] >= start and os.path.exists(path):
+                files.append((r["year"], path, r["start"], r["end"]))
+        return files
+
+    @contextlib.contextmanager
+    def _attached(self, year, path):
+        # one yearly archive ATTACHed (under the lock) for the length of a
+        # query, as schema archive_<year>; year None is the live database.
+        # SQLite allows at most 10 attached databases, so they are never
+        # all attached at once.
+        if year is None:
+            yield "main"
+            return
+        schema = f"archive_{year}"
+        with self.lock:
+            self._execute(f"ATTACH DATABASE ? AS {schema}", (path,))
+            try:
+                yield schema
+            finally:
+                self._execute(f"DETACH DATABASE {schema}")
+
+    def attendance_months(self, sids, start, end):
+        # [(student_id, YYYY-MM, present, total)] for some students over
+        # [start, end], from the live table and any archived years it covers
+        match = f"student_id IN ({','.join('?' * len(sids))})"
+        months = {}
+        for year, path, _, _ in self._archive_files(start, end) + [(None, None, start, end)]:
+            with self._attached(year, path) as schema:
+                rows = self._fetchall(
+                    f"SELECT student_id, substr(date, 1, 7) AS month, SUM(status='Present'), COUNT(*) FROM {schema}.attendance "
+                    f"WHERE {match} AND date BETWEEN ? AND ? GROUP BY student_id, month",
+                    tuple(sids) + (start, end),
+                )
+            for sid, month, present, total in rows:
+                p, t = months.get((sid, month), (0, 0))
+                months[(sid, month)] = (p + present, t + total)
+        return [(sid, month, p, t) for (sid, month), (p, t) in sorted(months.items())]
+
+    @cached("students")
+    def class_sizes(self):
+        # {class: number of students}
+        return dict(self._fetchall("SELECT class, COUNT(*) FROM students WHERE class != '' GROUP BY class"))
+
+    @cached("students")
+    def student_names(self):
+        # {id: (name, class)} for labelling reports
+        rows = self._fetchall("SELECT id, first_name || ' ' || last_name AS name, class FROM students")
+        return {r["id"]: (r["name"], r["class"] or "") for r in rows}
+
+    @cached("attendance_daily")
+    def attendance_percent(self, start, end=None):
+        # percentage of Present marks in [start, end), or None without data;
+        # reads the attendance_daily rollup, not the attendance rows
+        if end is None:
+            row = self._fetchone("SELECT SUM(present), SUM(total) FROM attendance_daily WHERE date >= ?", (start,))
+        else:
+            row = self._fetchone("SELECT SUM(present), SUM(total) FROM attendance_daily WHERE date >= ? AND date < ?", (start, end))
+        if not row[1]:
+            return None
+        return round(row[0] / row[1] * 100, 1)
+
+    @cached("attendance_daily")
+    def attendance_trend(self, start, end):
+        # {"YYYY-MM": percent} for every month in [start, end) that has marks
+        rows = self._fetchall(
+            "SELECT substr(date, 1, 7) AS month, SUM(present) AS present, SUM(total) AS total FROM attendance_daily "
+            "WHERE date >= ? AND date < ? GROUP BY month",
+            (start, end),
+        )
+        return {r["month"]: round(r["present"] / r["total"] * 100, 1) for r in rows if r["total"]}
+
+    def recent_attendance(self, days=7):
+        # the window is resolved here so that a cached result from
+        # yesterday is never served after midnight
+        return self._attendance_since(fmt_date(datetime.date.today() - datetime.timedelta(days=days)))
+
+    @cached("attendance", "students")
+    def _attendance_since(self, d0):
+        return self._fetchall(
+            "SELECT a.date, a.status, s.first_name || ' ' || s.last_name AS student FROM attendance a JOIN students s ON s.id=a.student_id WHERE a.date >= ? ORDER BY a.date DESC",
+            (d0,),
+        )
+
+    # ---- fees & payments ----
+
+    @cached("fees")
+    def count_paid_fees(self):
+        return self._scalar("SELECT COUNT(*) FROM fees WHERE status='paid'")
+
+    def create_invoice(self, sid, description, amount, due_date):
+        now = datetime.datetime.now().isoformat()
+        with self.transaction():
+            cur = self._execute(
+                "INSERT INTO fees (student_id, description, amount, due_date, status, created_at) VALUES (?,?,?,?,?,?)",
+                (sid, description, amount, due_date, "pending", now),
+            )
+            fee_id = cur.lastrowid
+            credit = -(self.student_balance(sid) or 0)
+            self._adjust_balance(sid, invoiced=amount, now=now)
+            if credit > CENT:
+                # spend unallocated credit from earlier payments, oldest first
+                rows = self._fetchall(
+                    "SELECT p.id, p.amount - COALESCE(SUM(a.amount), 0) AS unallocated FROM payments p "
+                    "LEFT JOIN payment_allocations a ON a.payment_id=p.id WHERE p.student_id=? GROUP BY p.id "
+                    "HAVING unallocated > ? ORDER BY p.id",
+                    (sid, CENT),
+                )
+                for row in rows:
+                    if self._allocate(row["id"], sid, row["unallocated"]) > CENT:
+                        break  # payment not used up, so nothing is left open
+        return fee_id
+
+    def record_payment(self, sid, amount, method, tx_ref=""):
+        # Partial payments are allowed: the amount is spread over the
+        # student's open invoices oldest due first; anything left over stays
+        # on the balance as credit for the next invoice.
+        paid_at = datetime.datetime.now().isoformat()
+        with self.transaction():
+            cur = self._execute(
+                "INSERT INTO payments (fee_id, student_id, amount, method, tx_ref, paid_at) VALUES (?,?,?,?,?,?)",
+                (None, sid, amount, method, tx_ref, paid_at),
+            )
+            payment_id = cur.lastrowid
+            self._allocate(payment_id, sid, amount)
+            self._adjust_balance(sid, paid=amount, now=paid_at)
+        return payment_id
+
+    def _allocate(self, payment_id, sid, amount):
+        # apply up to amount of a payment to open invoices; returns the rest
+        remaining = amount
+        first_fee = None
+        for fee in self._fetchall(
+            "SELECT id, amount, paid_amount FROM fees WHERE student_id=? AND status != 'paid' ORDER BY due_date, id", (sid,)
+        ):
+            if remaining <= CENT:
+                break
+            take = round(min(fee["amount"] - fee["paid_amount"], remaining), 2)
+            if take <= 0:
+                continue
+            settled = fee["paid_amount"] + take >= fee["amount"] - CENT
+            self._execute(
+                "UPDATE fees SET paid_amount=paid_amount+?, status=? WHERE id=?", (take, "paid" if settled else "partial", fee["id"])
+            )
+            self._execute(
+                "INSERT INTO payment_allocations (payment_id, fee_id, amount) VALUES (?,?,?) "
+                "ON CONFLICT(payment_id, fee_id) DO UPDATE SET amount=amount+excluded.amount",
+                (payment_id, fee["id"], take),
+            )
+            first_fee = first_fee or fee["id"]
+            remaining = round(remaining - take, 2)
+        if first_fee is not None:
+            # payments.fee_id keeps pointing at the (first) invoice it paid
+            self._execute("UPDATE payments SET fee_id=? WHERE id=? AND fee_id IS NULL", (first_fee, payment_id))
+        return remaining
+
+    def _adjust_balance(self, sid, invoiced=0.0, paid=0.0, now=None):
+        self._execute(
+            "INSERT INTO balances (student_id, invoiced, paid, balance, updated_at) VALUES (?,?,?,?,?) "
+            "ON CONFLICT(student_id) DO UPDATE SET invoiced=invoiced+excluded.invoiced, paid=paid+excluded.paid, "
+            "balance=round(balance+excluded.balance, 2), updated_at=excluded.updated_at",
+            (sid, invoiced, paid, round(invoiced - paid, 2), now or datetime.datetime.now().isoformat()),
+        )
+
+    def rebuild_balances(self):
+        # recompute every balance from fees and payments (db.BALANCE_ROWS),
+        # e.g. after bulk loads that bypass create_invoice()/record_payment()
+        with self.transaction():
+            self._execute("DELETE FROM balances")
+            self._execute(
+                "INSERT INTO balances (student_id, invoiced, paid, balance, updated_at) "
+                f"SELECT student_id, invoiced, paid, balance, ? FROM ({db.BALANCE_ROWS.format(where='true')})",
+                (datetime.datetime.now().isoformat(),),
+            )
+
+    def refresh_balances(self, sids):
+        # recompute the balances of some students the same way, e.g. after
+        # school.sync stored another campus's rows
+        now = datetime.datetime.now().isoformat()
+        sids = list(sids)
+        with self.transaction():
+            for i in range(0, len(sids), 500):
+                chunk = sids[i:i + 500]
+                match = f"student_id IN ({','.join('?' * len(chunk))})"
+                self._execute(f"DELETE FROM balances WHERE {match}", chunk)
+                self._execute(
+                    "INSERT INTO balances (student_id, invoiced, paid, balance, updated_at) "
+                    f"SELECT student_id, invoiced, paid, balance, ? FROM ({db.BALANCE_ROWS.format(where=match)})",
+                    (now, *chunk),
+                )
+
+    def refresh_fees(self, fee_ids):
+        # recompute paid_amount and status of some invoices from their
+        # payment allocations, e.g. after school.sync stored payments made
+        # on another campus (a legacy overpayment still only settles the fee)
+        fee_ids = list(fee_ids)
+        with self.transaction():
+            for i in range(0, len(fee_ids), 500):
+                chunk = fee_ids[i:i + 500]
+                match = f"id IN ({','.join('?' * len(chunk))})"
+                self._execute(
+                    "UPDATE fees SET paid_amount=MIN(amount, COALESCE((SELECT round(SUM(a.amount), 2) FROM payment_allocations a WHERE a.fee_id=fees.id), 0)) "
+                    f"WHERE {match}",
+                    chunk,
+                )
+                self._execute(
+                    "UPDATE fees SET status=CASE WHEN paid_amount > 0 AND paid_amount >= amount - ? THEN 'paid' WHEN paid_amount > ? THEN 'partial' "
+                    f"ELSE 'pending' END WHERE {match}",
+                    (CENT, CENT, *chunk),
+                )
+
+    @cached("fees")
+    def student_fees(self, sid):
+        return self._fetchall(
+            "SELECT id, description, amount, paid_amount, due_date, status, created_at FROM fees WHERE student_id=? ORDER BY due_date, id",
+            (sid,),
+        )
+
+    @cached("balances")
+    def student_balance(self, sid):
+        return self._scalar("SELECT balance FROM balances WHERE student_id=?", (sid,))
+
+    @cached("balances", "students")
+    def outstanding_balances(self, limit=-1):
+        return self._fetchall(
+            "SELECT s.admission_no, s.first_name || ' ' || s.last_name AS student, s.class, b.invoiced, b.paid, b.balance "
+            "FROM balances b JOIN students s ON s.id=b.student_id WHERE b.balance > 0 ORDER BY b.balance DESC LIMIT ?",
+            (limit,),
+        )
+
+    def aging_report(self, today=None):
+        # Outstanding amounts per student by days past due: 0-30 (including
+        # not yet due), 31-60 and 60+. Reads only open invoices and their
+        # maintained paid_amount, never the payment history. today is part
+        # of the cache key, as in recent_attendance().
+        return self._aging_report(today or fmt_date())
+
+    @cached("fees", "balances", "students")
+    def _aging_report(self, today):
+        return self._fetchall(
+            """
+            SELECT s.admission_no, s.first_name || ' ' || s.last_name AS student, s.class,
+                   SUM(CASE WHEN age <= 30 THEN due ELSE 0 END) AS days_0_30,
+                   SUM(CASE WHEN age > 30 AND age <= 60 THEN due ELSE 0 END) AS days_31_60,
+                   SUM(CASE WHEN age > 60 THEN due ELSE 0 END) AS days_60_plus,
+                   SUM(due) AS total, b.balance
+            FROM (
+                SELECT student_id, amount - paid_amount AS due,
+                       COALESCE(julianday(?) - julianday(due_date), 0) AS age
+                FROM fees WHERE status != 'paid'
+            ) f
+            JOIN students s ON s.id=f.student_id
+            LEFT JOIN balances b ON b.student_id=f.student_id
+            GROUP BY f.student_id
+            HAVING total > 0
+            ORDER BY days_60_plus DESC, total DESC
+            """,
+            (today,),
+        )
+
+    @cached("payments", "students")
+    def recent_payments(self, limit=50):
+        return self._fetchall(
+            "SELECT p.amount, p.paid_at, p.method, s.first_name || ' ' || s.last_name AS student FROM payments p JOIN students s ON s.id=p.student_id ORDER BY p.paid_at DESC LIMIT ?",
+            (limit,),
+        )
+
+    def _payment_filter(self, student_id=None, method=None, start=None, end=None, fee_id=None):
+        # WHERE clause shared by payment_history() and payment_totals();
+        # dates are whole days, end inclusive
+        where, params = [], []
+        if student_id is not None:
+            where.append("p.student_id=?")
+            params.append(student_id)
+        if method:
+            where.append("p.method=?")
+            params.append(method)
+        if start:
+            where.append("p.paid_at >= ?")
+            params.append(start)
+        if end:
+            where.append("p.paid_at < ?")
+            params.append(fmt_date(datetime.date.fromisoformat(end) + datetime.timedelta(days=1)))
+        if fee_id is not None:
+            # every payment allocated to the invoice, not only the first one
+            where.append("p.id IN (SELECT payment_id FROM payment_allocations WHERE fee_id=?)")
+            params.append(fee_id)
+        return " AND ".join(where) or "true", params
+
+    @cached("payments", "payment_allocations")
+    def payment_totals(self, student_id=None, method=None, start=None, end=None, fee_id=None):
+        # (count, sum of amounts) of the payments matching the filters
+        where, params = self._payment_filter(student_id, method, start, end, fee_id)
+        row = self._fetchone(f"SELECT COUNT(*), COALESCE(SUM(p.amount), 0) FROM payments p WHERE {where}", params)
+        return row[0], round(row[1], 2)
+
+    @cached("payments", "payment_allocations", "students", "fees")
+    def payment_history(self, student_id=None, method=None, start=None, end=None, fee_id=None, before=None, newer=0.0, limit=100):
+        # One page of payments, newest first, by keyset on (paid_at, id):
+        # before is the (paid_at, id) of the previous page's last row and
+        # newer the sum of the amounts on all previous pages, so every page
+        # costs the same however far back it is. running is the filtered
+        # total up to and including each payment in date order, i.e. the
+        # grand total less everything newer.
+        where, params = self._payment_filter(student_id, method, start, end, fee_id)
+        if before is not None:
+            where += " AND (p.paid_at, p.id) < (?, ?)"
+            params += list(before)
+        _, total = self.payment_totals(student_id, method, start, end, fee_id)
+        return self._fetchall(
+            f"""
+            SELECT page.*, round(? - ? - COALESCE(SUM(amount) OVER (
+                       ORDER BY paid_at DESC, id DESC ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING), 0), 2) AS running
+            FROM (
+                SELECT p.id, p.paid_at, p.amount, p.method, p.tx_ref, p.fee_id, f.description AS fee,
+                       s.admission_no, s.first_name || ' ' || COALESCE(s.last_name, '') AS student
+                FROM payments p LEFT JOIN students s ON s.id=p.student_id LEFT JOIN fees f ON f.id=p.fee_id
+                WHERE {where} ORDER BY p.paid_at DESC, p.id DESC LIMIT ?
+            ) AS page
+            ORDER BY paid_at DESC, id DESC
+            """,
+            [total, newer] + params + [limit],
+        )
+
+    # ---- exams ----
+
+    @cached("exam_schedule")
+    def list_exam_schedules(self):
+        return self._fetchall("SELECT * FROM exam_schedule ORDER BY exam_date, start_time")
+
+    def exam_conflicts(self, class_name, date, start_time, end_time, room="", exclude_id=None):
+        # bookings on `date` that share the room or class and overlap
+        # [start_time, end_time); [(kind, row)] with kind "room" or "class"
+        exam = {"class": class_name, "room": room, "start_time": start_time, "end_time": end_time}
+        index = schedule.IntervalIndex(self._fetchall("SELECT * FROM exam_schedule WHERE exam_date=?", (date,)))
+        return index.conflicts(exam, exclude_id)
+
+    def add_exam_schedule(self, title, class_name, subject, date, start_time, end_time, room, allow_conflicts=False):
+        # raises ValueError on bad input and schedule.ScheduleConflict (also
+        # a ValueError) on a clash, unless allow_conflicts is set
+        row = validate_exam(title, class_name, subject, date, start_time, end_time, room)
+        title, class_name, subject, date, start_time, end_time, room = row
+        with self.transaction():
+            # checked under the write lock so two terminals can't both book
+            if not allow_conflicts:
+                conflicts = self.exam_conflicts(class_name, date, start_time, end_time, room)
+                if conflicts:
+                    raise schedule.ScheduleConflict(conflicts)
+            cur = self._execute(
+                "INSERT INTO exam_schedule (exam_title, class, subject, exam_date, start_time, end_time, room) VALUES (?,?,?,?,?,?,?)",
+                row,
+            )
+        return cur.lastrowid
+
+    def exam_schedules_between(self, start, end):
+        return self._fetchall("SELECT * FROM exam_schedule WHERE exam_date BETWEEN ? AND ? ORDER BY exam_date, start_time", (start, end))
+
+    def add_exam_schedules(self, rows, allow_conflicts=False):
+        # bulk insert of (title, class, subject, date, start, end, room) rows,
+        # e.g. a generated timetable. The batch is checked against itself and
+        # the existing bookings on its dates in one sweep; any clash raises
+        # ScheduleConflict and nothing is written.
+        rows = [validate_exam(*row) for row in rows]
+        if not rows:
+            return 0
+        dates = sorted({r[3] for r in rows})
+        with self.transaction():
+            if not allow_conflicts:
+                cols = ("exam_title", "class", "subject", "exam_date", "start_time", "end_time", "room")
+                new = [dict(zip(cols, r), id=None) for r in rows]
+                existing = self.exam_schedules_between(dates[0], dates[-1])
+                conflicts, _ = schedule.audit(list(existing) + new)
+                clashes = [(kind, a if b["id"] is None else b) for kind, a, b in conflicts if a["id"] is None or b["id"] is None]
+                if clashes:
+                    raise schedule.ScheduleConflict(clashes[:20])
+            self._executemany(
+                "INSERT INTO exam_schedule (exam_title, class, subject, exam_date, start_time, end_time, room) VALUES (?,?,?,?,?,?,?)",
+                rows,
+            )
+        return len(rows)
+
+    def audit_exam_schedule(self):
+        # (conflicts, invalid) over the whole timetable; see schedule.audit()
+        return schedule.audit(self.list_exam_schedules())
+
+    def delete_exam_schedule(self, exam_id):
+        with self.transaction():
+            self._execute("DELETE FROM exam_schedule WHERE id=?", (exam_id,))
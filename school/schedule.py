@@ -0,0 +1,153 @@
+import bisect
+import heapq
+import re
+
+# Exam timetable checks.
+#
+# Times are stored as "HH:MM" and compared as minutes since midnight; an
+# exam occupies the half-open interval [start, end), so 09:00-11:00 and
+# 11:00-12:00 in the same room do not clash. Two exams conflict when they
+# are on the same date and share a room or a class.
+#
+# Inserts check against an IntervalIndex of that day's bookings (bisect on
+# start plus a running maximum of end times); the whole-schedule audit is
+# a sweep over each (date, room) and (date, class) group sorted by start,
+# O(n log n + conflicts) instead of comparing every pair.
+
+_TIME = re.compile(r"^\s*(\d{1,2})(?:\s*[:.h]\s*(\d{2}))?\s*(am|pm|a\.m\.|p\.m\.)?\s*$", re.I)
+
+
+def parse_time(text):
+    # "9:00", "09.30", "14h15", "2pm", "2:30 p.m." -> minutes since midnight
+    m = _TIME.match(str(text or ""))
+    if not m:
+        raise ValueError(f"Invalid time {text!r}; use HH:MM")
+    hour, minute = int(m.group(1)), int(m.group(2) or 0)
+    suffix = (m.group(3) or "").lower().replace(".", "")
+    if suffix:
+        if not 1 <= hour <= 12:
+            raise ValueError(f"Invalid time {text!r}; use HH:MM")
+        hour = hour % 12 + (12 if suffix == "pm" else 0)
+    elif m.group(2) is None:
+        # a bare "9" is too easy to mistype
+        raise ValueError(f"Invalid time {text!r}; use HH:MM")
+    if hour > 23 or minute > 59:
+        raise ValueError(f"Invalid time {text!r}; use HH:MM")
+    return hour * 60 + minute
+
+
+def fmt_time(minutes):
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def _keys(exam):
+    # the resources an exam books; blank rooms/classes book nothing
+    keys = []
+    room = (exam["room"] or "").strip().lower()
+    if room:
+        keys.append(("room", room))
+    cls = (exam["class"] or "").strip().lower()
+    if cls:
+        keys.append(("class", cls))
+    return keys
+
+
+def _interval(exam):
+    # None for legacy rows whose times don't parse (see audit())
+    try:
+        start, end = parse_time(exam["start_time"]), parse_time(exam["end_time"])
+    except ValueError:
+        return None
+    return (start, end) if end > start else None
+
+
+class IntervalIndex:
+    # bookings of one day, grouped per room/class and sorted by start.
+    # ends_max[k][i] is the latest end among the first i+1 bookings, so an
+    # overlap query bisects to the last booking starting before `end` and
+    # walks back only while something could still reach past `start`.
+    def __init__(self, exams):
+        groups = {}
+        for exam in exams:
+            iv = _interval(exam)
+            if iv is None:
+                continue
+            for key in _keys(exam):
+                groups.setdefault(key, []).append((iv[0], iv[1], exam))
+        self.starts, self.ends_max, self.items = {}, {}, {}
+        for key, items in groups.items():
+            items.sort(key=lambda t: (t[0], t[1]))
+            running, ends = 0, []
+            for _, end, _ in items:
+                running = max(running, end)
+                ends.append(running)
+            self.starts[key] = [t[0] for t in items]
+            self.ends_max[key] = ends
+            self.items[key] = items
+
+    def overlapping(self, key, start, end):
+        starts = self.starts.get(key)
+        if not starts:
+            return []
+        ends_max, items = self.ends_max[key], self.items[key]
+        found = []
+        i = bisect.bisect_left(starts, end) - 1
+        while i >= 0 and ends_max[i] > start:
+            if items[i][1] > start:
+                found.append(items[i][2])
+            i -= 1
+        found.reverse()
+        return found
+
+    def conflicts(self, exam, exclude_id=None):
+        # [(kind, other_exam)] for bookings clashing with `exam`
+        iv = _interval(exam)
+        if iv is None:
+            return []
+        out, seen = [], set()
+        for key in _keys(exam):
+            for other in self.overlapping(key, *iv):
+                if other["id"] == exclude_id or (key[0], other["id"]) in seen:
+                    continue
+                seen.add((key[0], other["id"]))
+                out.append((key[0], other))
+        return out
+
+
+def audit(exams):
+    # whole-schedule check. Returns (conflicts, invalid): conflicts are
+    # (kind, exam_a, exam_b) with a starting no later than b; invalid are
+    # rows with no date, or whose times are missing, don't parse or end
+    # before they start, which can't be placed on the timeline at all.
+    groups, invalid = {}, []
+    for exam in exams:
+        iv = _interval(exam)
+        if iv is None or not exam["exam_date"]:
+            invalid.append(exam)
+            continue
+        for kind, value in _keys(exam):
+            groups.setdefault((exam["exam_date"], kind, value), []).append((iv[0], iv[1], exam))
+    conflicts = []
+    for (_, kind, _), items in sorted(groups.items(), key=lambda kv: kv[0]):
+        items.sort(key=lambda t: (t[0], t[1]))
+        active = []  # min-heap of (end, seq) for bookings still running
+        for seq, (start, end, exam) in enumerate(items):
+            while active and active[0][0] <= start:
+                heapq.heappop(active)
+            for _, j in sorted(active, key=lambda t: t[1]):
+                conflicts.append((kind, items[j][2], exam))
+            heapq.heappush(active, (end, seq))
+    return conflicts, invalid
+
+
+def describe(exam):
+    room = f", room {exam['room']}" if exam["room"] else ""
+    return f"{exam['exam_title']} ({exam['class']}) {exam['exam_date']} {exam['start_time']}-{exam['end_time']}{room}"
+
+
+class ScheduleConflict(ValueError):
+    # raised by Repository.add_exam_schedule; .conflicts is [(kind, exam)]
+    def __init__(self, conflicts):
+        lines = [f"{kind.title()} already booked: {describe(other)}" for kind, other in conflicts]
+        super().__init__("\n".join(lines))
+        self.conflicts = conflicts
@@ -0,0 +1,388 @@
+import asyncio
+import base64
+import json
+import logging
+import math
+import re
+import sqlite3
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+from .db import fmt_date
+from .repository import validate_attendance, validate_date, validate_payment, validate_payment_filters, validate_student
+from .schedule import ScheduleConflict
+
+log = logging.getLogger(__name__)
+
+# Local HTTP/JSON API over the school database, built on asyncio streams so
+# it needs nothing beyond the standard library:
+#
+#     python -m school serve --port 8080
+#
+# Requests authenticate with HTTP Basic against the users table. Every
+# SQLite call runs on a bounded thread pool; a semaphore caps how many
+# requests may be waiting for it so a burst queues instead of piling up
+# threads. Input is checked with the same validate_* rules as the desktop
+# dialogs.
+
+MAX_BODY = 1 << 20
+MAX_HEADERS = 100
+CHECKPOINT_SECONDS = 300
+REASONS = {200: "OK", 201: "Created", 400: "Bad Request", 401: "Unauthorized", 404: "Not Found", 405: "Method Not Allowed",
+           409: "Conflict", 413: "Payload Too Large", 500: "Internal Server Error",
+           501: "Not Implemented"}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _row(row):
+    return dict(row) if row is not None else None
+
+
+def _rows(rows):
+    return [dict(r) for r in rows]
+
+
+def _limit(query, default):
+    # ?limit= clamped to 1..1000; SQLite reads a negative LIMIT as no limit
+    return max(1, min(int(query.get("limit", default)), 1000))
+
+
+class ApiServer:
+    def __init__(self, repo, host="127.0.0.1", port=8080, max_workers=4, max_pending=256):
+        self.repo = repo
+        self.host = host
+        self.port = port
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="school-api")
+        self.pending = asyncio.Semaphore(max_pending)
+        self.server = None
+        # (method, compiled path, handler); path groups become arguments
+        self.routes = [
+            ("GET", r"/students", self.list_students),
+            ("POST", r"/students", self.create_student),
+            ("GET", r"/students/(\d+)", self.get_student),
+            ("PUT", r"/students/(\d+)", self.update_student),
+            ("DELETE", r"/students/(\d+)", self.delete_student),
+            ("GET", r"/students/(\d+)/fees", self.student_fees),
+            ("GET", r"/attendance", self.attendance),
+            ("POST", r"/attendance", self.mark_attendance),
+            ("POST", r"/fees", self.create_invoice),
+            ("GET", r"/payments", self.recent_payments),
+            ("GET", r"/payments/history", self.payment_history),
+            ("POST", r"/payments", self.record_payment),
+            ("GET", r"/balances", self.balances),
+            ("GET", r"/balances/aging", self.aging),
+            ("GET", r"/exams", self.exams),
+            ("POST", r"/exams", self.create_exam),
+            ("GET", r"/exams/conflicts", self.exam_conflicts),
+        ]
+        self.routes = [(m, re.compile(p + r"/?\Z"), h) for m, p, h in self.routes]
+
+    async def db(self, fn, *args):
+        # run a repository call on the bounded pool
+        async with self.pending:
+            return await asyncio.get_running_loop().run_in_executor(self.pool, fn, *args)
+
+    # ---- HTTP plumbing ----
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, self.host, self.port, backlog=512)
+        return self.server
+
+    async def serve_forever(self):
+        if self.server is None:
+            await self.start()
+        log.info("serving on http://%s:%s", self.host, self.port)
+        checkpoints = asyncio.create_task(self.checkpoint_loop())
+        try:
+            async with self.server:
+                await self.server.serve_forever()
+        finally:
+            checkpoints.cancel()
+
+    async def checkpoint_loop(self):
+        # keep the WAL shared with desktop terminals from growing unbounded
+        while True:
+            await asyncio.sleep(CHECKPOINT_SECONDS)
+            try:
+                await self.db(self.repo.checkpoint)
+            except Exception:
+                log.exception("checkpoint failed")
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await self.read_request(reader)
+                except HttpError as e:
+                    # the rest of the stream can't be trusted after a bad request
+                    await self.respond(writer, e.status, {"error": str(e)}, keep_alive=False)
+                    break
+                if request is None:
+                    break
+                method, target, version, headers, body = request
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+                status, payload = await self.dispatch(method, target, headers, body)
+                await self.respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def read_request(self, reader):
+        # (method, target, version, headers, body), or None once the client
+        # has closed the connection; HttpError(400/413/501) for a bad request
+        line = await self.read_line(reader)
+        if not line:
+            return None
+        try:
+            method, target, version = line.decode("latin-1").split()
+        except ValueError:
+            raise HttpError(400, "malformed request line") from None
+        headers = {}
+        while True:
+            h = await self.read_line(reader)
+            if h in (b"\r\n", b"\n", b""):
+                break
+            if len(headers) >= MAX_HEADERS:
+                raise HttpError(400, "too many headers")
+            name, _, value = h.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if "transfer-encoding" in headers:
+            # no chunked decoding; the body length would be unknown
+            raise HttpError(501, "Transfer-Encoding is not supported")
+        length = headers.get("content-length") or "0"
+        if not (length.isascii() and length.isdigit()):
+            raise HttpError(400, "invalid Content-Length")
+        if int(length) > MAX_BODY:
+            raise HttpError(413, "request body too large")
+        body = await reader.readexactly(int(length)) if int(length) else b""
+        return method, target, version, headers, body
+
+    async def read_line(self, reader):
+        # readline() raises ValueError for a line over the stream's limit
+        try:
+            return await reader.readline()
+        except (ValueError, asyncio.LimitOverrunError):
+            raise HttpError(400, "request or header line too long") from None
+
+    async def respond(self, writer, status, payload, keep_alive):
+        data = json.dumps(payload).encode()
+        head = (
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+        )
+        if status == 401:
+            head += 'WWW-Authenticate: Basic realm="school"\r\n'
+        writer.write(head.encode() + b"\r\n" + data)
+        await writer.drain()
+
+    async def dispatch(self, method, target, headers, body):
+        url = urllib.parse.urlsplit(target)
+        query = {k: v[-1] for k, v in urllib.parse.parse_qs(url.query).items()}
+        try:
+            user = await self.authenticate(headers)
+            allowed = False
+            for route_method, pattern, handler in self.routes:
+                m = pattern.match(url.path)
+                if not m:
+                    continue
+                allowed = True
+                if route_method == method:
+                    data = json.loads(body) if body else {}
+                    if not isinstance(data, dict):
+                        raise HttpError(400, "request body must be a JSON object")
+                    result = await handler(user, query, data, *m.groups())
+                    return (201, result) if method == "POST" else (200, result)
+            raise HttpError(405 if allowed else 404, "method not allowed" if allowed else "not found")
+        except HttpError as e:
+            return e.status, {"error": str(e)}
+        except ScheduleConflict as e:
+            return 409, {"error": "schedule conflict", "conflicts": [{"kind": k, "exam": dict(o)} for k, o in e.conflicts]}
+        except json.JSONDecodeError:
+            return 400, {"error": "invalid JSON"}
+        except ValueError as e:
+            return 400, {"error": str(e)}
+        except Exception:
+            log.exception("error handling %s %s", method, target)
+            return 500, {"error": "internal error"}
+
+    async def authenticate(self, headers):
+        scheme, _, token = headers.get("authorization", "").partition(" ")
+        if scheme.lower() == "basic":
+            try:
+                username, _, password = base64.b64decode(token).decode().partition(":")
+            except ValueError:
+                username = password = None
+            if username:
+                user = await self.db(self.repo.authenticate, username, password)
+                if user:
+                    return user
+        raise HttpError(401, "authentication required")
+
+    async def student_by_admission(self, admission_no):
+        row = await self.db(self.repo.find_student, str(admission_no or ""))
+        if not row:
+            raise HttpError(404, "Student admission number not found")
+        return row
+
+    # ---- students ----
+
+    async def list_students(self, user, query, data):
+        limit = _limit(query, 100)
+        if query.get("q"):
+            return _rows(await self.db(self.repo.search_students, query["q"], limit))
+        after = int(query["after"]) if "after" in query else None
+        return _rows(await self.db(self.repo.students_page, after, None, limit))
+
+    async def get_student(self, user, query, data, sid):
+        row = await self.db(self.repo.get_student, int(sid))
+        if not row:
+            raise HttpError(404, "Student not found")
+        return _row(row)
+
+    async def create_student(self, user, query, data):
+        student = validate_student(data)
+        try:
+            return {"id": await self.db(self.repo.add_student, student)}
+        except sqlite3.IntegrityError:
+            raise HttpError(409, "Admission number must be unique") from None
+
+    async def update_student(self, user, query, data, sid):
+        await self.get_student(user, query, data, sid)
+        student = validate_student(data)
+        try:
+            await self.db(self.repo.update_student, int(sid), student)
+        except sqlite3.IntegrityError:
+            raise HttpError(409, "Admission number must be unique") from None
+        return {"id": int(sid)}
+
+    async def delete_student(self, user, query, data, sid):
+        await self.get_student(user, query, data, sid)
+        await self.db(self.repo.delete_student, int(sid))
+        return {"id": int(sid)}
+
+    async def student_fees(self, user, query, data, sid):
+        fees = await self.db(self.repo.student_fees, int(sid))
+        balance = await self.db(self.repo.student_balance, int(sid))
+        return {"fees": _rows(fees), "balance": balance or 0}
+
+    # ---- attendance ----
+
+    async def attendance(self, user, query, data):
+        date = validate_date(query.get("date") or fmt_date())
+        return _rows(await self.db(self.repo.attendance_roster, date, query.get("class")))
+
+    async def mark_attendance(self, user, query, data):
+        # {"date": "YYYY-MM-DD", "marks": [{"student_id": 1, "status": "Present"}, ...]}
+        # admission_no may be given instead of student_id
+        date = validate_date(data.get("date") or fmt_date())
+        if not isinstance(data.get("marks") or [], list):
+            raise ValueError("marks must be a list")
+        marks = []
+        for mark in data.get("marks") or []:
+            if not isinstance(mark, dict):
+                raise ValueError("Each mark must be an object")
+            _, status = validate_attendance(date, mark.get("status"))
+            sid = mark.get("student_id")
+            if sid is None:
+                sid = (await self.student_by_admission(mark.get("admission_no")))["id"]
+            elif isinstance(sid, bool) or not isinstance(sid, (int, str)) or not (str(sid).isascii() and str(sid).isdigit()):
+                raise ValueError("student_id must be a whole number")
+            marks.append((int(sid), status))
+        if not marks:
+            raise ValueError("No marks given")
+        unknown = {sid for sid, _ in marks} - await self.db(self.repo.existing_student_ids, {sid for sid, _ in marks})
+        if unknown:
+            raise HttpError(404, f"No student with id {', '.join(map(str, sorted(unknown)))}")
+        await self.db(self.repo.mark_attendance_bulk, date, marks, user["id"])
+        return {"date": date, "marked": len(marks)}
+
+    # ---- fees & payments ----
+
+    async def create_invoice(self, user, query, data):
+        student = await self.student_by_admission(data.get("admission_no"))
+        amount, _, _ = validate_payment(data.get("amount"))
+        due_date = validate_date(data.get("due_date") or fmt_date())
+        fee_id = await self.db(self.repo.create_invoice, student["id"], data.get("description") or "Tuition", amount, due_date)
+        return {"id": fee_id}
+
+    async def record_payment(self, user, query, data):
+        student = await self.student_by_admission(data.get("admission_no"))
+        amount, method, tx_ref = validate_payment(data.get("amount"), data.get("method"), data.get("tx_ref"))
+        payment_id = await self.db(self.repo.record_payment, student["id"], amount, method, tx_ref)
+        balance = await self.db(self.repo.student_balance, student["id"])
+        return {"id": payment_id, "balance": balance or 0}
+
+    async def recent_payments(self, user, query, data):
+        return _rows(await self.db(self.repo.recent_payments, _limit(query, 50)))
+
+    async def payment_history(self, user, query, data):
+        # ?admission_no=&method=&from=&to=&fee=&limit=100; pass the returned
+        # "next" back as ?cursor= for the following (older) page
+        adm, filters = validate_payment_filters(query.get("admission_no"), query.get("method"), query.get("from"), query.get("to"), query.get("fee"))
+        args = [(await self.student_by_admission(adm))["id"] if adm else None] + [filters[k] for k in ("method", "start", "end", "fee_id")]
+        limit = _limit(query, 100)
+        before, newer = None, 0.0
+        if query.get("cursor"):
+            # "<paid_at>,<id>,<sum of the amounts already returned>"
+            try:
+                paid_at, pid, newer = query["cursor"].rsplit(",", 2)
+                before, newer = (paid_at, int(pid)), float(newer)
+                if not math.isfinite(newer):
+                    raise ValueError
+            except ValueError:
+                raise ValueError("Invalid cursor") from None
+        rows = await self.db(self.repo.payment_history, *args, before, newer, limit)
+        count, total = await self.db(self.repo.payment_totals, *args)
+        last = rows[-1] if rows and len(rows) == limit else None
+        cursor = f"{last['paid_at']},{last['id']},{round(newer + sum(r['amount'] for r in rows), 2)}" if last else None
+        return {"count": count, "total": total, "payments": _rows(rows), "next": cursor}
+
+    async def balances(self, user, query, data):
+        return _rows(await self.db(self.repo.outstanding_balances))
+
+    async def aging(self, user, query, data):
+        date = validate_date(query["date"]) if query.get("date") else None
+        return _rows(await self.db(self.repo.aging_report, date))
+
+    # ---- exams ----
+
+    async def exams(self, user, query, data):
+        return _rows(await self.db(self.repo.list_exam_schedules))
+
+    async def create_exam(self, user, query, data):
+        # {"exam_title", "class", "subject", "exam_date", "start_time",
+        # "end_time", "room", "allow_conflicts": false}; 409 on a clash
+        fields = [data.get(k) for k in ("exam_title", "class", "subject", "exam_date", "start_time", "end_time", "room")]
+        return {"id": await self.db(self.repo.add_exam_schedule, *fields, bool(data.get("allow_conflicts")))}
+
+    async def exam_conflicts(self, user, query, data):
+        conflicts, invalid = await self.db(self.repo.audit_exam_schedule)
+        return {
+            "conflicts": [{"kind": kind, "exams": [dict(a), dict(b)]} for kind, a, b in conflicts],
+            "invalid": _rows(invalid),
+        }
+
+
+def serve(repo, host="127.0.0.1", port=8080, max_workers=4):
+    server = ApiServer(repo, host, port, max_workers=max_workers)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
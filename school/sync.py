@@ -0,0 +1,447 @@
+import datetime
+import gzip
+import json
+
+# Delta sync between campus databases.
+#
+# Triggers (db._migration_7_change_log) append every change to students,
+# attendance, fees, payments and exam_schedule to change_log, numbered by
+# a sequence that only grows. An export to a peer carries one entry per
+# row changed since the sequence last sent to it, with the row's current
+# values under a key both databases understand (admission_no for
+# students, admission_no|date for attendance, a uid for the rest), so its
+# size follows the number of changed rows, not the size of the database.
+#
+# Applying a delta runs in one transaction with the 'sync' maintenance
+# flag raised, so the triggers stay quiet and the applied rows are logged
+# here with the peer as origin and the peer's change time instead; they
+# are relayed to other sites but never echoed back. When both sides
+# changed the same row, the later change wins (ties go to the larger site
+# id), so every site ends with the same row whatever order deltas arrive
+# in. This relies on the campuses' clocks being roughly right.
+#
+# Invoices travel without paid_amount/status: two campuses can each take
+# a payment on the same invoice, so after a delta is applied both are
+# recomputed from the payment allocations of every invoice it touched.
+# Attendance moved out by school.archive was not deleted: a log entry for
+# a mark archived before it was exported is dropped, not sent as a delete.
+# (Archived dates are no longer in the live table, so the receiving side
+# never finds a row there to change.)
+#
+# Databases copied from one another share a site id; run new_site() on
+# the copy before syncing them.
+
+FORMAT = "school-sync/1"
+
+# upserts are applied in this order so that referenced students and fees
+# exist first; deletes in the reverse order
+TABLES = ("students", "fees", "payments", "attendance", "exam_schedule")
+
+CHUNK = 500
+
+STUDENT_COLUMNS = ("first_name", "last_name", "dob", "class", "section", "guardian_name", "phone", "created_at")
+FEE_COLUMNS = ("description", "amount", "due_date", "created_at")
+PAYMENT_COLUMNS = ("amount", "method", "tx_ref", "paid_at")
+EXAM_COLUMNS = ("exam_title", "class", "subject", "exam_date", "start_time", "end_time", "room")
+
+
+def _uid(alias):
+    # same expression as the triggers' key for fees/payments/exam_schedule
+    return f"COALESCE({alias}.uid, (SELECT value FROM sync_meta WHERE key='site') || '-' || {alias}.id)"
+
+
+def site_id(repo):
+    return repo._scalar("SELECT value FROM sync_meta WHERE key='site'")
+
+
+def peers(repo):
+    return repo._fetchall("SELECT site, received, received_at, sent, sent_at FROM sync_peers ORDER BY site")
+
+
+def last_seq(repo):
+    return repo._scalar("SELECT COALESCE(MAX(seq), 0) FROM change_log")
+
+
+def _pruned_through(repo):
+    return int(repo._scalar("SELECT value FROM sync_meta WHERE key='pruned'") or 0)
+
+
+def _in_chunks(ids):
+    ids = list(ids)
+    for i in range(0, len(ids), CHUNK):
+        chunk = ids[i:i + CHUNK]
+        yield chunk, f"IN ({','.join('?' * len(chunk))})"
+
+
+# ---- export ----
+
+def _current_rows(repo, table, ids):
+    # {row id: (key, values)} for the rows of `table` that still exist
+    found = {}
+    for chunk, match in _in_chunks(ids):
+        if table == "students":
+            for r in repo._fetchall(f"SELECT id, admission_no, {', '.join(STUDENT_COLUMNS)} FROM students WHERE id {match}", chunk):
+                if r["admission_no"]:
+                    found[r["id"]] = (r["admission_no"], {c: r[c] for c in STUDENT_COLUMNS})
+        elif table == "attendance":
+            for r in repo._fetchall(
+                f"SELECT a.id, s.admission_no, a.date, a.status FROM attendance a JOIN students s ON s.id=a.student_id WHERE a.id {match}", chunk
+            ):
+                if r["admission_no"]:
+                    found[r["id"]] = (f"{r['admission_no']}|{r['date']}", {"student": r["admission_no"], "date": r["date"], "status": r["status"]})
+        elif table == "fees":
+            for r in repo._fetchall(
+                f"SELECT f.id, {_uid('f')} AS key, s.admission_no AS student, {', '.join('f.' + c for c in FEE_COLUMNS)} "
+                f"FROM fees f LEFT JOIN students s ON s.id=f.student_id WHERE f.id {match}",
+                chunk,
+            ):
+                found[r["id"]] = (r["key"], {"student": r["student"], **{c: r[c] for c in FEE_COLUMNS}})
+        elif table == "payments":
+            allocations = {}
+            for r in repo._fetchall(
+                f"SELECT a.payment_id, {_uid('f')} AS fee, a.amount FROM payment_allocations a JOIN fees f ON f.id=a.fee_id "
+                f"WHERE a.payment_id {match} ORDER BY a.payment_id, a.fee_id",
+                chunk,
+            ):
+                allocations.setdefault(r["payment_id"], []).append([r["fee"], r["amount"]])
+            for r in repo._fetchall(
+                f"SELECT p.id, {_uid('p')} AS key, s.admission_no AS student, CASE WHEN f.id IS NULL THEN NULL ELSE {_uid('f')} END AS fee, "
+                f"{', '.join('p.' + c for c in PAYMENT_COLUMNS)} FROM payments p "
+                f"LEFT JOIN students s ON s.id=p.student_id LEFT JOIN fees f ON f.id=p.fee_id WHERE p.id {match}",
+                chunk,
+            ):
+                found[r["id"]] = (r["key"], {
+                    "student": r["student"], "fee": r["fee"], **{c: r[c] for c in PAYMENT_COLUMNS}, "allocations": allocations.get(r["id"], []),
+                })
+        else:
+            for r in repo._fetchall(f"SELECT e.id, {_uid('e')} AS key, {', '.join(EXAM_COLUMNS)} FROM exam_schedule e WHERE e.id {match}", chunk):
+                found[r["id"]] = (r["key"], {c: r[c] for c in EXAM_COLUMNS})
+    return found
+
+
+def export_changes(repo, peer=None, since=None):
+    # the delta for `peer`: rows changed after `since` (default: what was
+    # last sent to it), minus changes that came from the peer itself.
+    # Records the export as sent.
+    me = site_id(repo)
+    if peer == me:
+        raise ValueError("That is this database's own site id")
+    if since is None:
+        since = repo._scalar("SELECT sent FROM sync_peers WHERE site=?", (peer,)) or 0 if peer else 0
+    if since < _pruned_through(repo):
+        raise ValueError(f"Changes up to {_pruned_through(repo)} were pruned; copy the whole database to the peer instead")
+    through = last_seq(repo)
+    archived_through = repo.archived_through()
+    # first and last log entry of each changed row: the first holds the key
+    # the peer knows the row by, the last when and where it last changed
+    touched = repo._fetchall(
+        """
+        WITH rows AS (
+            SELECT tbl, row_id, MIN(seq) AS first, MAX(seq) AS last FROM change_log WHERE seq > ? AND seq <= ? GROUP BY tbl, row_id
+        )
+        SELECT r.tbl, r.row_id, f.key AS known, l.changed_at, COALESCE(l.origin, ?) AS origin
+        FROM rows r JOIN change_log f ON f.seq=r.first JOIN change_log l ON l.seq=r.last ORDER BY r.last
+        """,
+        (since, through, me),
+    )
+    by_table = {}
+    for t in touched:
+        if t["origin"] != peer:
+            by_table.setdefault(t["tbl"], []).append(t)
+    changes = []
+    for table in TABLES:
+        entries = by_table.get(table, ())
+        current = _current_rows(repo, table, [t["row_id"] for t in entries])
+        for t in entries:
+            change = {"table": table, "at": t["changed_at"], "origin": t["origin"]}
+            row = current.get(t["row_id"])
+            if row is None:
+                if table == "attendance" and archived_through is not None and t["known"].rpartition("|")[2] <= archived_through:
+                    continue  # archived, not deleted
+                change.update(op="delete", key=t["known"])
+            else:
+                change.update(op="upsert", key=row[0], row=row[1])
+                if t["known"] != row[0]:
+                    change["prev"] = t["known"]
+            changes.append(change)
+    if peer:
+        now = datetime.datetime.now().isoformat()
+        with repo.transaction():
+            repo._execute(
+                "INSERT INTO sync_peers (site, sent, sent_at) VALUES (?,?,?) "
+                "ON CONFLICT(site) DO UPDATE SET sent=excluded.sent, sent_at=excluded.sent_at",
+                (peer, through, now),
+            )
+    return {
+        "format": FORMAT, "site": me, "peer": peer, "since": since, "through": through,
+        "created_at": datetime.datetime.now().isoformat(), "changes": changes,
+    }
+
+
+# ---- apply ----
+
+class _Applier:
+    def __init__(self, repo, me, peer):
+        self.repo = repo
+        self.me = me
+        self.peer = peer
+        self.students = {}  # admission_no -> id, filled on demand
+        self.balances = set()  # students whose fees/payments changed
+        self.fees = set()  # invoices whose allocations may have changed
+        self.stats = {"applied": 0, "conflicts": 0, "skipped": 0}
+        self.archived_through = repo.archived_through()
+
+    # -- lookups --
+
+    def student(self, admission_no):
+        if admission_no not in self.students:
+            self.students[admission_no] = self.repo._scalar("SELECT id FROM students WHERE admission_no=?", (admission_no,))
+        return self.students[admission_no]
+
+    def by_uid(self, table, key):
+        # rows created here are keyed by id until another site's copy is
+        # stored with its uid; everything else is found by uid
+        if key is None:
+            return None
+        site, _, rid = key.rpartition("-")
+        if site == self.me and rid.isdigit():
+            found = self.repo._scalar(f"SELECT id FROM {table} WHERE id=? AND uid IS NULL", (int(rid),))
+            if found is not None:
+                return found
+        return self.repo._scalar(f"SELECT id FROM {table} WHERE uid=?", (key,))
+
+    def attendance(self, key):
+        adm, _, date = key.rpartition("|")
+        sid = self.student(adm)
+        return None if sid is None else self.repo._scalar("SELECT id FROM attendance WHERE student_id=? AND date=?", (sid, date))
+
+    def find(self, change):
+        # (local row id or None, the key it is known by here); a renamed
+        # student or moved mark is looked up under its previous key first
+        table = change["table"]
+        if table not in ("students", "attendance"):
+            return self.by_uid(table, change["key"]), change["key"]
+        lookup = self.student if table == "students" else self.attendance
+        for key in (change.get("prev"), change["key"]):
+            if key is not None:
+                row_id = lookup(key)
+                if row_id is not None:
+                    return row_id, key
+        return None, change["key"]
+
+    def local_wins(self, table, row_id, change):
+        # the row's last change here is later than the incoming one
+        last = self.repo._fetchone(
+            "SELECT changed_at, COALESCE(origin, ?) AS origin FROM change_log WHERE tbl=? AND row_id=? ORDER BY seq DESC LIMIT 1",
+            (self.me, table, row_id),
+        )
+        return last is not None and (last["changed_at"], last["origin"]) > (change["at"], change["origin"])
+
+    def log(self, table, row_id, key, op, change):
+        self.repo._execute(
+            "INSERT INTO change_log (tbl, row_id, key, op, origin, changed_at) VALUES (?,?,?,?,?,?)",
+            (table, row_id, key, op, change["origin"], change["at"]),
+        )
+
+    # -- writes --
+
+    def apply(self, change):
+        table = change["table"]
+        if table not in TABLES or change["op"] not in ("upsert", "delete"):
+            raise ValueError(f"Unknown change {table} {change['op']}")
+        row_id, known = self.find(change)
+        if row_id is not None and self.local_wins(table, row_id, change):
+            self.stats["conflicts"] += 1
+            return
+        if change["op"] == "delete":
+            if row_id is not None:
+                self.delete(table, row_id, known, change)
+            return
+        op = "I" if row_id is None else "U"
+        row_id = getattr(self, "upsert_" + table)(row_id, change["key"], change["row"])
+        if row_id is None:
+            self.stats["skipped"] += 1
+            return
+        if table == "students":
+            self.students.pop(known, None)
+            self.students[change["key"]] = row_id
+        self.log(table, row_id, known, op, change)
+        self.stats["applied"] += 1
+
+    def delete(self, table, row_id, known, change):
+        if table == "payments":
+            self.fees.update(self.allocated(row_id))
+        if table in ("fees", "payments"):
+            self.balances.add(self.repo._scalar(f"SELECT student_id FROM {table} WHERE id=?", (row_id,)))
+            column = "fee_id" if table == "fees" else "payment_id"
+            self.repo._execute(f"DELETE FROM payment_allocations WHERE {column}=?", (row_id,))
+        self.repo._execute(f"DELETE FROM {table} WHERE id=?", (row_id,))
+        if table == "students":
+            self.students.pop(known, None)
+        self.log(table, row_id, known, "D", change)
+        self.stats["applied"] += 1
+
+    def allocated(self, payment_id):
+        return [r[0] for r in self.repo._fetchall("SELECT fee_id FROM payment_allocations WHERE payment_id=?", (payment_id,))]
+
+    def upsert_students(self, row_id, key, row):
+        other = self.student(key)
+        if other is not None and other != row_id:
+            return None  # renamed to an admission number taken here
+        values = tuple(row.get(c) for c in STUDENT_COLUMNS)
+        if row_id is None:
+            row_id = self.repo._execute(
+                f"INSERT INTO students (admission_no, {', '.join(STUDENT_COLUMNS)}) VALUES (?{',?' * len(STUDENT_COLUMNS)})", (key,) + values
+            ).lastrowid
+        else:
+            self.repo._execute(
+                f"UPDATE students SET admission_no=?, {', '.join(c + '=?' for c in STUDENT_COLUMNS)} WHERE id=?", (key,) + values + (row_id,)
+            )
+        return row_id
+
+    def upsert_attendance(self, row_id, key, row):
+        sid = self.student(row["student"])
+        if sid is None or (self.archived_through is not None and row["date"] <= self.archived_through):
+            return None
+        if row_id is None:
+            return self.repo._execute("INSERT INTO attendance (student_id, date, status) VALUES (?,?,?)", (sid, row["date"], row["status"])).lastrowid
+        self.repo._execute("UPDATE attendance SET student_id=?, date=?, status=? WHERE id=?", (sid, row["date"], row["status"], row_id))
+        return row_id
+
+    def upsert_fees(self, row_id, key, row):
+        sid = self.student(row["student"])
+        if sid is None:
+            return None
+        values = tuple(row.get(c) for c in FEE_COLUMNS)
+        if row_id is None:
+            row_id = self.repo._execute(
+                f"INSERT INTO fees (uid, student_id, status, {', '.join(FEE_COLUMNS)}) VALUES (?,?,'pending'{',?' * len(FEE_COLUMNS)})",
+                (key, sid) + values,
+            ).lastrowid
+        else:
+            self.balances.add(self.repo._scalar("SELECT student_id FROM fees WHERE id=?", (row_id,)))
+            self.repo._execute(f"UPDATE fees SET student_id=?, {', '.join(c + '=?' for c in FEE_COLUMNS)} WHERE id=?", (sid,) + values + (row_id,))
+        self.balances.add(sid)
+        self.fees.add(row_id)
+        return row_id
+
+    def upsert_payments(self, row_id, key, row):
+        sid = self.student(row["student"])
+        if sid is None:
+            return None
+        values = (sid, self.by_uid("fees", row["fee"])) + tuple(row.get(c) for c in PAYMENT_COLUMNS)
+        if row_id is None:
+            row_id = self.repo._execute(
+                f"INSERT INTO payments (uid, student_id, fee_id, {', '.join(PAYMENT_COLUMNS)}) VALUES (?,?,?{',?' * len(PAYMENT_COLUMNS)})",
+                (key,) + values,
+            ).lastrowid
+        else:
+            self.balances.add(self.repo._scalar("SELECT student_id FROM payments WHERE id=?", (row_id,)))
+            self.repo._execute(
+                f"UPDATE payments SET student_id=?, fee_id=?, {', '.join(c + '=?' for c in PAYMENT_COLUMNS)} WHERE id=?", values + (row_id,)
+            )
+            self.fees.update(self.allocated(row_id))
+            self.repo._execute("DELETE FROM payment_allocations WHERE payment_id=?", (row_id,))
+        allocations = [(row_id, fee_id, amount) for fee_id, amount in ((self.by_uid("fees", f), a) for f, a in row.get("allocations", ())) if fee_id]
+        self.repo._executemany("INSERT INTO payment_allocations (payment_id, fee_id, amount) VALUES (?,?,?)", allocations)
+        self.fees.update(fee_id for _, fee_id, _ in allocations)
+        self.balances.add(sid)
+        return row_id
+
+    def upsert_exam_schedule(self, row_id, key, row):
+        # the sending site has already checked (or accepted) its clashes
+        values = tuple(row.get(c) for c in EXAM_COLUMNS)
+        if row_id is None:
+            return self.repo._execute(
+                f"INSERT INTO exam_schedule (uid, {', '.join(EXAM_COLUMNS)}) VALUES (?{',?' * len(EXAM_COLUMNS)})", (key,) + values
+            ).lastrowid
+        self.repo._execute(f"UPDATE exam_schedule SET {', '.join(c + '=?' for c in EXAM_COLUMNS)} WHERE id=?", values + (row_id,))
+        return row_id
+
+
+def apply_changes(repo, delta):
+    # apply a delta from export_changes() in one transaction; returns
+    # {"applied", "conflicts" (kept the later local change), "skipped"
+    # (unknown student, archived date, admission number taken)}
+    if delta.get("format") != FORMAT:
+        raise ValueError("Not a school sync file")
+    me, peer = site_id(repo), delta["site"]
+    if peer == me:
+        raise ValueError("This delta came from this database's own site id; if one database is a copy of the other, run new-site on the copy")
+    if delta["peer"] not in (None, me):
+        raise ValueError(f"This delta was exported for site {delta['peer']}, not {me}")
+    received = repo._scalar("SELECT received FROM sync_peers WHERE site=?", (peer,)) or 0
+    if delta["through"] <= received:
+        return {"applied": 0, "conflicts": 0, "skipped": 0, "already": True}
+    if delta["since"] > received:
+        raise ValueError(f"Changes {received + 1}..{delta['since']} of site {peer} are missing; export again there with --since {received}")
+    order = {t: i for i, t in enumerate(TABLES)}
+    upserts = sorted((c for c in delta["changes"] if c["op"] == "upsert"), key=lambda c: order.get(c["table"], len(TABLES)))
+    deletes = sorted((c for c in delta["changes"] if c["op"] == "delete"), key=lambda c: -order.get(c["table"], -1))
+    applier = _Applier(repo, me, peer)
+    with repo.transaction():
+        repo._execute("INSERT INTO maintenance (flag) VALUES ('sync')")
+        for change in upserts + deletes:
+            applier.apply(change)
+        # each campus derives paid_amount/status itself, so not logged
+        fees = [f for f in applier.fees if f is not None]
+        if fees:
+            repo.refresh_fees(fees)
+            for chunk, match in _in_chunks(fees):
+                applier.balances.update(r[0] for r in repo._fetchall(f"SELECT student_id FROM fees WHERE id {match}", chunk))
+        repo._execute("DELETE FROM maintenance WHERE flag='sync'")
+        applier.balances.discard(None)
+        if applier.balances:
+            repo.refresh_balances(applier.balances)
+        repo._execute(
+            "INSERT INTO sync_peers (site, received, received_at) VALUES (?,?,?) "
+            "ON CONFLICT(site) DO UPDATE SET received=excluded.received, received_at=excluded.received_at",
+            (peer, delta["through"], datetime.datetime.now().isoformat()),
+        )
+    return applier.stats
+
+
+# ---- files and housekeeping ----
+
+def write_delta(delta, path):
+    # JSON, gzipped when the name ends in .gz
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "wt", encoding="utf-8") as f:
+        json.dump(delta, f, separators=(",", ":"))
+
+
+def read_delta(path):
+    opener = gzip.open if path.endswith(".gz") else open
+    try:
+        with opener(path, "rt", encoding="utf-8") as f:
+            return json.load(f)
+    except (json.JSONDecodeError, gzip.BadGzipFile, UnicodeDecodeError) as e:
+        raise ValueError(f"{path}: not a school sync file ({e})") from None
+
+
+def new_site(repo):
+    # give a copied database its own site id. Rows it shares with the
+    # original keep the key they had, so both sides still match them up.
+    with repo.transaction():
+        old = site_id(repo)
+        repo._execute("INSERT INTO maintenance (flag) VALUES ('sync')")
+        for table in ("fees", "payments", "exam_schedule"):
+            repo._execute(f"UPDATE {table} SET uid=? || '-' || id WHERE uid IS NULL", (old,))
+        repo._execute("DELETE FROM maintenance WHERE flag='sync'")
+        repo._execute("UPDATE sync_meta SET value=lower(hex(randomblob(8))) WHERE key='site'")
+        repo._execute("DELETE FROM sync_peers")
+        return site_id(repo)
+
+
+def prune(repo):
+    # drop log entries every known peer has been sent; returns how many
+    with repo.transaction():
+        through = repo._scalar("SELECT MIN(sent) FROM sync_peers")
+        if not through:
+            return 0
+        removed = repo._execute("DELETE FROM change_log WHERE seq <= ?", (through,)).rowcount
+        repo._execute(
+            "INSERT INTO sync_meta (key, value) VALUES ('pruned', ?) ON CONFLICT(key) DO UPDATE SET value=MAX(CAST(value AS INTEGER), excluded.value)",
+            (through,),
+        )
+    return removed
@@ -0,0 +1,317 @@
+import bisect
+import collections
+import csv
+import datetime
+import heapq
+import random
+import time
+
+from .db import fmt_date
+from .schedule import fmt_time, parse_time
+
+# Exam timetable generator.
+#
+# Each paper (one class sitting one subject) needs a slot (a date and a
+# start time) and a room that seats the class. Papers of the same class
+# conflict; slots are the colours of that conflict graph, and the rooms
+# free in a slot bound how many papers it can take. Placement is DSatur:
+# the paper whose class already blocks the most slots goes next, into the
+# cheapest slot that still has a room for it. Local search then moves and
+# swaps papers to spread each class's exams over the window (two papers on
+# one day, or on consecutive days, cost a penalty). Slots, rooms and classes
+# already booked in exam_schedule are left alone.
+
+SAME_DAY = 10
+NEXT_DAY = 1
+
+
+def _name(value):
+    return (value or "").strip().lower()
+
+
+class Paper:
+    __slots__ = ("index", "class_name", "key", "subject", "duration", "title", "size")
+
+    def __init__(self, index, class_name, subject, duration, title, size):
+        self.index = index
+        self.class_name = class_name
+        self.key = _name(class_name)  # "Grade X" and "grade x" are one class
+        self.subject = subject
+        self.duration = duration
+        self.title = title
+        self.size = size
+
+
+def school_days(start, end, weekdays=(0, 1, 2, 3, 4)):
+    day, end = datetime.date.fromisoformat(start), datetime.date.fromisoformat(end)
+    days = []
+    while day <= end:
+        if day.weekday() in weekdays:
+            days.append(fmt_date(day))
+        day += datetime.timedelta(days=1)
+    return days
+
+
+class Timetable:
+    def __init__(self, papers, rooms, dates, slot_times, slot_length, existing=(), seed=0):
+        # papers: dicts with class, subject, duration (minutes), optional
+        # title and size (students sitting it); rooms: {name: capacity};
+        # dates: ISO dates; slot_times: start times per day ("09:00", ...);
+        # existing: exam_schedule rows that keep their rooms and classes
+        self.rng = random.Random(seed)
+        self.dates = list(dates)
+        starts = sorted(parse_time(t) for t in slot_times)
+        # papers in one slot may run its full length, so slots must not overlap
+        for a, b in zip(starts, starts[1:]):
+            if b - a < slot_length:
+                raise ValueError(f"Slots at {fmt_time(a)} and {fmt_time(b)} are less than the {slot_length} minute slot length apart")
+        self.slots = [(d, s) for d in range(len(self.dates)) for s in starts]
+        self.slot_length = slot_length
+        self.papers = []
+        for i, p in enumerate(papers):
+            duration = int(p.get("duration") or slot_length)
+            if duration <= 0:
+                raise ValueError(f"Paper {p.get('class')} {p.get('subject')}: duration must be positive")
+            self.papers.append(Paper(i, str(p["class"]), str(p["subject"]), duration, p.get("title") or "Exam", int(p.get("size") or 0)))
+        self.rooms = dict(rooms)
+        self.by_class = collections.defaultdict(list)
+        for p in self.papers:
+            self.by_class[p.key].append(p.index)
+
+        # free rooms per slot as a sorted (capacity, name) list for best fit
+        blocked_rooms, self.blocked_classes = self._blocked(existing, starts)
+        all_rooms = sorted((cap, name) for name, cap in self.rooms.items())
+        self.free = [[r for r in all_rooms if (c, _name(r[1])) not in blocked_rooms] for c in range(len(self.slots))]
+
+        self.slot_of = [None] * len(self.papers)
+        self.room_of = [None] * len(self.papers)
+        self.class_slots = collections.defaultdict(set)
+        self.class_days = collections.defaultdict(collections.Counter)
+        self.unplaced = []
+        self.penalty = 0
+
+    def _blocked(self, existing, starts):
+        # (slot, room) pairs and class -> slots taken by bookings overlapping
+        # a slot's [start, start + slot_length); names compared as in
+        # school.schedule, ignoring case and surrounding spaces
+        day_index = {d: i for i, d in enumerate(self.dates)}
+        rooms, classes = set(), collections.defaultdict(set)
+        for row in existing:
+            d = day_index.get(row["exam_date"])
+            if d is None:
+                continue
+            try:
+                b0, b1 = parse_time(row["start_time"]), parse_time(row["end_time"])
+            except ValueError:
+                continue
+            for k, s in enumerate(starts):
+                if b0 < s + self.slot_length and s < b1:
+                    c = d * len(starts) + k
+                    if _name(row["room"]):
+                        rooms.add((c, _name(row["room"])))
+                    if _name(row["class"]):
+                        classes[_name(row["class"])].add(c)
+        return rooms, classes
+
+    # ---- state ----
+
+    def _room_for(self, paper, c):
+        free = self.free[c]
+        i = bisect.bisect_left(free, (paper.size, ""))
+        return free[i] if i < len(free) else None
+
+    def _allowed(self, paper, c):
+        return (
+            paper.duration <= self.slot_length
+            and c not in self.class_slots[paper.key]
+            and c not in self.blocked_classes.get(paper.key, ())
+        )
+
+    def _day_cost(self, key, day):
+        # penalty of adding one more exam for the class on `day`
+        days = self.class_days[key]
+        return days[day] * SAME_DAY + (days[day - 1] + days[day + 1]) * NEXT_DAY
+
+    def _place(self, paper, c, room):
+        self.free[c].remove(room)
+        self.slot_of[paper.index], self.room_of[paper.index] = c, room
+        self.penalty += self._day_cost(paper.key, self.slots[c][0])
+        self.class_slots[paper.key].add(c)
+        self.class_days[paper.key][self.slots[c][0]] += 1
+
+    def _unplace(self, paper):
+        c, room = self.slot_of[paper.index], self.room_of[paper.index]
+        self.class_slots[paper.key].discard(c)
+        self.class_days[paper.key][self.slots[c][0]] -= 1
+        self.penalty -= self._day_cost(paper.key, self.slots[c][0])
+        bisect.insort(self.free[c], room)
+        self.slot_of[paper.index] = self.room_of[paper.index] = None
+        return c, room
+
+    # ---- construction: DSatur ----
+
+    def solve(self, seconds=2.0):
+        deadline = time.perf_counter() + seconds
+        sat = {key: len(self.blocked_classes.get(key, ())) for key in self.by_class}
+
+        def entry(p):
+            return (-sat[p.key], -len(self.by_class[p.key]), -p.size, p.index)
+
+        # heap of (-saturation, -class papers, -students, index); placing a
+        # paper raises its classmates' saturation, so they are pushed again
+        # and the older entries are skipped when popped
+        heap, done = [], set()
+        for p in self.papers:
+            if p.duration > self.slot_length:
+                self.unplaced.append((p, f"longer than the {self.slot_length} minute slot"))
+                done.add(p.index)
+            else:
+                heap.append(entry(p))
+        heapq.heapify(heap)
+        while heap:
+            s, _, _, i = heapq.heappop(heap)
+            paper = self.papers[i]
+            if i in done or -s != sat[paper.key]:
+                continue
+            done.add(i)
+            best = None
+            for c in range(len(self.slots)):
+                if not self._allowed(paper, c):
+                    continue
+                room = self._room_for(paper, c)
+                if room is None:
+                    continue
+                cost = self._day_cost(paper.key, self.slots[c][0])
+                if best is None or cost < best[0]:
+                    best = (cost, c, room)
+                    if cost == 0:
+                        break
+            if best is None:
+                reason = "no room large enough" if not any(cap >= paper.size for cap in self.rooms.values()) else "no free slot"
+                self.unplaced.append((paper, reason))
+                continue
+            self._place(paper, best[1], best[2])
+            sat[paper.key] += 1
+            for j in self.by_class[paper.key]:
+                if j not in done:
+                    heapq.heappush(heap, entry(self.papers[j]))
+        self.improve(deadline)
+        return self
+
+    # ---- improvement: moves and swaps ----
+
+    def improve(self, deadline, patience=50):
+        # random moves/swaps, accepting sideways steps to cross plateaus;
+        # stops at zero penalty, the deadline, or `patience` rounds of 200
+        # tries without a strict improvement
+        placed = [p for p in self.papers if self.slot_of[p.index] is not None]
+        slots = range(len(self.slots))
+        best, stale = self.penalty, 0
+        while placed and self.penalty and stale < patience and time.perf_counter() < deadline:
+            for _ in range(200):
+                paper = self.rng.choice(placed)
+                if self.rng.random() < 0.5:
+                    self._try_move(paper, self.rng.choice(slots))
+                else:
+                    self._try_swap(paper, self.rng.choice(placed))
+            stale = 0 if self.penalty < best else stale + 1
+            best = min(best, self.penalty)
+
+    def _try_move(self, paper, c):
+        if not self._allowed(paper, c):
+            return
+        before = self.penalty
+        old_c, old_room = self._unplace(paper)
+        room = self._room_for(paper, c)
+        if room is not None:
+            self._place(paper, c, room)
+            if self.penalty <= before:
+                return
+            self._unplace(paper)
+        self._place(paper, old_c, old_room)
+
+    def _try_swap(self, a, b):
+        # exchange the slots (and rooms) of papers from different classes
+        if a.key == b.key:
+            return
+        ca, cb = self.slot_of[a.index], self.slot_of[b.index]
+        if ca == cb:
+            return
+        before = self.penalty
+        _, ra = self._unplace(a)
+        _, rb = self._unplace(b)
+        if self._allowed(a, cb) and self._allowed(b, ca) and rb[0] >= a.size and ra[0] >= b.size:
+            self._place(a, cb, rb)
+            self._place(b, ca, ra)
+            if self.penalty <= before:
+                return
+            self._unplace(a)
+            self._unplace(b)
+        self._place(a, ca, ra)
+        self._place(b, cb, rb)
+
+    # ---- output ----
+
+    def rows(self):
+        # exam_schedule rows, in date/time order
+        out = []
+        for p in self.papers:
+            c = self.slot_of[p.index]
+            if c is None:
+                continue
+            day, start = self.slots[c]
+            out.append((p.title, p.class_name, p.subject, self.dates[day], fmt_time(start), fmt_time(start + p.duration), self.room_of[p.index][1]))
+        out.sort(key=lambda r: (r[3], r[4], r[6]))
+        return out
+
+
+def read_papers(fileobj, title="Term Exam"):
+    # CSV with class,subject and optional duration (minutes), title columns
+    papers = []
+    for r in csv.DictReader(fileobj):
+        if not (r.get("class") or "").strip() or not (r.get("subject") or "").strip():
+            raise ValueError(f"Line {len(papers) + 2}: class and subject are required")
+        try:
+            duration = int(r.get("duration") or 0) or None
+        except ValueError:
+            raise ValueError(f"Line {len(papers) + 2}: duration must be whole minutes") from None
+        papers.append({"class": r["class"].strip(), "subject": r["subject"].strip(), "duration": duration, "title": (r.get("title") or "").strip() or title})
+    return papers
+
+
+def parse_rooms(spec):
+    # "Hall:120, R1:40" -> {"Hall": 120, "R1": 40}; a bare name has no limit.
+    # Names differing only in case are one room: the first spelling is kept
+    # with the largest capacity given.
+    rooms, spelling = {}, {}
+    for part in spec.split(","):
+        name, sep, cap = part.strip().rpartition(":")
+        if not sep:
+            name, cap = cap, None
+        if name.strip():
+            try:
+                cap = int(cap) if cap else 10**6
+            except ValueError:
+                raise ValueError(f"Invalid room capacity in {part.strip()!r}") from None
+            name = spelling.setdefault(_name(name), name.strip())
+            rooms[name] = max(rooms.get(name, 0), cap)
+    return rooms
+
+
+def generate(repo, papers, rooms, start, end, slot_times=("09:00", "13:00"), slot_length=180, seconds=2.0, seed=0, write=True):
+    # plan papers into [start, end] around the existing timetable and
+    # (optionally) insert the result; returns the solved Timetable
+    dates = school_days(start, end)
+    if not dates:
+        raise ValueError("No school days in the date window")
+    if not rooms:
+        raise ValueError("At least one room is needed")
+    sizes = {}
+    for name, size in repo.class_sizes().items():
+        sizes[_name(name)] = sizes.get(_name(name), 0) + size
+    papers = [dict(p, size=p.get("size") or sizes.get(_name(p["class"]), 0)) for p in papers]
+    existing = repo.exam_schedules_between(dates[0], dates[-1])
+    table = Timetable(papers, rooms, dates, slot_times, slot_length, existing, seed).solve(seconds)
+    if write:
+        repo.add_exam_schedules(table.rows())
+    return table
@@ -0,0 +1,53 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from school import archive, documents  # noqa: E402
+from school.repository import Repository  # noqa: E402
+
+YEARS = range(2010, 2022)  # more years than SQLite can ATTACH at once
+
+
+def marked_database(path):
+    repo = Repository(str(path))
+    sids = [r["id"] for r in repo._fetchall("SELECT id FROM students ORDER BY id")]
+    for year in YEARS:
+        repo.mark_attendance_bulk(f"{year}-09-10", [(sid, "Present") for sid in sids], 1)
+        repo.mark_attendance_bulk(f"{year + 1}-03-10", [(sid, "Absent") for sid in sids], 1)
+    repo.mark_attendance_bulk("2026-09-10", [(sid, "Present") for sid in sids], 1)
+    return repo, sids
+
+
+def test_many_archived_years_reopen(tmp_path):
+    path = tmp_path / "school.db"
+    repo, sids = marked_database(path)
+    moved = archive.archive_closed(repo, today="2026-10-18")
+    assert sorted(moved) == list(YEARS)
+    assert repo._scalar("SELECT COUNT(*) FROM attendance") == len(sids)
+    repo.close()
+
+    repo = Repository(str(path))
+    try:
+        assert len(repo.attendance_archives()) == len(YEARS)
+        rows = list(repo.iter_attendance("2000-01-01", "2030-01-01", batch_size=2))
+        assert len(rows) == (2 * len(YEARS) + 1) * len(sids)
+        assert [r[1] for r in rows] == sorted(r[1] for r in rows)
+        months = repo.attendance_months(sids[:1], "2010-08-01", "2026-12-31")
+        assert len(months) == 2 * len(YEARS) + 1
+        assert (sids[0], "2015-03", 0, 1) in months
+        # nothing is left attached between queries
+        assert [r[1] for r in repo._fetchall("PRAGMA database_list")] == ["main"]
+    finally:
+        repo.close()
+
+
+def test_report_cards_read_archived_terms(tmp_path):
+    path = tmp_path / "school.db"
+    repo, sids = marked_database(path)
+    archive.archive_closed(repo, today="2026-10-18")
+    try:
+        batch = documents.fetch_batch(repo, repo._fetchall("SELECT * FROM students WHERE id=?", (sids[0],)), ("cards",), "2014-08-01", "2015-07-31")
+        assert batch[0]["months"] == [("2014-09", 1, 1), ("2015-03", 0, 1)]
+    finally:
+        repo.close()
@@ -0,0 +1,70 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from school import db  # noqa: E402
+from school.repository import Repository  # noqa: E402
+
+
+def legacy_database(path):
+    # fees and payments as the code before the fee ledger (migration 5)
+    # left them: any payment marked the student's first open invoice paid
+    conn = db.connect(str(path))
+    for step in db.MIGRATIONS[:4]:
+        step(conn)
+    conn.execute("PRAGMA user_version = 4")
+    conn.execute("DELETE FROM students")  # the sample rows
+    for sid in (1, 2, 3, 4):
+        conn.execute("INSERT INTO students (id, first_name, admission_no) VALUES (?, 'S', ?)", (sid, f"A{sid}"))
+    conn.executemany(
+        "INSERT INTO fees (id, student_id, description, amount, due_date, status) VALUES (?,?,'Tuition',?,'2024-01-01',?)",
+        [(1, 1, 100, "paid"), (2, 1, 70, "pending"), (3, 2, 100, "paid"), (4, 3, 80, "pending"), (5, 3, 10, "paid")],
+    )
+    conn.executemany(
+        "INSERT INTO payments (fee_id, student_id, amount, method, paid_at) VALUES (?,?,?,'cash','2024-01-02')",
+        [
+            (1, 1, 30),  # settled invoice 1 although short
+            (None, 1, 20),  # no open invoice at the time: credit
+            (3, 2, 150),  # more than the invoice
+            (None, 4, 25),
+        ],
+    )
+    conn.close()
+
+
+def balances(repo):
+    return {r["student_id"]: r["balance"] for r in repo._fetchall("SELECT student_id, balance FROM balances")}
+
+
+def test_migration_and_rebuild_agree(tmp_path):
+    path = tmp_path / "school.db"
+    legacy_database(path)
+    repo = Repository(str(path))
+    try:
+        migrated = balances(repo)
+        assert migrated == {1: 50.0, 2: 0.0, 3: 80.0, 4: -25.0}
+        repo.rebuild_balances()
+        assert balances(repo) == migrated
+        repo.refresh_balances([1, 2, 3, 4])
+        assert balances(repo) == migrated
+        # settled legacy invoices are allocated in full
+        assert repo._scalar("SELECT SUM(amount) FROM payment_allocations WHERE fee_id=1") == 100
+    finally:
+        repo.close()
+
+
+def test_ledger_payments_keep_agreeing(tmp_path):
+    path = tmp_path / "school.db"
+    legacy_database(path)
+    repo = Repository(str(path))
+    try:
+        repo.record_payment(1, 80, "card")
+        repo.create_invoice(2, "Trip", 40, "2024-02-01")
+        repo.record_payment(3, 50, "cash")
+        kept = balances(repo)
+        assert kept[1] == -30.0
+        repo.rebuild_balances()
+        assert balances(repo) == kept
+    finally:
+        repo.close()
@@ -0,0 +1,108 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from school import archive, sync  # noqa: E402
+from school.repository import Repository  # noqa: E402
+
+
+def student(admission_no, first_name="Ada", cls="Grade 5"):
+    return {"first_name": first_name, "last_name": "Lovelace", "dob": "2015-01-01", "admission_no": admission_no,
+            "class": cls, "section": "A", "guardian_name": "", "phone": ""}
+
+
+@pytest.fixture
+def campuses(tmp_path):
+    # one database copied to a second campus, as the README describes
+    main = Repository(str(tmp_path / "main.db"))
+    sid = main.add_student(student("S-1"))
+    main.create_invoice(sid, "Tuition", 100, "2026-09-01")
+    main.close()
+    shutil.copy(tmp_path / "main.db", tmp_path / "north.db")
+    main, north = Repository(str(tmp_path / "main.db")), Repository(str(tmp_path / "north.db"))
+    sync.new_site(north)
+    yield main, north
+    main.close()
+    north.close()
+
+
+def send(src, dst):
+    return sync.apply_changes(dst, sync.export_changes(src, sync.site_id(dst)))
+
+
+def sid_of(repo, admission_no):
+    return repo.find_student(admission_no)["id"]
+
+
+def test_round_trip(campuses):
+    main, north = campuses
+    main.add_student(student("S-2", "Grace"))
+    north.add_student(student("S-3", "Alan"))
+    send(main, north)
+    send(north, main)
+    for repo in (main, north):
+        assert {r["admission_no"] for r in repo._fetchall("SELECT admission_no FROM students")} >= {"S-1", "S-2", "S-3"}
+    # nothing is echoed back
+    assert send(main, north)["applied"] == 0
+
+
+def test_payments_on_one_invoice_at_both_campuses(campuses):
+    main, north = campuses
+    main.record_payment(sid_of(main, "S-1"), 30, "cash")
+    north.record_payment(sid_of(north, "S-1"), 50, "card")
+    send(main, north)
+    send(north, main)
+    fees = [repo._fetchone("SELECT paid_amount, status FROM fees WHERE description='Tuition'") for repo in (main, north)]
+    assert [tuple(f) for f in fees] == [(80, "partial")] * 2
+    assert main.student_balance(sid_of(main, "S-1")) == north.student_balance(sid_of(north, "S-1")) == 20
+
+
+def test_rename_follows_the_old_admission_number(campuses):
+    main, north = campuses
+    sid = sid_of(main, "S-1")
+    main.update_student(sid, student("S-1A", "Augusta"))
+    delta = sync.export_changes(main, sync.site_id(north))
+    assert [c.get("prev") for c in delta["changes"] if c["table"] == "students"] == ["S-1"]
+    sync.apply_changes(north, delta)
+    assert north.find_student("S-1") is None
+    row = north.get_student(sid_of(north, "S-1A"))
+    assert row["first_name"] == "Augusta"
+    assert north._scalar("SELECT COUNT(*) FROM fees WHERE student_id=?", (row["id"],)) == 1
+
+
+def test_applying_a_file_twice(campuses, tmp_path):
+    main, north = campuses
+    main.record_payment(sid_of(main, "S-1"), 40, "cash")
+    path = str(tmp_path / "to-north.json.gz")
+    sync.write_delta(sync.export_changes(main, sync.site_id(north)), path)
+    assert sync.apply_changes(north, sync.read_delta(path))["applied"] > 0
+    assert sync.apply_changes(north, sync.read_delta(path)) == {"applied": 0, "conflicts": 0, "skipped": 0, "already": True}
+    assert north._scalar("SELECT COUNT(*) FROM payments") == 1
+    assert north.student_balance(sid_of(north, "S-1")) == 60
+
+
+def test_archived_marks_are_not_sent_as_deletes(campuses):
+    main, north = campuses
+    main.mark_attendance_bulk("2025-03-10", [(sid_of(main, "S-1"), "Present")], 1)
+    north.mark_attendance_bulk("2025-03-10", [(sid_of(north, "S-1"), "Present")], 1)
+    archive.archive_year(main, 2024, today="2026-10-18")
+    delta = sync.export_changes(main, sync.site_id(north))
+    assert [c for c in delta["changes"] if c["table"] == "attendance"] == []
+    sync.apply_changes(north, delta)
+    assert north._scalar("SELECT COUNT(*) FROM attendance") == 1
+
+
+def test_prune_then_export_with_an_old_since(campuses):
+    main, north = campuses
+    main.add_student(student("S-2"))
+    send(main, north)
+    assert sync.prune(main) > 0
+    with pytest.raises(ValueError, match="pruned"):
+        sync.export_changes(main, sync.site_id(north), since=0)
+    # later changes still go out from where the peer is
+    main.add_student(student("S-4"))
+    assert send(main, north)["applied"] == 1
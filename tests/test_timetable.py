@@ -0,0 +1,21 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from school import timetable  # noqa: E402
+
+
+def test_class_names_ignore_case():
+    papers = [{"class": "Grade X", "subject": "Maths"}, {"class": "grade x ", "subject": "Physics"}]
+    existing = [{"exam_date": "2026-11-02", "start_time": "09:00", "end_time": "12:00", "room": "HALL", "class": "GRADE X"}]
+    table = timetable.Timetable(papers, {"Hall": 100, "R1": 40}, ["2026-11-02", "2026-11-03"], ("09:00", "13:00"), 180, existing).solve(0.2)
+    rows = table.rows()
+    assert len(rows) == 2 and not table.unplaced
+    # never together, and never in the slot the booked GRADE X paper holds
+    assert len({(r[3], r[4]) for r in rows}) == 2
+    assert ("2026-11-02", "09:00") not in {(r[3], r[4]) for r in rows}
+
+
+def test_parse_rooms_merges_case():
+    assert timetable.parse_rooms("Hall:120, hall:150, R1:40, r1") == {"Hall": 150, "R1": 10**6}